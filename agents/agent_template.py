@@ -1,8 +1,14 @@
 import boto3
 from langchain_aws import ChatBedrock
 from langgraph.graph import StateGraph, END
-from typing import TypedDict, List
+from typing import TypedDict, List, Any
+import hashlib
 import json
+import re
+import time
+
+from .generation_profiles import DEFAULT_PROFILE
+from . import resilience, telemetry, tracing
 
 
 class AgentState(TypedDict):
@@ -11,11 +17,356 @@ class AgentState(TypedDict):
     product_data: List[dict]
     analysis: str
     recommendations: List[dict]
+    payload: Any
+    call_stats: dict
+
+
+CODE_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
 
 
-def build_agent(system_prompt):
+def parse_json_response(text):
     """
-    Build a LangGraph agent using AWS Bedrock Claude model
+    Extract the JSON payload from a model response
+    
+    Handles bare JSON, JSON wrapped in markdown code fences and JSON
+    surrounded by prose.
+    
+    Args:
+        text (str): Raw model response
+        
+    Returns:
+        The decoded JSON value, or None if no JSON value could be found
+    """
+    if not isinstance(text, str):
+        return text
+    
+    candidates = [match.strip() for match in CODE_FENCE_PATTERN.findall(text)]
+    candidates.append(text.strip())
+    
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            pass
+        # Fall back to the first decodable value inside the text
+        for start, char in enumerate(candidate):
+            if char not in '[{':
+                continue
+            try:
+                value, _ = decoder.raw_decode(candidate, start)
+                return value
+            except ValueError:
+                continue
+    return None
+
+
+def content_to_text(content):
+    """
+    Flatten message content (a string or a list of content blocks) to text
+    """
+    if isinstance(content, list):
+        return "".join(
+            block.get('text', '') if isinstance(block, dict) else str(block)
+            for block in content
+        )
+    return content or ""
+
+
+def validate_payload(payload, profile):
+    """
+    Check a decoded payload against the agent's expected response shape
+    
+    Args:
+        payload: Decoded JSON value
+        profile (GenerationProfile): Profile of the agent that produced it
+        
+    Returns:
+        The normalized payload, or None if it does not match the shape
+    """
+    if payload is None:
+        return None
+    
+    if profile.response_shape == "id_list":
+        # Tool calls wrap the list as {"ids": [...]}
+        if isinstance(payload, dict):
+            payload = payload.get("ids")
+        if not isinstance(payload, list):
+            return None
+        ids = [item.strip() for item in payload if isinstance(item, str) and item.strip()]
+        if profile.id_prefix:
+            id_pattern = re.compile(rf"{re.escape(profile.id_prefix)}\d+")
+            ids = [item for item in ids if id_pattern.fullmatch(item)]
+        if not ids:
+            return None
+        return ids[:profile.list_length]
+    
+    if profile.response_shape == "object":
+        if not isinstance(payload, dict):
+            return None
+        if any(key not in payload for key in profile.required_keys):
+            return None
+        return payload
+    
+    return payload
+
+
+def parse_agent_response(response, profile):
+    """
+    Parse and validate an agent's analysis string
+    
+    Args:
+        response: Analysis returned by a run_*_agent function (str or decoded value)
+        profile (GenerationProfile): Profile of the agent
+        
+    Returns:
+        The validated payload, or None if the response could not be used
+    """
+    return validate_payload(parse_json_response(response), profile)
+
+
+class JsonPayloadScanner:
+    """
+    Incrementally scan streamed text for complete top-level JSON values
+    
+    Text is fed in as it arrives. feed() returns the source text of the next
+    JSON array or object once its closing bracket has been read, so the
+    caller can stop the stream without waiting for trailing prose.
+    """
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+    
+    def feed(self, text=""):
+        """
+        Append text and return the next complete JSON value text, or None
+        
+        Call feed() with no arguments to keep scanning the buffered text after
+        a candidate value was rejected.
+        """
+        self.buffer += text
+        while self._pos < len(self.buffer):
+            char = self.buffer[self._pos]
+            self._pos += 1
+            
+            if self._start is None:
+                if char in '[{':
+                    self._start = self._pos - 1
+                    self._depth = 1
+                continue
+            
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            
+            if char == '"':
+                self._in_string = True
+            elif char in '[{':
+                self._depth += 1
+            elif char in ']}':
+                self._depth -= 1
+                if self._depth == 0:
+                    value = self.buffer[self._start:self._pos]
+                    self._start = None
+                    return value
+        return None
+
+
+def chunk_to_text(chunk):
+    """
+    Text carried by a streamed message chunk, including partial tool call arguments
+    """
+    text = content_to_text(chunk.content)
+    for tool_chunk in getattr(chunk, 'tool_call_chunks', None) or []:
+        text += tool_chunk.get('args') or ''
+    return text
+
+
+def add_usage(total, usage_metadata):
+    """
+    Accumulate a LangChain usage_metadata dict into a running token total
+    """
+    if not usage_metadata:
+        return total
+    total = dict(total or {"input_tokens": 0, "output_tokens": 0, "cache_read": 0, "cache_creation": 0})
+    details = usage_metadata.get('input_token_details') or {}
+    total["input_tokens"] += usage_metadata.get('input_tokens', 0) or 0
+    total["output_tokens"] += usage_metadata.get('output_tokens', 0) or 0
+    total["cache_read"] += details.get('cache_read', 0) or 0
+    total["cache_creation"] += details.get('cache_creation', 0) or 0
+    return total
+
+
+def invoke_model(llm, user_context, profile):
+    """
+    Call the model and wait for the full completion
+    
+    Args:
+        llm: Chat model
+        user_context (str): Prompt sent as the human message
+        profile (GenerationProfile): Profile of the calling agent
+        
+    Returns:
+        tuple: (raw_output, payload, call_stats)
+    """
+    start = time.perf_counter()
+    response = llm.invoke(user_context)
+    latency = time.perf_counter() - start
+    
+    # Structured output arrives as tool call arguments, plain output as text
+    if response.tool_calls:
+        raw_output = response.tool_calls[0]['args']
+    else:
+        raw_output = content_to_text(response.content)
+    
+    payload = validate_payload(parse_json_response(raw_output), profile)
+    call_stats = {
+        "latency": latency,
+        "time_to_first_token": None,
+        "time_to_payload": latency if payload is not None else None,
+        "stopped_early": False,
+        "usage": add_usage(None, getattr(response, 'usage_metadata', None))
+    }
+    return raw_output, payload, call_stats
+
+
+def stream_model(llm, user_context, profile):
+    """
+    Stream the completion and stop as soon as a valid payload has been read
+    
+    Tokens are scanned as they arrive. Once a complete JSON value matching the
+    profile's response shape is read, the stream is closed, so trailing
+    explanation text is never generated or waited for.
+    
+    Args:
+        llm: Chat model
+        user_context (str): Prompt sent as the human message
+        profile (GenerationProfile): Profile of the calling agent
+        
+    Returns:
+        tuple: (raw_output, payload, call_stats)
+    """
+    start = time.perf_counter()
+    time_to_first_token = None
+    time_to_payload = None
+    payload = None
+    usage = None
+    scanner = JsonPayloadScanner()
+    
+    stream = llm.stream(user_context)
+    try:
+        for chunk in stream:
+            usage = add_usage(usage, getattr(chunk, 'usage_metadata', None))
+            text = chunk_to_text(chunk)
+            if not text:
+                continue
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+            
+            candidate = scanner.feed(text)
+            while candidate is not None and payload is None:
+                try:
+                    payload = validate_payload(json.loads(candidate), profile)
+                except ValueError:
+                    payload = None
+                if payload is None:
+                    candidate = scanner.feed()
+            
+            if payload is not None:
+                time_to_payload = time.perf_counter() - start
+                break
+    finally:
+        # Closing the generator releases the underlying response stream
+        stream.close()
+    
+    raw_output = scanner.buffer
+    if payload is None:
+        # The stream ended without a clean value; try the lenient parser
+        payload = validate_payload(parse_json_response(raw_output), profile)
+    
+    call_stats = {
+        "latency": time.perf_counter() - start,
+        "time_to_first_token": time_to_first_token,
+        "time_to_payload": time_to_payload,
+        "stopped_early": time_to_payload is not None,
+        # Usage normally arrives with the final chunk, which early termination skips
+        "usage": usage
+    }
+    return raw_output, payload, call_stats
+
+
+def estimate_text_tokens(text):
+    """
+    Rough token count of a prompt or completion (1 token ≈ 4 characters)
+    """
+    if not isinstance(text, str):
+        text = json.dumps(text, default=str)
+    return len(text) // 4
+
+
+def build_call_event(profile, call_stats, payload, prompt_text, raw_output, retries=0):
+    """
+    Build the telemetry event for a completed model call
+    
+    Token counts come from the response usage when the model reported it,
+    otherwise they are estimated from the prompt and the text received.
+    """
+    usage = call_stats.get('usage')
+    if usage:
+        input_tokens = usage['input_tokens'] + usage['cache_read'] + usage['cache_creation']
+        output_tokens = usage['output_tokens']
+        usage_source = "response"
+        if usage['cache_read']:
+            cache_status = "prompt_cache_read"
+        elif usage['cache_creation']:
+            cache_status = "prompt_cache_write"
+        else:
+            cache_status = "miss"
+    else:
+        input_tokens = estimate_text_tokens(prompt_text)
+        output_tokens = estimate_text_tokens(raw_output)
+        usage_source = "estimated"
+        cache_status = "miss"
+    
+    return telemetry.LLMCallEvent(
+        agent=profile.name,
+        latency=call_stats['latency'],
+        time_to_first_token=call_stats['time_to_first_token'],
+        time_to_payload=call_stats['time_to_payload'],
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+        usage_source=usage_source,
+        retries=retries,
+        cache_status=cache_status,
+        outcome="parsed" if payload is not None else "fallback",
+        stopped_early=call_stats['stopped_early']
+    )
+
+
+def prompt_fingerprint(system_prompt, profile):
+    """
+    Short digest of a system prompt and its generation profile
+    
+    Used as the prompt version of cached results, so editing a prompt or its
+    output settings invalidates everything it produced.
+    """
+    hasher = hashlib.sha256(system_prompt.encode('utf-8'))
+    hasher.update(repr(profile).encode('utf-8'))
+    return hasher.hexdigest()[:16]
+
+
+def build_bedrock_llm(system_prompt, profile):
+    """
+    Create the Bedrock chat model configured by a generation profile
     """
     # Initialize Bedrock client using AWS CLI credentials
     bedrock_client = boto3.client(
@@ -23,58 +374,131 @@ def build_agent(system_prompt):
         region_name='us-east-1'
     )
 
+    model_kwargs = {
+        "max_tokens": profile.max_tokens,
+        "temperature": profile.temperature,
+        "system": system_prompt
+    }
+    if profile.stop_sequences and not profile.structured_output:
+        model_kwargs["stop_sequences"] = list(profile.stop_sequences)
+
     # Create ChatBedrock instance
     llm = ChatBedrock(
         client=bedrock_client,
         model_id='anthropic.claude-3-5-sonnet-20240620-v1:0',
-        model_kwargs={
-            "max_tokens": 100000,
-            "temperature": 0.1,
-            "system": system_prompt
-        }
+        model_kwargs=model_kwargs
     )
     
-    def analyze_data(state: AgentState):
-        """Analyze user data and generate recommendations"""
-        try:
-            # Convert any datetime objects to strings for JSON serialization
-            def serialize_data(data):
-                if isinstance(data, list):
-                    return [serialize_data(item) for item in data]
-                elif isinstance(data, dict):
-                    return {key: serialize_data(value) for key, value in data.items()}
-                elif hasattr(data, 'isoformat'):  # datetime objects
-                    return data.isoformat()
-                elif hasattr(data, '__str__') and 'Timestamp' in str(type(data)):  # pandas Timestamp
-                    return str(data)
-                else:
-                    return data
-            
-            # Serialize the data
-            serialized_user_info = serialize_data(state['user_info'])
-            serialized_transactions = serialize_data(state['transactions'][:10])
-            serialized_products = serialize_data(state['product_data'][:5])
-            
-            # Prepare input for the LLM
-            user_context = f"""
+    # Force the answer through a tool whose input schema is the expected payload
+    if profile.structured_output:
+        llm = llm.bind_tools([profile.tool_spec()], tool_choice=profile.tool_name)
+    return llm
+
+
+def serialize_data(data):
+    """
+    Convert datetime and pandas Timestamp values (at any depth) to strings for JSON serialization
+    """
+    if isinstance(data, list):
+        return [serialize_data(item) for item in data]
+    elif isinstance(data, dict):
+        return {key: serialize_data(value) for key, value in data.items()}
+    elif hasattr(data, 'isoformat'):  # datetime objects
+        return data.isoformat()
+    elif hasattr(data, '__str__') and 'Timestamp' in str(type(data)):  # pandas Timestamp
+        return str(data)
+    else:
+        return data
+
+
+def build_user_context(user_info, transactions, product_data):
+    """
+    The user message an agent sends for one request (the system prompt goes separately)
+    
+    Args:
+        user_info (dict): User information
+        transactions (list): Transaction records or projections (only the first 10 are sent)
+        product_data (list): Products to choose from (only the first 5 are sent)
+        
+    Returns:
+        str: Prompt text
+    """
+    # Serialize the data
+    serialized_user_info = serialize_data(user_info)
+    serialized_transactions = serialize_data(transactions[:10])
+    serialized_products = serialize_data(product_data[:5])
+    
+    # Prepare input for the LLM
+    return f"""
             User Information: {json.dumps(serialized_user_info, indent=2)}
             Transaction Data: {json.dumps(serialized_transactions, indent=2)}
             Available Products: {json.dumps(serialized_products, indent=2)}
             
             Please analyze the user's financial behavior and recommend suitable products.
             """
-            
-            # Get response from Claude
-            response = llm.invoke(user_context)
-            
-            # Update state with analysis
-            state['analysis'] = response.content
-            
-            return state
-            
-        except Exception as e:
-            state['analysis'] = f"Error in analysis: {str(e)}"
-            return state
+
+
+def build_agent(system_prompt, profile=DEFAULT_PROFILE, llm=None):
+    """
+    Build a LangGraph agent using AWS Bedrock Claude model
+    
+    Args:
+        system_prompt (str): System prompt for the agent
+        profile (GenerationProfile): Output token cap, stop sequences and response shape
+        llm: Optional chat model to use instead of Bedrock (e.g. the FailureInjectingLLM in helperfunctions/fake_llm.py)
+    """
+    if llm is None:
+        llm = build_bedrock_llm(system_prompt, profile)
+    
+    def analyze_data(state: AgentState):
+        """
+        Analyze user data and generate recommendations
+        
+        Every failure propagates, failed model calls as ModelCallError: a
+        caller must never mistake an error for an answer and store defaults.
+        """
+        user_context = build_user_context(state['user_info'], state['transactions'], state['product_data'])
+        
+        # Get response from Claude, retrying throttled and transient failures
+        def call_model():
+            if profile.stream:
+                return stream_model(llm, user_context, profile)
+            return invoke_model(llm, user_context, profile)
+        
+        start = time.perf_counter()
+        try:
+            with tracing.span("llm_call", agent=profile.name) as call_span:
+                (raw_output, payload, call_stats), retries = resilience.call_with_retry(call_model)
+                if call_span:
+                    call_span.set(
+                        time_to_first_token=call_stats['time_to_first_token'],
+                        time_to_payload=call_stats['time_to_payload'],
+                        retries=retries,
+                        parsed=payload is not None
+                    )
+        except resilience.ModelCallError as e:
+            telemetry.emit(telemetry.LLMCallEvent(
+                agent=profile.name,
+                latency=time.perf_counter() - start,
+                input_tokens=estimate_text_tokens(system_prompt + user_context),
+                usage_source="estimated",
+                retries=e.attempts - 1,
+                outcome="error",
+                error=str(e)
+            ))
+            raise
+        
+        state['payload'] = payload
+        state['call_stats'] = call_stats
+        telemetry.emit(build_call_event(profile, call_stats, payload, system_prompt + user_context, raw_output, retries))
+        
+        # Update state with analysis
+        if payload is not None:
+            state['analysis'] = json.dumps(payload)
+        else:
+            state['analysis'] = raw_output if isinstance(raw_output, str) else json.dumps(raw_output, default=str)
+        
+        return state
     
     # Create the agent graph
     workflow = StateGraph(AgentState)
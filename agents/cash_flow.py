@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+
+# Income is recorded as negative amounts in these categories
+INCOME_PREFIX = "INCOME_"
+
+# Positive amounts in these categories move money between the user's accounts rather than spend it
+TRANSFER_PREFIX = "TRANSFER_"
+
+# Transfers out of the account: savings and investment contributions
+SAVED_PREFIX = "TRANSFER_OUT_"
+
+
+def cash_flow(categories, amounts):
+    """
+    Income, spending and amount saved of every transaction
+
+    The one definition shared by the feature store, spending tags and agent
+    projections, so their totals agree for the same user and month.
+
+    Args:
+        categories (pd.Series): Txn Category values
+        amounts (pd.Series): Txn Amount values (non-numeric amounts count as 0)
+
+    Returns:
+        tuple: (income, spend, saved) np.ndarrays, one value per transaction
+    """
+    categories = categories.astype(str)
+    amounts = pd.to_numeric(amounts, errors='coerce').fillna(0.0).to_numpy(dtype=float)
+    is_income = categories.str.startswith(INCOME_PREFIX).to_numpy()
+    is_transfer = categories.str.startswith(TRANSFER_PREFIX).to_numpy()
+    is_saved = categories.str.startswith(SAVED_PREFIX).to_numpy()
+    outflow = ~is_income & (amounts > 0)
+
+    income = np.where(is_income & (amounts < 0), -amounts, 0.0)
+    spend = np.where(outflow & ~is_transfer, amounts, 0.0)
+    saved = np.where(outflow & is_saved, amounts, 0.0)
+    return income, spend, saved
@@ -1,7 +1,9 @@
-from .agent_template import build_agent, AgentState
+from .agent_template import build_agent, AgentState, prompt_fingerprint
+from .generation_profiles import GENERATION_PROFILES
+from . import tracing
 
-def run_coupons_agent(user_info, transaction_data, coupons_data):
-    system_prompt = """
+
+system_prompt = """
     You are a coupon recommendation agent. Analyze the user's transaction history and recommend the top 3 coupons that best match their spending patterns.
     
     Consider:
@@ -12,8 +14,14 @@ def run_coupons_agent(user_info, transaction_data, coupons_data):
     
     Return ONLY a simple JSON array of the top 3 coupon IDs, like: ["CO1", "CO2", "CO3"]
     """
-    
-    agent = build_agent(system_prompt)
+
+# Identifies the prompt and output settings that produced stored recommendations
+PROMPT_VERSION = prompt_fingerprint(system_prompt, GENERATION_PROFILES["coupons"])
+
+
+@tracing.traced("coupons_agent")
+def run_coupons_agent(user_info, transaction_data, coupons_data):
+    agent = build_agent(system_prompt, GENERATION_PROFILES["coupons"])
     
     # Prepare state
     state = AgentState(
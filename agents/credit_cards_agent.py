@@ -1,7 +1,10 @@
-from .agent_template import build_agent, AgentState
+from .agent_template import build_agent, AgentState, prompt_fingerprint
+from .generation_profiles import GENERATION_PROFILES
+from .product_catalog import canonical_id, product_id
+from . import tracing
 
-def run_credit_cards_agent(user_info, transaction_data, credit_cards_data, user_card_ids=None):
-    system_prompt = """
+
+system_prompt = """
     You are a credit card recommendation agent. Analyze the user's spending patterns and recommend 3 credit cards that best match their lifestyle.
     
     Consider:
@@ -13,14 +16,21 @@ def run_credit_cards_agent(user_info, transaction_data, credit_cards_data, user_
     
     Return ONLY a simple JSON array of the top 3 card IDs, like: ["CC1", "CC2", "CC3"]
     """
-    
+
+# Identifies the prompt and output settings that produced stored recommendations
+PROMPT_VERSION = prompt_fingerprint(system_prompt, GENERATION_PROFILES["credit_cards"])
+
+
+@tracing.traced("credit_cards_agent")
+def run_credit_cards_agent(user_info, transaction_data, credit_cards_data, user_card_ids=None):
     # Filter out cards user already has
     if user_card_ids:
-        filtered_cards = [card for card in credit_cards_data if card.get('Card_id') not in user_card_ids]
+        owned = {canonical_id(card_id) for card_id in user_card_ids}
+        filtered_cards = [card for card in credit_cards_data if product_id(card, 'credit_cards') not in owned]
     else:
         filtered_cards = credit_cards_data
     
-    agent = build_agent(system_prompt)
+    agent = build_agent(system_prompt, GENERATION_PROFILES["credit_cards"])
     
     # Prepare state
     state = AgentState(
@@ -1,46 +1,155 @@
-from .agent_template import build_agent, AgentState
+import hashlib
+import json
+import re
+import threading
+from .agent_template import build_agent, AgentState, prompt_fingerprint, estimate_token_size, parse_agent_response
 from .email_notification_agent_prompts.v6 import system_prompt
+from .email_notification_agent_prompts.segment_v1 import system_prompt as segment_system_prompt
+from .generation_profiles import GENERATION_PROFILES
+from .product_catalog import ProductCatalog
+from . import telemetry, tracing
 
-def generate_email_notifications(user_info, top_recommendations, monthly_summaries, product_data):
+# Identifies the prompt and output settings that produced stored email subjects
+PROMPT_VERSION = prompt_fingerprint(system_prompt, GENERATION_PROFILES["email_notification"])
+SEGMENT_PROMPT_VERSION = prompt_fingerprint(segment_system_prompt, GENERATION_PROFILES["email_notification"])
+
+PLACEHOLDER_PATTERN = re.compile(r'\{(\w+)\}')
+
+
+# Approximate token budget for the email agent's input context
+EMAIL_CONTEXT_TOKEN_BUDGET = 600
+
+# Fields of each top product that subject lines draw on, most important first
+EMAIL_PRODUCT_FIELDS = {
+    'top_coupon': ('key_feature', 'urgency', 'product_category'),
+    'top_loan': ('key_feature', 'loan_type', 'loan_range'),
+    'top_credit_card': ('key_feature', 'card_name', 'annual_fee'),
+    'top_savings': ('key_feature', 'account_name', 'minimum'),
+}
+
+# (recommendation key, product_details key, catalog key) of each top product
+TOP_PRODUCT_KEYS = (
+    ('coupons', 'top_coupon', 'coupons'),
+    ('loans', 'top_loan', 'loans'),
+    ('credit_cards', 'top_credit_card', 'credit_cards'),
+    ('high_yield_savings', 'top_savings', 'savings'),
+)
+
+
+def _keep_product_fields(count):
+    def trim(context):
+        context['products'] = [
+            {key: value for i, (key, value) in enumerate(product.items()) if i <= count}
+            for product in context['products']
+        ]
+    return trim
+
+
+def _drop_month_field(name):
+    def trim(context):
+        context['latest_month'].pop(name, None)
+    return trim
+
+
+# Applied in order until the context fits the token budget
+CONTEXT_TRIMS = (
+    _drop_month_field('top_merchants'),
+    _drop_month_field('key_highlights'),
+    _keep_product_fields(2),
+    _drop_month_field('top_categories'),
+    _keep_product_fields(1),
+)
+
+
+def build_email_context(user_info, product_details, spending_insights, user_financial_profile, spending_tags=None,
+                        token_budget=EMAIL_CONTEXT_TOKEN_BUDGET):
     """
-    Generate creative email notifications for all product recommendations and monthly summary
+    Build the small context subject lines need: who the user is, the latest month's
+    key numbers and the key features of each top product
     
     Args:
         user_info (dict): User information
-        top_recommendations (dict): Top recommendations from each product agent
-        monthly_summaries (list): Monthly financial analysis data
-        product_data (dict): All product data for context lookup
+        product_details (dict): Enhanced details of each top product (top_coupon, top_loan, ...)
+        spending_insights (dict): Output of extract_spending_insights
+        user_financial_profile (dict): Output of create_user_financial_profile
+        spending_tags (list): The latest month's spending tags
+        token_budget (int): Approximate token limit; optional details are dropped to stay under it
     
     Returns:
-        dict: Creative email subjects for each category
+        dict: {"user": ..., "latest_month": ..., "products": [...]}
     """
+    user = {
+        "first_name": str(user_info.get('User_name', '')).split(' ')[0],
+        "age": user_info.get('Age', 0),
+        "financial_goals": user_info.get('Financial_goals', ''),
+        "credit_tier": user_financial_profile.get('credit_tier'),
+        "life_stage": user_financial_profile.get('life_stage'),
+        "spending_style": user_financial_profile.get('spending_style'),
+        "savings_priority": user_financial_profile.get('savings_priority')
+    }
     
-    agent = build_agent(system_prompt)
-    
-    # Prepare comprehensive context for the agent with enhanced details
-    spending_insights = extract_spending_insights(monthly_summaries)
-    user_financial_profile = create_user_financial_profile(user_info, monthly_summaries)
-    
-    context_data = {
-        "user_info": user_info,
-        "user_financial_profile": user_financial_profile,
-        "spending_insights": spending_insights,
-        "top_recommendations": top_recommendations,
-        "monthly_summaries": monthly_summaries,
-        "product_details": product_data,
-        "personalization_context": {
-            "first_name": user_info.get('User_name', '').split(' ')[0],
-            "credit_score": user_info.get('Credit_score', 0),
-            "financial_goals": user_info.get('Financial_goals', ''),
-            "age": user_info.get('Age', 0)
-        }
+    latest_month = {
+        "month": spending_insights.get('latest_month_year'),
+        "total_income": spending_insights.get('total_income'),
+        "total_spending": spending_insights.get('total_spending'),
+        "spending_ratio": spending_insights.get('spending_ratio'),
+        "savings_potential": spending_insights.get('savings_potential'),
+        "spending_tags": spending_tags or [],
+        "top_categories": {name: amount for name, amount in spending_insights.get('top_categories', [])},
+        "top_merchants": spending_insights.get('top_merchants', []),
+        "key_highlights": spending_insights.get('key_highlights', [])
     }
+    latest_month = {key: value for key, value in latest_month.items() if value not in (None, [], {})}
+    
+    products = []
+    for name, fields in EMAIL_PRODUCT_FIELDS.items():
+        details = product_details.get(name)
+        if not details:
+            continue
+        product = {"product": name}
+        product.update({field: details[field] for field in fields if details.get(field) not in (None, '')})
+        products.append(product)
+    
+    context = {"user": user, "latest_month": latest_month, "products": products}
+    for trim in CONTEXT_TRIMS:
+        if estimate_token_size(context) <= token_budget:
+            break
+        trim(context)
+    else:
+        if estimate_token_size(context) > token_budget:
+            print(f"Warning: email context is ~{estimate_token_size(context)} tokens, over the {token_budget} token budget")
     
-    # Prepare state
+    return context
+
+
+def email_agent_inputs(email_context):
+    """
+    Agent inputs of a per-user email request: user profile, the latest month as the only "transaction" record, and the top products
+    
+    Returns:
+        tuple: (user_info, transactions, product_data)
+    """
+    return email_context['user'], [email_context['latest_month']], email_context['products']
+
+
+def generate_email_notifications(email_context):
+    """
+    Generate creative email notifications for all product recommendations and monthly summary
+    
+    Args:
+        email_context (dict): Context from build_email_context
+    
+    Returns:
+        dict: Creative email subjects for each category
+    """
+    
+    agent = build_agent(system_prompt, GENERATION_PROFILES["email_notification"])
+    
+    user, transactions, products = email_agent_inputs(email_context)
     state = AgentState(
-        user_info=user_info,
-        transactions=[],  # Not needed for email generation
-        product_data=[context_data],  # Pass all context as product_data
+        user_info=user,
+        transactions=transactions,
+        product_data=products,
         analysis="",
         recommendations=[]
     )
@@ -50,60 +159,211 @@ def generate_email_notifications(user_info, top_recommendations, monthly_summari
     return result['analysis']
 
 
-def get_top_product_details(product_id, product_list, product_type):
+def prepare_email_context(user_info, product_recommendations, monthly_summaries, all_product_data, features=None):
     """
-    Helper function to get enhanced details of a specific product by ID
+    Look up the top product of each agent and build the email agent's context
     
     Args:
-        product_id (str): Product ID to lookup
-        product_list (list): List of products 
-        product_type (str): Type of product (for ID field mapping)
+        user_info (dict): User information
+        product_recommendations (dict): Recommendations from each agent
+        monthly_summaries (list): Monthly financial summaries  
+        all_product_data (ProductCatalog): Product catalog for context lookup (a plain dict is indexed on the fly)
+        features (dict): Latest month's feature vector from the feature store, if available
     
     Returns:
-        dict: Enhanced product details with extracted key features
+        dict: Context from build_email_context
     """
-    id_field_map = {
-        'coupons': 'coupon_id',
-        'loans': 'loan_id', 
-        'credit_cards': 'card_id',
-        'savings': 'id'
+    # Extract top recommendations (first item from each list)
+    top_recommendations = {}
+    for product_type, rec_list in product_recommendations.items():
+        if rec_list and len(rec_list) > 0:
+            top_recommendations[product_type] = rec_list[0]
+    
+    # Get detailed info for each top recommendation
+    catalog = ProductCatalog.ensure(all_product_data)
+    product_details = {}
+    for rec_key, detail_key, product_type in TOP_PRODUCT_KEYS:
+        if rec_key in top_recommendations:
+            product_details[detail_key] = catalog.details(product_type, top_recommendations[rec_key])
+    
+    spending_insights = extract_spending_insights(monthly_summaries, features)
+    user_financial_profile = create_user_financial_profile(user_info, monthly_summaries, features)
+    spending_tags = monthly_summaries[-1].get('spending_tags') if monthly_summaries else None
+    
+    email_context = build_email_context(user_info, product_details, spending_insights, user_financial_profile, spending_tags)
+    
+    # Fields shared by every user who can receive the same subject templates
+    top_categories = spending_insights.get('top_categories') or []
+    email_context['segment'] = {
+        "credit_tier": user_financial_profile.get('credit_tier'),
+        "life_stage": user_financial_profile.get('life_stage'),
+        "top_category": top_categories[0][0] if top_categories else None,
+        "top_product_ids": top_recommendations,
+        "products": email_context['products']
     }
+    return email_context
+
+
+# Segment fields that identify it; "products" is left out because it is trimmed to each user's token budget
+SEGMENT_KEY_FIELDS = ("credit_tier", "life_stage", "top_category", "top_product_ids")
+
+
+def segment_key(segment):
+    """
+    Stable key of an email segment: its traits and untrimmed top product IDs
+    """
+    payload = json.dumps({field: segment.get(field) for field in SEGMENT_KEY_FIELDS}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def segment_agent_inputs(segment):
+    """
+    Agent inputs of a segment template request: the segment's traits and products, no transactions
+    
+    Returns:
+        tuple: (user_info, transactions, product_data)
+    """
+    return {key: segment[key] for key in ("credit_tier", "life_stage", "top_category")}, [], segment['products']
+
+
+def generate_segment_templates(segment):
+    """
+    Generate subject templates with placeholders for every user of a segment
+    
+    Args:
+        segment (dict): The "segment" entry of an email context
+    
+    Returns:
+        str: The agent's analysis (JSON object of templates)
+    """
+    agent = build_agent(segment_system_prompt, GENERATION_PROFILES["email_notification"])
     
-    id_field = id_field_map.get(product_type, 'id')
-    
-    for product in product_list:
-        if product.get(id_field) == product_id:
-            enhanced_product = product.copy()
-            
-            # Add extracted key features based on product type
-            if product_type == 'coupons':
-                enhanced_product['key_feature'] = f"{product.get('discount_percentage', '')} off at {product.get('merchant_name', '')}"
-                enhanced_product['urgency'] = product.get('expiry_date', '')
-                
-            elif product_type == 'loans':
-                rate_range = product.get('interest_rate_range', '')
-                enhanced_product['key_feature'] = f"{rate_range} APR from {product.get('bank_name', '')}"
-                enhanced_product['loan_range'] = f"${product.get('minimum_amount', '')}-${product.get('maximum_amount', '')}"
-                
-            elif product_type == 'credit_cards':
-                welcome_bonus = product.get('welcome_bonus', '')
-                rewards_rate = product.get('rewards_rate', '')
-                enhanced_product['key_feature'] = welcome_bonus or rewards_rate
-                enhanced_product['issuer'] = product.get('issuer', '')
-                enhanced_product['annual_fee'] = product.get('annual_fee', '$0')
-                
-            elif product_type == 'savings':
-                apy = product.get('apy', product.get('interest_rate', ''))
-                bank = product.get('bank_name', product.get('institution', ''))
-                enhanced_product['key_feature'] = f"{apy} APY at {bank}"
-                enhanced_product['minimum'] = product.get('minimum_balance', '$0')
-            
-            return enhanced_product
-    
-    return {}
-
-
-def run_email_notification_agent(user_info, product_recommendations, monthly_summaries, all_product_data):
+    traits, transactions, products = segment_agent_inputs(segment)
+    state = AgentState(
+        user_info=traits,
+        transactions=transactions,
+        product_data=products,
+        analysis="",
+        recommendations=[]
+    )
+    
+    result = agent.invoke(state)
+    return result['analysis']
+
+
+def fill_templates(templates, email_context):
+    """
+    Replace the placeholders of segment templates with one user's values
+    
+    Args:
+        templates (dict): Email key -> template text
+        email_context (dict): The user's context from prepare_email_context
+    
+    Returns:
+        dict: Email key -> subject line
+    """
+    user = email_context['user']
+    month = email_context['latest_month']
+    top_category = email_context.get('segment', {}).get('top_category')
+    
+    def dollars(value):
+        return f"${value:,.0f}" if isinstance(value, (int, float)) else ""
+    
+    values = {
+        "first_name": user.get('first_name', ''),
+        "financial_goal": str(user.get('financial_goals', '')).lower(),
+        "total_spending": dollars(month.get('total_spending')),
+        "spending_ratio": f"{month['spending_ratio']:.0f}%" if isinstance(month.get('spending_ratio'), (int, float)) else "",
+        "savings_potential": dollars(month.get('savings_potential')),
+        "top_category": str(top_category or '').replace('_', ' ')
+    }
+    
+    def substitute(match):
+        return values.get(match.group(1), match.group(0))
+    
+    filled = {}
+    for key, template in templates.items():
+        text = PLACEHOLDER_PATTERN.sub(substitute, str(template))
+        filled[key] = re.sub(r'\s+([,.!?])', r'\1', re.sub(r'\s{2,}', ' ', text)).strip()
+    return filled
+
+
+class _TemplateCache:
+    """
+    In-process template cache used when no run store is given
+    """
+    def __init__(self):
+        self._templates = {}
+    
+    def get_email_templates(self, key, prompt_version):
+        return self._templates.get((key, prompt_version))
+    
+    def put_email_templates(self, key, prompt_version, templates):
+        self._templates[(key, prompt_version)] = templates
+
+
+_memory_templates = _TemplateCache()
+# Segment key -> [lock, number of threads holding or waiting for it]
+_segment_locks = {}
+_segment_locks_guard = threading.Lock()
+
+
+def _acquire_segment_lock(key):
+    """
+    The segment's lock, registered as in use until _release_segment_lock(key)
+    """
+    with _segment_locks_guard:
+        entry = _segment_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+        return entry[0]
+
+
+def _release_segment_lock(key):
+    # Drop the lock once no thread holds or waits for it, so every waiter shares one lock object
+    with _segment_locks_guard:
+        entry = _segment_locks[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _segment_locks[key]
+
+
+def segment_email_notifications(email_context, template_store=None):
+    """
+    Subjects filled from the segment's cached templates, generating them on the first miss
+    
+    Args:
+        email_context (dict): The user's context from prepare_email_context
+        template_store: Object with get_email_templates/put_email_templates (e.g. RunStore);
+            an in-process cache is used when None
+    
+    Returns:
+        str: JSON object of email subjects (or the raw analysis if the templates could not be parsed)
+    """
+    store = template_store or _memory_templates
+    key = segment_key(email_context['segment'])
+    
+    # One model call per segment, even when users of the same segment are processed concurrently
+    lock = _acquire_segment_lock(key)
+    try:
+        with lock:
+            templates = store.get_email_templates(key, SEGMENT_PROMPT_VERSION)
+            if templates is None:
+                raw_templates = generate_segment_templates(email_context['segment'])
+                templates = parse_agent_response(raw_templates, GENERATION_PROFILES["email_notification"])
+                if templates is None:
+                    return raw_templates
+                store.put_email_templates(key, SEGMENT_PROMPT_VERSION, templates)
+            else:
+                telemetry.record_cache_hit('email_notification', cache_status="segment")
+    finally:
+        _release_segment_lock(key)
+    
+    return json.dumps(fill_templates(templates, email_context))
+
+
+@tracing.traced("email_notification_agent")
+def run_email_notification_agent(user_info, product_recommendations, monthly_summaries, all_product_data, features=None,
+                                 email_context=None, segment_mode=False, template_store=None):
     """
     Main function to run the email notification agent
     
@@ -111,74 +371,43 @@ def run_email_notification_agent(user_info, product_recommendations, monthly_sum
         user_info (dict): User information
         product_recommendations (dict): Top recommendations from each agent
         monthly_summaries (list): Monthly financial summaries  
-        all_product_data (dict): All product data for context lookup
+        all_product_data (ProductCatalog): Product catalog for context lookup (a plain dict is indexed on the fly)
+        features (dict): Latest month's feature vector from the feature store, if available
+        email_context (dict): Context already built with prepare_email_context, if any
+        segment_mode (bool): Fill cached per-segment templates instead of calling the model per user
+        template_store: Template cache for segment mode (e.g. RunStore)
     
     Returns:
         dict: Email notification subjects
     """
-    # Extract top recommendations (first item from each list)
-    top_recommendations = {}
-    for product_type, rec_list in product_recommendations.items():
-        if rec_list and len(rec_list) > 0:
-            top_recommendations[product_type] = rec_list[0]
-    
-    # Get detailed info for each top recommendation
-    product_details = {}
-    
-    if 'coupons' in top_recommendations:
-        product_details['top_coupon'] = get_top_product_details(
-            top_recommendations['coupons'], 
-            all_product_data.get('coupons', []), 
-            'coupons'
+    if email_context is None:
+        email_context = prepare_email_context(
+            user_info,
+            product_recommendations,
+            monthly_summaries,
+            all_product_data,
+            features
         )
     
-    if 'loans' in top_recommendations:
-        product_details['top_loan'] = get_top_product_details(
-            top_recommendations['loans'],
-            all_product_data.get('loans', []),
-            'loans'
-        )
-        
-    if 'credit_cards' in top_recommendations:
-        product_details['top_credit_card'] = get_top_product_details(
-            top_recommendations['credit_cards'],
-            all_product_data.get('credit_cards', []),
-            'credit_cards'
-        )
-        
-    if 'high_yield_savings' in top_recommendations:
-        product_details['top_savings'] = get_top_product_details(
-            top_recommendations['high_yield_savings'],
-            all_product_data.get('savings', []),
-            'savings'
-        )
+    if segment_mode:
+        return segment_email_notifications(email_context, template_store)
     
     # Run the notification agent
-    email_notifications = generate_email_notifications(
-        user_info, 
-        top_recommendations,
-        monthly_summaries,
-        product_details
-    )
+    email_notifications = generate_email_notifications(email_context)
     
     return email_notifications
 
 
-def extract_spending_insights(monthly_summaries):
+def insights_from_summary(latest_month):
     """
-    Extract key spending insights and patterns from monthly summaries
+    Spending numbers parsed from a monthly summary written by the model
     
     Args:
-        monthly_summaries (list): List of monthly financial data
+        latest_month (dict): Most recent monthly summary
     
     Returns:
-        dict: Key spending insights and trends
+        dict: Spending insights without highlights
     """
-    if not monthly_summaries:
-        return {}
-    
-    latest_month = monthly_summaries[-1] if monthly_summaries else {}
-    
     # Safe conversion functions
     def safe_float(value):
         try:
@@ -218,6 +447,45 @@ def extract_spending_insights(monthly_summaries):
     # Sort categories by amount
     sorted_categories = sorted(category_amounts.items(), key=lambda x: x[1], reverse=True)[:3]
     insights["top_categories"] = sorted_categories
+    return insights
+
+
+def extract_spending_insights(monthly_summaries, features=None):
+    """
+    Extract key spending insights and patterns from monthly summaries
+    
+    Args:
+        monthly_summaries (list): List of monthly financial data
+        features (dict): Latest month's feature vector; its numbers are used
+            instead of parsing the amounts written by the summary model
+    
+    Returns:
+        dict: Key spending insights and trends
+    """
+    if not monthly_summaries and not features:
+        return {}
+    
+    latest_month = monthly_summaries[-1] if monthly_summaries else {}
+    
+    if features:
+        month_year = features['month_year']
+        category_amounts = {
+            name[len('spend_'):]: value for name, value in features.items()
+            if name.startswith('spend_') and name != 'spend_investing' and value > 0
+        }
+        insights = {
+            "latest_month_year": f"{month_year[5:]}/{month_year[:4]}",
+            "total_spending": round(features['spending'], 2),
+            "total_income": round(features['income'], 2),
+            "spending_ratio": round(features['spending_ratio'], 2),
+            "top_categories": sorted(category_amounts.items(), key=lambda x: x[1], reverse=True)[:3],
+            "top_merchants": [features[name] for name in sorted(features)
+                              if name.startswith('top_merchant_') and name != 'top_merchant_share' and features[name]],
+            "savings_potential": 0,
+            "key_highlights": []
+        }
+    else:
+        insights = insights_from_summary(latest_month)
     
     # Calculate savings potential (income - spending)
     insights["savings_potential"] = insights["total_income"] - insights["total_spending"]
@@ -226,7 +494,6 @@ def extract_spending_insights(monthly_summaries):
     ai_summary = latest_month.get('ai_summary', '')
     if ai_summary:
         # Extract key numbers and percentages
-        import re
         percentages = re.findall(r'(\d+\.?\d*)%', ai_summary)
         dollar_amounts = re.findall(r'\$(\d+[,\d]*\.?\d*)', ai_summary)
         
@@ -238,13 +505,14 @@ def extract_spending_insights(monthly_summaries):
     return insights
 
 
-def create_user_financial_profile(user_info, monthly_summaries):
+def create_user_financial_profile(user_info, monthly_summaries, features=None):
     """
     Create a comprehensive financial profile for personalized recommendations
     
     Args:
         user_info (dict): User information
         monthly_summaries (list): Monthly spending data
+        features (dict): Latest month's feature vector, preferred for the spending ratio
     
     Returns:
         dict: User financial profile for personalization
@@ -290,7 +558,10 @@ def create_user_financial_profile(user_info, monthly_summaries):
         profile["savings_priority"] = "debt_focused"
     
     # Analyze spending patterns if available
-    if monthly_summaries:
+    spending_ratio = None
+    if features:
+        spending_ratio = features['spending_ratio']
+    elif monthly_summaries:
         latest = monthly_summaries[-1].get('categories_expenses', {})
         spending_ratio_raw = latest.get('total_spending_%', 0)
         
@@ -301,7 +572,8 @@ def create_user_financial_profile(user_info, monthly_summaries):
             spending_ratio = float(spending_ratio_raw)
         except (ValueError, TypeError):
             spending_ratio = 0
-        
+    
+    if spending_ratio is not None:
         if spending_ratio > 80:
             profile["spending_style"] = "high_spender"
         elif spending_ratio < 50:
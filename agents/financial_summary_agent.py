@@ -1,7 +1,9 @@
-from .agent_template import build_agent, AgentState
+from .agent_template import build_agent, AgentState, prompt_fingerprint
+from .generation_profiles import GENERATION_PROFILES
+from . import tracing
 
-def summarize_user(user_info, monthly_data):
-    system_prompt = """
+
+system_prompt = """
     You are a financial summary agent. Generate a comprehensive monthly summary of the user's spending behavior and provide actionable suggestions to achieve their financial goals.
     
     Analyze the monthly transaction data and return a JSON object with the following structure:
@@ -9,7 +11,6 @@ def summarize_user(user_info, monthly_data):
         "month": "01",
         "year": "2023", 
         "ai_summary": "Brief AI-generated summary of spending patterns and recommendations",
-        "spending_tags": ["tag1", "tag2"],
         "categories_expenses": {
             "total_income": "dollar_amount",
             "food": "dollar_amount",
@@ -31,26 +32,17 @@ def summarize_user(user_info, monthly_data):
     - Suggest budget optimization opportunities
     - Generate the summary as if you are telling to the user. For example: "You are spending this much in this category. You need to minimize this spending" etc.
     - Keep the summary short and informative so that the user will not get bored after reading this.
-    - Assign exactly two spending behavior tags based on the user's highest spending categories and patterns. Choose from tags like:
-      - "Foodie" (high food/dining spending)
-      - "Shopaholic" (high shopping/merchandise spending)
-      - "Travel Enthusiast" (high travel spending)
-      - "Entertainment Buff" (high entertainment spending)
-      - "Home-Centered" (high housing/utilities spending)
-      - "Budget Master" (well-balanced spending)
-      - "Saver" (low overall spending relative to income)
-      - "Investor" (investment-focused spending)
-      - "Health Conscious" (high health/wellness spending)
-      - "Education Focused" (high education spending)
-      - "Family First" (family-oriented spending)
-      - "Tech Enthusiast" (high technology spending)
-      - "Commuter" (high transportation spending)
-      - Or create your own based on the unique spending pattern
     
     Return ONLY valid JSON, no other text.
     """
-    
-    agent = build_agent(system_prompt)
+
+# Identifies the prompt and output settings that produced a stored summary
+PROMPT_VERSION = prompt_fingerprint(system_prompt, GENERATION_PROFILES["financial_summary"])
+
+
+@tracing.traced("financial_summary_agent")
+def summarize_user(user_info, monthly_data):
+    agent = build_agent(system_prompt, GENERATION_PROFILES["financial_summary"])
     
     # Prepare state
     state = AgentState(
@@ -0,0 +1,127 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    """
+    Output settings for a single agent
+
+    Attributes:
+        name (str): Agent name, also used to name the structured output tool
+        max_tokens (int): Output token cap for one call
+        response_shape (str): "id_list" for the recommendation agents, "object" for JSON objects, "any" to skip validation
+        schema (dict): JSON schema of the expected payload
+        stop_sequences (tuple): Stop sequences used when structured output is disabled
+        structured_output (bool): If True, force the model to answer through a tool call
+        id_prefix (str): Expected product ID prefix for id_list profiles (e.g. "CO")
+        list_length (int): Number of IDs expected for id_list profiles
+        temperature (float): Sampling temperature
+        required_keys (tuple): Keys an "object" payload must contain
+        stream (bool): If True, stream the response and stop once the payload closes
+    """
+    name: str
+    max_tokens: int
+    response_shape: str
+    schema: dict
+    stop_sequences: tuple = ()
+    structured_output: bool = True
+    id_prefix: str = ""
+    list_length: int = 3
+    temperature: float = 0.1
+    required_keys: tuple = ()
+    stream: bool = False
+
+    @property
+    def tool_name(self):
+        return f"submit_{self.name}"
+
+    def tool_spec(self):
+        """
+        Anthropic tool definition used to force structured output
+        """
+        return {
+            "name": self.tool_name,
+            "description": f"Submit the final {self.name} result.",
+            "input_schema": self.schema
+        }
+
+
+def _id_list_profile(name, id_prefix, max_tokens=128):
+    """
+    Build the profile of a recommendation agent that returns three product IDs
+    """
+    return GenerationProfile(
+        name=name,
+        max_tokens=max_tokens,
+        response_shape="id_list",
+        schema={
+            "type": "object",
+            "properties": {
+                "ids": {
+                    "type": "array",
+                    "items": {"type": "string", "pattern": f"^{id_prefix}[0-9]+$"},
+                    "minItems": 3,
+                    "maxItems": 3
+                }
+            },
+            "required": ["ids"]
+        },
+        stop_sequences=("\n\n",),
+        id_prefix=id_prefix,
+        stream=True
+    )
+
+
+MONTHLY_SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "month": {"type": "string"},
+        "year": {"type": "string"},
+        "ai_summary": {"type": "string"},
+        "categories_expenses": {"type": "object", "additionalProperties": {"type": "string"}}
+    },
+    "required": ["month", "year", "ai_summary", "categories_expenses"]
+}
+
+EMAIL_SUBJECTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "spending_summary_email": {"type": "string"},
+        "coupons_email": {"type": "string"},
+        "loans_email": {"type": "string"},
+        "credit_cards_email": {"type": "string"},
+        "savings_email": {"type": "string"}
+    },
+    "required": ["spending_summary_email", "coupons_email", "loans_email", "credit_cards_email", "savings_email"]
+}
+
+
+GENERATION_PROFILES = {
+    "coupons": _id_list_profile("coupons", "CO"),
+    "loans": _id_list_profile("loans", "LN"),
+    "credit_cards": _id_list_profile("credit_cards", "CC"),
+    "savings": _id_list_profile("savings", "HY"),
+    "financial_summary": GenerationProfile(
+        name="financial_summary",
+        max_tokens=1024,
+        response_shape="object",
+        schema=MONTHLY_SUMMARY_SCHEMA,
+        required_keys=tuple(MONTHLY_SUMMARY_SCHEMA["required"])
+    ),
+    "email_notification": GenerationProfile(
+        name="email_notification",
+        max_tokens=512,
+        response_shape="object",
+        schema=EMAIL_SUBJECTS_SCHEMA,
+        required_keys=tuple(EMAIL_SUBJECTS_SCHEMA["required"])
+    ),
+}
+
+# Used by build_agent when no profile is given
+DEFAULT_PROFILE = GenerationProfile(
+    name="default",
+    max_tokens=4096,
+    response_shape="any",
+    schema={"type": "object"},
+    structured_output=False
+)
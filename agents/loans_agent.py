@@ -1,7 +1,9 @@
-from .agent_template import build_agent, AgentState
+from .agent_template import build_agent, AgentState, prompt_fingerprint
+from .generation_profiles import GENERATION_PROFILES
+from . import tracing
 
-def run_loans_agent(user_info, transaction_data, loans_data):
-    system_prompt = """
+
+system_prompt = """
     You are a loan recommendation agent. Analyze the user's financial profile and recommend the top 3 loans that best suit their needs.
     
     Consider:
@@ -13,8 +15,14 @@ def run_loans_agent(user_info, transaction_data, loans_data):
 
     Return ONLY a simple JSON array of the top 3 loan IDs, like: ["LN1", "LN2", "LN3"]
     """
-    
-    agent = build_agent(system_prompt)
+
+# Identifies the prompt and output settings that produced stored recommendations
+PROMPT_VERSION = prompt_fingerprint(system_prompt, GENERATION_PROFILES["loans"])
+
+
+@tracing.traced("loans_agent")
+def run_loans_agent(user_info, transaction_data, loans_data):
+    agent = build_agent(system_prompt, GENERATION_PROFILES["loans"])
     
     # Prepare state
     state = AgentState(
@@ -0,0 +1,160 @@
+import math
+from collections.abc import Mapping
+
+
+# Canonical ID field of each product catalog
+ID_FIELDS = {
+    'coupons': 'coupon_id',
+    'loans': 'loan_id',
+    'credit_cards': 'card_id',
+    'savings': 'id',
+}
+
+
+def canonical_id(value):
+    """
+    Normalize a product ID for lookups ("co1 " -> "CO1")
+    """
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return str(value).strip().upper()
+
+
+def product_id(product, product_type):
+    """
+    ID of a catalog record, accepting case variants of the ID field (card_id / Card_id)
+
+    Args:
+        product (dict): Catalog record
+        product_type (str): Catalog key
+
+    Returns:
+        str: Canonical ID, or None if the record has no ID
+    """
+    id_field = ID_FIELDS.get(product_type, 'id')
+    if id_field in product:
+        return canonical_id(product[id_field])
+    for key, value in product.items():
+        if str(key).lower() == id_field:
+            return canonical_id(value)
+    return None
+
+
+def _text(value, default=''):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return default
+    return str(value).strip()
+
+
+def _amount(value):
+    return _text(value).lstrip('$')
+
+
+def derive_details(product, product_type):
+    """
+    Fields the email agent uses to describe a product, derived from its catalog record
+
+    Returns:
+        dict: Copy of the record with key_feature and type-specific summary fields
+    """
+    details = dict(product)
+
+    if product_type == 'coupons':
+        discount = _text(product.get('discount_percentage'))
+        merchant = _text(product.get('merchant_name'))
+        details['key_feature'] = f"{discount} off at {merchant}" if discount.endswith('%') else f"{discount} at {merchant}"
+        details['urgency'] = _text(product.get('expiry_date'))
+
+    elif product_type == 'loans':
+        details['key_feature'] = f"{_text(product.get('interest_rate_range'))} APR from {_text(product.get('bank_name'))}"
+        details['loan_range'] = f"${_amount(product.get('minimum_amount'))}-${_amount(product.get('maximum_amount'))}"
+
+    elif product_type == 'credit_cards':
+        details['key_feature'] = _text(product.get('welcome_bonus')) or _text(product.get('rewards_rate'))
+        details['issuer'] = _text(product.get('issuer'))
+        details['annual_fee'] = _text(product.get('annual_fee'), '$0')
+
+    elif product_type == 'savings':
+        apy = _text(product.get('apy_rate')) or _text(product.get('apy')) or _text(product.get('interest_rate'))
+        bank = _text(product.get('bank_name')) or _text(product.get('institution'))
+        details['key_feature'] = f"{apy} APY at {bank}"
+        details['minimum'] = _text(product.get('minimum_balance'), '$0')
+
+    return details
+
+
+class ProductCatalog(Mapping):
+    """
+    All product catalogs of a run, indexed by canonical product ID
+
+    Behaves like the {product_type: [records]} dict it is built from, so it
+    can be passed wherever product_data was, and adds O(1) lookups of records
+    and of their derived details.
+
+    Example:
+        catalog = ProductCatalog(product_data)
+        catalog.get_product('credit_cards', 'CC1')
+        catalog.details('savings', 'HY3')['key_feature']
+    """
+    def __init__(self, product_data):
+        self._records = {product_type: list(records) for product_type, records in product_data.items()}
+        self._index = {}
+        self._details = {}
+        for product_type, records in self._records.items():
+            index = {}
+            for record in records:
+                record_id = product_id(record, product_type)
+                if record_id is not None and record_id not in index:
+                    index[record_id] = record
+            self._index[product_type] = index
+            self._details[product_type] = {
+                record_id: derive_details(record, product_type) for record_id, record in index.items()
+            }
+
+    @classmethod
+    def ensure(cls, product_data):
+        """
+        Return product_data itself if it is already a catalog, otherwise index it
+        """
+        return product_data if isinstance(product_data, cls) else cls(product_data or {})
+
+    # Mapping interface: product type -> list of records
+
+    def __getitem__(self, product_type):
+        return self._records[product_type]
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    # Lookups
+
+    def get_product(self, product_type, product_id):
+        """
+        Catalog record of a product, or None if the ID is unknown
+        """
+        return self._index.get(product_type, {}).get(canonical_id(product_id))
+
+    def details(self, product_type, product_id):
+        """
+        Record plus derived fields such as key_feature, or {} if the ID is unknown
+        """
+        details = self._details.get(product_type, {}).get(canonical_id(product_id))
+        return dict(details) if details else {}
+
+    def contains(self, product_type, product_id):
+        return canonical_id(product_id) in self._index.get(product_type, {})
+
+    def known_ids(self, product_type, product_ids):
+        """
+        The IDs that exist in the catalog, canonicalized, in their original order
+        """
+        index = self._index.get(product_type, {})
+        known = []
+        for value in product_ids:
+            key = canonical_id(value)
+            if key in index and key not in known:
+                known.append(key)
+        return known
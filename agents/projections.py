@@ -0,0 +1,154 @@
+import pandas as pd
+from .cash_flow import cash_flow
+
+
+# Bump when a projection changes so stored recommendations built from the old view are recomputed
+PROJECTION_VERSION = 2
+
+# agent_template sends at most this many transaction records to the model
+MAX_RECORDS = 10
+
+
+def _prepare(transactions):
+    """
+    Normalize a transaction frame or record list into the columns the projections use
+    """
+    frame = pd.DataFrame(transactions) if isinstance(transactions, list) else transactions
+    amount = pd.to_numeric(frame['Txn Amount'], errors='coerce').fillna(0.0)
+    category = frame['Txn Category'].astype(str)
+    if 'month_year' in frame.columns:
+        month = frame['month_year'].astype(str)
+    else:
+        month = pd.to_datetime(frame['Txn Date'], errors='coerce').dt.strftime('%Y-%m')
+    income, spend, saved = cash_flow(category, amount)
+    return pd.DataFrame({
+        'month': month.values,
+        'category': category.values,
+        'merchant': frame['Merchant Name'].astype(str).values,
+        'mode': frame['Txn Mode'].astype(str).values,
+        'amount': amount.values,
+        'income': income,
+        'spend': spend,
+        'debt_payment': amount.where(category.str.startswith('LOAN_PAYMENTS_') & (amount > 0), 0.0).values,
+        'saved': saved,
+    })
+
+
+def _round(records):
+    return [{key: round(value, 2) if isinstance(value, float) else value for key, value in record.items()}
+            for record in records]
+
+
+def _monthly_balance(frame, columns):
+    """
+    One income/expense balance record per month, most recent months last
+    """
+    monthly = frame.groupby('month')[columns].sum().sort_index()
+    monthly['net'] = monthly['income'] - monthly['spend']
+    # Averages cover every month; only the records sent to the model are limited
+    overview = {
+        "months": int(frame['month'].nunique()),
+        "avg_monthly_income": float(monthly['income'].mean()),
+        "avg_monthly_spending": float(monthly['spend'].mean()),
+        "avg_monthly_net": float(monthly['net'].mean()),
+    }
+    return overview, monthly.tail(MAX_RECORDS - 1).reset_index()
+
+
+def coupons_projection(transactions):
+    """
+    Merchants the user shops at most, with their category, visit count and spend
+
+    Returns:
+        list: Up to MAX_RECORDS merchant records, most frequent first
+    """
+    frame = _prepare(transactions)
+    frame = frame[frame['spend'] > 0]
+    merchants = (frame.groupby(['merchant', 'category'])
+                 .agg(visits=('spend', 'size'), spend=('spend', 'sum'))
+                 .reset_index()
+                 .sort_values(['visits', 'spend'], ascending=False)
+                 .head(MAX_RECORDS))
+    return _round(merchants.to_dict('records'))
+
+
+def loans_projection(transactions):
+    """
+    Overall income/expense balance followed by monthly income, spending and debt payments
+
+    Returns:
+        list: Overview record plus up to MAX_RECORDS - 1 monthly records
+    """
+    frame = _prepare(transactions)
+    overview, monthly = _monthly_balance(frame, ['income', 'spend', 'debt_payment'])
+    total_income = frame['income'].sum()
+    overview["debt_to_income"] = float(frame['debt_payment'].sum() / total_income) if total_income else 0.0
+    debt_categories = frame[frame['debt_payment'] > 0].groupby('category')['debt_payment'].sum()
+    overview["debt_payments_by_type"] = {category: round(float(value), 2) for category, value in debt_categories.items()}
+    return _round([overview] + monthly.to_dict('records'))
+
+
+def savings_projection(transactions):
+    """
+    Overall income/expense balance followed by monthly income, spending and amounts saved
+
+    Returns:
+        list: Overview record plus up to MAX_RECORDS - 1 monthly records
+    """
+    frame = _prepare(transactions)
+    overview, monthly = _monthly_balance(frame, ['income', 'spend', 'saved'])
+    total_income = frame['income'].sum()
+    overview["savings_rate"] = float(frame['saved'].sum() / total_income) if total_income else 0.0
+    return _round([overview] + monthly.to_dict('records'))
+
+
+def credit_cards_projection(transactions):
+    """
+    Payment mode mix followed by spend per category
+
+    Returns:
+        list: Payment mode record plus up to MAX_RECORDS - 1 category records, largest spend first
+    """
+    frame = _prepare(transactions)
+    frame = frame[frame['spend'] > 0]
+    total = frame['spend'].sum()
+    modes = frame.groupby('mode')['spend'].sum().sort_values(ascending=False)
+    overview = {
+        "months": int(frame['month'].nunique()),
+        "avg_monthly_spending": float(total / max(frame['month'].nunique(), 1)),
+        "payment_mode_share": {mode: round(float(value / total), 3) for mode, value in modes.items()} if total else {},
+    }
+    categories = (frame.groupby('category')
+                  .agg(spend=('spend', 'sum'), txns=('spend', 'size'))
+                  .sort_values('spend', ascending=False)
+                  .head(MAX_RECORDS - 1)
+                  .reset_index())
+    categories['share'] = categories['spend'] / total if total else 0.0
+    return _round([overview] + categories.to_dict('records'))
+
+
+PROJECTIONS = {
+    "coupons": coupons_projection,
+    "loans": loans_projection,
+    "credit_cards": credit_cards_projection,
+    "savings": savings_projection,
+}
+
+
+def project(agent, transactions):
+    """
+    The minimal view of a user's transactions that one recommendation agent needs
+
+    Args:
+        agent (str): Catalog key of the agent ("coupons", "loans", "credit_cards", "savings")
+        transactions (pd.DataFrame or list): The user's preprocessed transactions
+
+    Returns:
+        list: Aggregate records (the unprojected records if the agent has no projection)
+    """
+    if len(transactions) == 0:
+        return []
+    projection = PROJECTIONS.get(agent)
+    if projection is None:
+        return transactions if isinstance(transactions, list) else transactions.to_dict('records')
+    return projection(transactions)
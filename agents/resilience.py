@@ -0,0 +1,231 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+
+THROTTLED = "throttled"
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+THROTTLING_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "SlowDown",
+}
+
+TRANSIENT_CODES = {
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "InternalFailure",
+    "ModelTimeoutException",
+    "ModelNotReadyException",
+    "ModelStreamErrorException",
+    "RequestTimeout",
+    "RequestTimeoutException",
+}
+
+# langchain_aws re-raises Bedrock errors as ValueError("Error raised by bedrock service: ..."),
+# so the error code is often only visible in the message
+THROTTLING_MARKERS = ("throttl", "too many requests", "rate exceeded", "slow down")
+TRANSIENT_MARKERS = ("timed out", "timeout", "serviceunavailable", "service unavailable",
+                     "internalserver", "connection reset", "connection aborted",
+                     "could not connect", "model is not ready")
+
+
+class ModelCallError(Exception):
+    """
+    A model call that failed permanently or ran out of retries
+    """
+    def __init__(self, message, category, attempts):
+        super().__init__(message)
+        self.category = category
+        self.attempts = attempts
+
+
+def _error_code(exc):
+    response = getattr(exc, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+    return None
+
+
+def classify_error(exc):
+    """
+    Classify a model call exception as throttled, transient or permanent
+
+    Walks the exception chain so wrapped boto3 errors are recognised.
+
+    Args:
+        exc (Exception): Raised exception
+
+    Returns:
+        str: THROTTLED, TRANSIENT or PERMANENT
+    """
+    seen = set()
+    current = exc
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        code = _error_code(current)
+        if code in THROTTLING_CODES:
+            return THROTTLED
+        if code in TRANSIENT_CODES:
+            return TRANSIENT
+        if type(current).__name__ in ("ReadTimeoutError", "ConnectTimeoutError", "EndpointConnectionError",
+                                      "ConnectionClosedError", "ConnectionError", "TimeoutError"):
+            return TRANSIENT
+        current = current.__cause__ or current.__context__
+
+    message = str(exc).lower()
+    if any(marker in message for marker in THROTTLING_MARKERS):
+        return THROTTLED
+    if any(marker in message for marker in TRANSIENT_MARKERS):
+        return TRANSIENT
+    return PERMANENT
+
+
+class ResilienceStats:
+    """
+    Thread-safe counters for model call attempts, retries and failures
+    """
+    FIELDS = ("calls", "attempts", "retries", "throttled", "transient", "permanent", "gave_up")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {name: 0 for name in self.FIELDS}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts = {name: 0 for name in self.FIELDS}
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Shared cap on in-flight model calls, adjusted AIMD-style
+
+    Every successful call grows the limit by 1/limit (about +1 per round of
+    calls); every throttled call multiplies it by `decrease_factor`. Callers
+    block in acquire() while the number of in-flight calls is at the limit.
+    """
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=32, decrease_factor=0.5):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.throttle_events = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        with self._condition:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def on_throttle(self):
+        with self._condition:
+            self.throttle_events += 1
+            self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter
+
+    Attributes:
+        max_attempts (int): Attempts including the first call
+        base_delay (float): Delay before the first retry, in seconds
+        max_delay (float): Upper bound of a single delay, in seconds
+        throttle_multiplier (float): Extra delay factor applied after throttling
+    """
+    max_attempts: int = 6
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    throttle_multiplier: float = 2.0
+
+    def delay(self, attempt, category):
+        """
+        Sleep time before retry number `attempt` (1-based)
+        """
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        if category == THROTTLED:
+            ceiling = min(self.max_delay, ceiling * self.throttle_multiplier)
+        return random.uniform(0, ceiling)
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+# One limiter and one set of counters shared by every agent in the process
+shared_limiter = AdaptiveConcurrencyLimiter()
+stats = ResilienceStats()
+
+
+def call_with_retry(fn, policy=DEFAULT_POLICY, limiter=None, counters=None, sleep=time.sleep):
+    """
+    Run a model call with classification, backoff and concurrency control
+
+    Args:
+        fn (callable): Zero-argument function performing one model call
+        policy (RetryPolicy): Retry and backoff settings
+        limiter (AdaptiveConcurrencyLimiter): Shared concurrency limit (defaults to shared_limiter)
+        counters (ResilienceStats): Counters to update (defaults to the module stats)
+        sleep (callable): Sleep function, replaceable for testing
+
+    Returns:
+        tuple: (result of fn, number of retries performed)
+
+    Raises:
+        ModelCallError: If the error is permanent or all attempts failed
+    """
+    limiter = limiter or shared_limiter
+    counters = counters or stats
+    counters.incr("calls")
+
+    attempt = 0
+    while True:
+        attempt += 1
+        counters.incr("attempts")
+        limiter.acquire()
+        try:
+            result = fn()
+        except Exception as e:
+            category = classify_error(e)
+            counters.incr(category)
+            if category == THROTTLED:
+                limiter.on_throttle()
+
+            if category == PERMANENT or attempt >= policy.max_attempts:
+                counters.incr("gave_up")
+                raise ModelCallError(
+                    f"{category} error after {attempt} attempt(s): {e}", category, attempt
+                ) from e
+        else:
+            limiter.on_success()
+            return result, attempt - 1
+        finally:
+            limiter.release()
+
+        counters.incr("retries")
+        sleep(policy.delay(attempt, category))
@@ -0,0 +1,256 @@
+import math
+import re
+import threading
+
+
+# Third-best score must beat the fourth by this much for the ranking to count as decided
+DECISIVE_MARGIN = 2.0
+
+# Loan types that serve each financial goal (keywords matched against Financial_goals and loan_type)
+LOAN_GOAL_KEYWORDS = {
+    "student": ("student",),
+    "education": ("student",),
+    "home": ("mortgage", "home loan", "fha", "va home", "usda", "construction"),
+    "debt": ("debt consolidation", "refinance"),
+    "pay off": ("debt consolidation", "refinance"),
+    "business": ("business", "sba", "franchise", "equipment"),
+    "credit": ("secured personal", "payday alternative"),
+}
+
+# Card reward keywords that pay off for each feature store spend group
+CARD_GROUP_KEYWORDS = {
+    "dining": ("dining", "restaurant", "fast food"),
+    "groceries": ("grocer", "supermarket"),
+    "transportation": ("gas", "transit"),
+    "travel": ("travel", "airfare", "flight", "hotel", "air travel"),
+    "entertainment": ("entertainment", "streaming", "movie"),
+    "shopping": ("online shopping", "department", "amazon", "walmart"),
+    "housing": ("home improvement", "utilities", "furnish"),
+    "health": ("drugstore", "fitness", "gym"),
+}
+
+# Savings account categories restricted to, or aimed at, particular users
+SAVINGS_GOAL_CATEGORIES = {
+    "retirement": "Retirement",
+    "education": "Education",
+    "emergency": "Online Savings",
+    "investment": "Investment Focused",
+}
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def min_credit_score(value):
+    """
+    Minimum credit score from catalog values like "680+" or "740-850" (0 if not given)
+    """
+    if _is_missing(value):
+        return 0
+    match = re.search(r'\d{3}', str(value))
+    return int(match.group()) if match else 0
+
+
+def dollar_amount(value):
+    """
+    First dollar amount in values like "$5000" or "$99 (waived first year)" (0 if not given)
+    """
+    if _is_missing(value):
+        return 0.0
+    match = re.search(r'\d[\d,]*\.?\d*', str(value))
+    return float(match.group().replace(',', '')) if match else 0.0
+
+
+def percent(value):
+    """
+    Percentage from values like "4.35%" (0 if not given)
+    """
+    if _is_missing(value):
+        return 0.0
+    match = re.search(r'\d+\.?\d*', str(value))
+    return float(match.group()) if match else 0.0
+
+
+def _credit_score(user_info):
+    try:
+        return int(float(user_info.get('Credit_score', 0) or 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _age(user_info):
+    try:
+        return float(user_info.get('Age', 0) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _top_groups(features, count=3):
+    if not features:
+        return []
+    shares = {name[len('share_'):]: value for name, value in features.items()
+              if name.startswith('share_') and name != 'share_investing' and value > 0}
+    return [group for group, _ in sorted(shares.items(), key=lambda x: x[1], reverse=True)[:count]]
+
+
+def score_loans(user_info, features, loans):
+    """
+    Eligible loans with a goal-match score
+
+    Returns:
+        list: (loan_id, score) for loans whose required credit score the user meets
+    """
+    credit_score = _credit_score(user_info)
+    goals = str(user_info.get('Financial_goals', '')).lower()
+    wanted = [kw for goal, keywords in LOAN_GOAL_KEYWORDS.items() if goal in goals for kw in keywords]
+
+    scored = []
+    for loan in loans:
+        required = min_credit_score(loan.get('required_credit_score'))
+        if credit_score < required:
+            continue
+        loan_type = str(loan.get('loan_type', '')).lower()
+        score = 5.0 if any(keyword in loan_type for keyword in wanted) else 0.0
+        # Prefer loans the user qualifies for comfortably
+        score += min(credit_score - required, 100) / 100
+        scored.append((loan.get('loan_id'), score))
+    return scored
+
+
+def score_credit_cards(user_info, features, cards):
+    """
+    Eligible cards scored by how well their reward categories match the user's top spend groups
+
+    Returns:
+        list: (card_id, score) for cards whose credit score requirement the user meets
+    """
+    credit_score = _credit_score(user_info)
+    top_groups = _top_groups(features)
+    monthly_spending = features['spending'] if features else 0.0
+
+    scored = []
+    for card in cards:
+        if credit_score < min_credit_score(card.get('credit_score_requirement')):
+            continue
+        categories = '' if _is_missing(card.get('cashback_categories')) else str(card['cashback_categories']).lower()
+        if 'business' in categories:
+            continue
+        score = 0.0
+        for rank, group in enumerate(top_groups):
+            if any(keyword in categories for keyword in CARD_GROUP_KEYWORDS.get(group, ())):
+                score += 3.0 - rank
+        if 'all purchases' in categories:
+            score += 1.0
+        # An annual fee only pays off with enough monthly spending
+        annual_fee = dollar_amount(card.get('annual_fee'))
+        if annual_fee:
+            score -= annual_fee / max(monthly_spending * 12 * 0.01, 1.0)
+        scored.append((card.get('card_id'), score))
+    return scored
+
+
+def score_savings(user_info, features, accounts):
+    """
+    Savings accounts the user can open, scored by APY and goal fit
+
+    Returns:
+        list: (account_id, score) for accounts within reach of the user's monthly surplus
+    """
+    age = _age(user_info)
+    goals = str(user_info.get('Financial_goals', '')).lower()
+    wanted = {category for goal, category in SAVINGS_GOAL_CATEGORIES.items() if goal in goals}
+    surplus = max(features['savings'], 0.0) if features else None
+
+    scored = []
+    for account in accounts:
+        category = str(account.get('account_category', ''))
+        if category in ("Business", "Military"):
+            continue
+        if category == "Senior Citizen" and age < 60:
+            continue
+        if category == "Youth" and age >= 25:
+            continue
+        minimum = dollar_amount(account.get('minimum_balance'))
+        if surplus is not None and minimum > surplus:
+            continue
+        score = percent(account.get('apy_rate', account.get('apy'))) * 2
+        if category in wanted:
+            score += 3.0
+        scored.append((account.get('id'), score))
+    return scored
+
+
+SCORERS = {
+    "loans": score_loans,
+    "credit_cards": score_credit_cards,
+    "savings": score_savings,
+}
+
+
+class RulesStats:
+    """
+    Per-agent counts of requests seen and decided without the model
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.considered = {}
+        self.decided = {}
+
+    def record(self, agent, decided):
+        with self._lock:
+            self.considered[agent] = self.considered.get(agent, 0) + 1
+            if decided:
+                self.decided[agent] = self.decided.get(agent, 0) + 1
+
+    def print_summary(self):
+        with self._lock:
+            considered = dict(self.considered)
+            decided = dict(self.decided)
+        if not considered:
+            return
+        print("\n===== Rules Fast Path =====")
+        for agent, count in sorted(considered.items()):
+            skipped = decided.get(agent, 0)
+            print(f"{agent:<20} {skipped:>6} of {count:<6} model calls avoided ({skipped / count:.0%})")
+        print("===========================\n")
+
+
+stats = RulesStats()
+
+
+def recommend(product_type, user_info, features, products, margin=DECISIVE_MARGIN, list_length=3):
+    """
+    Decide a recommendation locally when the answer is clear-cut
+
+    The answer is clear-cut when eligibility leaves exactly `list_length`
+    products, or when the last recommended product outscores the next one by
+    at least `margin`. With fewer eligible products the model decides, so a
+    recommendation list is never shorter than `list_length`.
+
+    Args:
+        product_type (str): "loans", "credit_cards" or "savings"
+        user_info (dict): User information
+        features (dict): Latest month's feature vector (may be None)
+        products (list): Product catalog
+        margin (float): Score gap that makes the top list decisive
+        list_length (int): Number of products to recommend
+
+    Returns:
+        tuple: (product_ids, reason), or None to defer to the model
+    """
+    scorer = SCORERS.get(product_type)
+    if scorer is None:
+        return None
+
+    scored = sorted(scorer(user_info, features, products), key=lambda x: x[1], reverse=True)
+    decision = None
+    if len(scored) == list_length:
+        decision = [product_id for product_id, _ in scored], f"only {len(scored)} eligible"
+    elif len(scored) > list_length:
+        gap = scored[list_length - 1][1] - scored[list_length][1]
+        if gap >= margin:
+            decision = [product_id for product_id, _ in scored[:list_length]], f"score margin {gap:.1f}"
+
+    stats.record(product_type, decision is not None)
+    return decision
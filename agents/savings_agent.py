@@ -1,7 +1,9 @@
-from .agent_template import build_agent, AgentState
+from .agent_template import build_agent, AgentState, prompt_fingerprint
+from .generation_profiles import GENERATION_PROFILES
+from . import tracing
 
-def run_savings_agent(user_info, transaction_data, savings_data):
-    system_prompt = """
+
+system_prompt = """
     You are a high-yield savings account recommendation agent. Analyze the user's financial behavior and recommend suitable savings options.
     
     Consider:
@@ -13,8 +15,14 @@ def run_savings_agent(user_info, transaction_data, savings_data):
     
     Return ONLY a simple JSON array of the top 3 savings account IDs, like: ["HY1", "HY2", "HY3"]
     """
-    
-    agent = build_agent(system_prompt)
+
+# Identifies the prompt and output settings that produced stored recommendations
+PROMPT_VERSION = prompt_fingerprint(system_prompt, GENERATION_PROFILES["savings"])
+
+
+@tracing.traced("savings_agent")
+def run_savings_agent(user_info, transaction_data, savings_data):
+    agent = build_agent(system_prompt, GENERATION_PROFILES["savings"])
     
     # Prepare state
     state = AgentState(
@@ -0,0 +1,238 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from typing import Optional
+
+
+# Fields (user_id, month, ...) attached to every event emitted inside call_context()
+_call_context = contextvars.ContextVar("llm_call_context", default={})
+
+
+@contextmanager
+def call_context(**fields):
+    """
+    Attach fields such as user_id and month to model calls made inside the block
+
+    Example:
+        with call_context(user_id="U1"):
+            with call_context(month="2023-01"):
+                summarize_user(...)
+    """
+    token = _call_context.set({**_call_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _call_context.reset(token)
+
+
+def current_context():
+    """
+    Return the fields set by the enclosing call_context() blocks
+    """
+    return dict(_call_context.get())
+
+
+@dataclass
+class LLMCallEvent:
+    """
+    One model call made through agent_template
+    """
+    agent: str
+    user_id: Optional[str] = None
+    month: Optional[str] = None
+    latency: float = 0.0
+    time_to_first_token: Optional[float] = None
+    time_to_payload: Optional[float] = None
+    input_tokens: int = 0
+    output_tokens: int = 0
+    usage_source: str = "response"
+    retries: int = 0
+    cache_status: str = "miss"
+    outcome: str = "parsed"
+    stopped_early: bool = False
+    error: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class JsonlFileSink:
+    """
+    Append every event as one JSON line to a file
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def emit(self, event):
+        line = json.dumps(event.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line + "\n")
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers (0 for an empty list)
+    """
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+# cache_status values of events that stand for a skipped model call
+SKIPPED_CALL_STATUSES = ("hit", "cohort", "rules", "segment", "checkpoint")
+
+
+# Latencies kept per agent for the percentiles; beyond this many calls they are a uniform sample
+LATENCY_SAMPLE_SIZE = 10000
+
+
+class InMemoryAggregator:
+    """
+    Summarize latency and token usage per agent
+
+    Counts and token totals are kept as running sums. Latency percentiles come
+    from a reservoir sample of at most `sample_size` calls per agent, so
+    memory stays bounded however many calls a run makes (percentiles are exact
+    up to that many calls).
+    """
+    def __init__(self, sample_size=LATENCY_SAMPLE_SIZE, seed=0):
+        self.sample_size = sample_size
+        self._agents = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def emit(self, event):
+        with self._lock:
+            stats = self._agents.setdefault(event.agent, {
+                "calls": 0, "cache_hits": 0, "input_tokens": 0, "output_tokens": 0,
+                "retries": 0, "fallbacks": 0, "latencies": []
+            })
+            if event.cache_status in SKIPPED_CALL_STATUSES:
+                stats["cache_hits"] += 1
+                return
+            stats["calls"] += 1
+            stats["input_tokens"] += event.input_tokens
+            stats["output_tokens"] += event.output_tokens
+            stats["retries"] += event.retries
+            stats["fallbacks"] += event.outcome != "parsed"
+            # Reservoir sampling: every call ends up in the sample with equal probability
+            latencies = stats["latencies"]
+            if len(latencies) < self.sample_size:
+                latencies.append(event.latency)
+            else:
+                slot = self._random.randrange(stats["calls"])
+                if slot < self.sample_size:
+                    latencies[slot] = event.latency
+
+    def summary(self):
+        """
+        Per-agent latency percentiles and token totals
+
+        Returns:
+            dict: agent name -> statistics
+        """
+        with self._lock:
+            agents = {agent: dict(stats, latencies=list(stats["latencies"]))
+                      for agent, stats in self._agents.items()}
+
+        stats = {}
+        for agent, totals in sorted(agents.items()):
+            latencies = totals["latencies"]
+            stats[agent] = {
+                "calls": totals["calls"],
+                "cache_hits": totals["cache_hits"],
+                "latency_p50": percentile(latencies, 50),
+                "latency_p95": percentile(latencies, 95),
+                "latency_p99": percentile(latencies, 99),
+                "input_tokens": totals["input_tokens"],
+                "output_tokens": totals["output_tokens"],
+                "retries": totals["retries"],
+                "fallbacks": totals["fallbacks"]
+            }
+        return stats
+
+    def print_summary(self):
+        stats = self.summary()
+        if not stats:
+            print("No model calls recorded")
+            return
+
+        print("\n===== LLM Call Summary =====")
+        print(f"{'agent':<20} {'calls':>6} {'hits':>5} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} "
+              f"{'tokens in':>10} {'tokens out':>10} {'retries':>7} {'fallbk':>6}")
+        for agent, s in stats.items():
+            print(f"{agent:<20} {s['calls']:>6} {s['cache_hits']:>5} {s['latency_p50']:>7.2f} "
+                  f"{s['latency_p95']:>7.2f} {s['latency_p99']:>7.2f} {s['input_tokens']:>10,} "
+                  f"{s['output_tokens']:>10,} {s['retries']:>7} {s['fallbacks']:>6}")
+        print("============================\n")
+
+
+class FanOutSink:
+    """
+    Forward every event to several sinks
+    """
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def emit(self, event):
+        for sink in self.sinks:
+            sink.emit(event)
+
+
+_sink = None
+
+
+def set_sink(sink):
+    """
+    Install the sink that receives all events (None disables telemetry)
+    """
+    global _sink
+    _sink = sink
+
+
+def get_sink():
+    return _sink
+
+
+def record_cache_hit(agent, cache_status="hit", **fields):
+    """
+    Record a result that was served from a cache instead of a model call
+
+    Args:
+        agent (str): Agent whose call was skipped
+        cache_status (str): "hit" for the run store, "cohort" for a neighbour's result,
+            "rules" for a local rules decision, "segment" for cached email templates,
+            "checkpoint" for a stage result of the interrupted run being resumed
+    """
+    emit(LLMCallEvent(agent=agent, cache_status=cache_status, usage_source="none", **fields))
+
+
+def emit(event):
+    """
+    Fill in context fields and send the event to the installed sink
+    """
+    if _sink is None:
+        return
+    context = current_context()
+    if event.user_id is None:
+        event.user_id = context.get("user_id")
+    if event.month is None:
+        event.month = context.get("month")
+    try:
+        _sink.emit(event)
+    except Exception as e:
+        # Telemetry must never break a run
+        print(f"Warning: failed to record telemetry event: {e}")
@@ -0,0 +1,232 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Span that is currently open in this thread / context
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+_span_ids = itertools.count(1)
+
+
+class Span:
+    """
+    A timed, named unit of work with an optional parent span
+    """
+    __slots__ = ("name", "span_id", "parent_id", "start_ns", "end_ns", "thread_id", "attributes")
+
+    def __init__(self, name, parent_id, attributes):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent_id
+        self.start_ns = time.perf_counter_ns()
+        self.end_ns = None
+        self.thread_id = threading.get_ident()
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        """
+        Add attributes to the span after it was opened (e.g. result sizes)
+        """
+        self.attributes.update(attributes)
+
+    @property
+    def duration(self):
+        """
+        Duration in seconds (None while the span is open)
+        """
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e9
+
+
+class Tracer:
+    """
+    Collect finished spans as a Chrome trace-event file
+
+    The file can be opened in chrome://tracing or https://ui.perfetto.dev
+    to see every stage of every user on a timeline, one row per thread.
+
+    With a `path`, every span is appended to the file as it finishes (Chrome's
+    JSON array format, readable even if the run crashes before close()), so
+    memory stays flat however long the run; without one, spans are kept in
+    memory for export_chrome_trace().
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.spans = []
+        self.recorded = 0
+        self.origin_ns = time.perf_counter_ns()
+        self._totals = {}
+        self._thread_ids = {}
+        self._lock = threading.Lock()
+        self._file = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(path, 'w')
+            self._file.write("[\n")
+
+    def record(self, span):
+        with self._lock:
+            self.recorded += 1
+            count, total = self._totals.get(span.name, (0, 0.0))
+            self._totals[span.name] = (count + 1, total + span.duration)
+            if self._file is None:
+                self.spans.append(span)
+                return
+            if self.recorded > 1:
+                self._file.write(",\n")
+            self._file.write(json.dumps(self._event(span, os.getpid()), default=str))
+
+    def _event(self, span, pid):
+        # Small, stable row numbers are easier to read than raw thread idents
+        tid = self._thread_ids.setdefault(span.thread_id, len(self._thread_ids) + 1)
+        args = {key: value for key, value in span.attributes.items()}
+        args["span_id"] = span.span_id
+        if span.parent_id is not None:
+            args["parent_id"] = span.parent_id
+        return {
+            "name": span.name,
+            "cat": span.name.split(".")[0],
+            "ph": "X",
+            "ts": (span.start_ns - self.origin_ns) / 1000,
+            "dur": (span.end_ns - span.start_ns) / 1000,
+            "pid": pid,
+            "tid": tid,
+            "args": args
+        }
+
+    def to_chrome_trace(self):
+        """
+        Build the trace of the spans kept in memory as a Chrome trace-event document
+
+        Returns:
+            dict: {"traceEvents": [...]} with one complete ("X") event per span
+        """
+        pid = os.getpid()
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start_ns)
+            events = [self._event(span, pid) for span in spans]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path):
+        """
+        Write the trace to a JSON file (a streaming tracer just closes its file)
+
+        Args:
+            path (str): Output file path
+        """
+        if self._file is not None:
+            self.close()
+            return
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_chrome_trace(), f, default=str)
+        print(f"Trace with {len(self.spans)} spans written to {path}")
+
+    def close(self):
+        """
+        Finish a streamed trace file
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write("\n]\n")
+            self._file.close()
+            self._file = None
+        print(f"Trace with {self.recorded} spans written to {self.path}")
+
+    def stage_totals(self):
+        """
+        Total seconds spent per span name
+
+        Returns:
+            dict: span name -> (count, total seconds)
+        """
+        with self._lock:
+            return dict(self._totals)
+
+
+_tracer = None
+
+
+def set_tracer(tracer):
+    """
+    Install the tracer that records spans (None disables tracing)
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def current_span():
+    """
+    The span open in this thread / context, to hand to work that runs on another thread
+    """
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """
+    Time a block of work as a child of the currently open span
+
+    Context variables do not follow work submitted to a thread pool, so code
+    running on a worker thread passes the submitting thread's span as `parent`.
+
+    Example:
+        with span("monthly_summaries", user_id="U1") as s:
+            ...
+            s.set(months=6)
+
+    Args:
+        name (str): Span name
+        parent (Span): Parent span (None = the currently open span)
+
+    Yields:
+        Span: The open span, or None when no tracer is installed
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+
+    parent = parent or _current_span.get()
+    current = Span(name, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=str(e))
+        raise
+    finally:
+        current.end_ns = time.perf_counter_ns()
+        _current_span.reset(token)
+        tracer.record(current)
+
+
+def traced(name=None):
+    """
+    Decorator that wraps every call of a function in a span
+    """
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,173 @@
+import threading
+import numpy as np
+from feature_store import FEATURE_GROUPS, SHARE_COLUMNS
+
+
+DEFAULT_SIMILARITY_THRESHOLD = 0.97
+
+
+def cohort_key(user_info, features):
+    """
+    Quantized profile key; only users with the same key are compared
+
+    Args:
+        user_info (dict): User information (Credit_score, Age, Financial_goals)
+        features (dict): Latest month's feature vector from the feature store
+
+    Returns:
+        tuple: (credit band, age band, goals, dominant spend group, spending ratio band)
+    """
+    try:
+        credit_band = int(float(user_info.get('Credit_score', 0) or 0)) // 50 * 50
+    except (TypeError, ValueError):
+        credit_band = 0
+    try:
+        age = float(user_info.get('Age', 0) or 0)
+    except (TypeError, ValueError):
+        age = 0
+    age_band = 0 if age < 30 else 1 if age < 45 else 2 if age < 65 else 3
+    goals = " ".join(str(user_info.get('Financial_goals', '')).lower().split())
+
+    shares = spend_vector(features)
+    dominant = list(FEATURE_GROUPS)[int(np.argmax(shares))] if shares.any() else "none"
+    ratio_band = int(features['spending_ratio'] // 20)
+    return credit_band, age_band, goals, dominant, ratio_band
+
+
+def spend_vector(features):
+    """
+    Spend-share vector of a user's latest month
+    """
+    return np.array([features[column] for column in SHARE_COLUMNS], dtype=float)
+
+
+class _Bucket:
+    """
+    Users of one cohort whose recommendations came from the same catalog and prompt version
+
+    Vectors are appended to a preallocated matrix that doubles when full, so
+    adding a user never copies the whole bucket and lookups need no restacking.
+    """
+    def __init__(self, capacity=16):
+        self.user_ids = []
+        self.product_ids = []
+        self._matrix = None
+        self._capacity = capacity
+
+    def add(self, user_id, unit_vector, product_ids):
+        size = len(self.user_ids)
+        if self._matrix is None:
+            self._matrix = np.empty((self._capacity, len(unit_vector)))
+        elif size == len(self._matrix):
+            self._matrix = np.concatenate([self._matrix, np.empty_like(self._matrix)])
+        self._matrix[size] = unit_vector
+        self.user_ids.append(user_id)
+        self.product_ids.append(product_ids)
+
+    def nearest(self, unit_vector, exclude_user=None):
+        if not self.user_ids:
+            return None, 0.0
+        similarities = self._matrix[:len(self.user_ids)] @ unit_vector
+        # The user's own earlier entries are skipped; everyone else competes on similarity
+        while True:
+            position = int(np.argmax(similarities))
+            if similarities[position] == -np.inf:
+                return None, 0.0
+            if self.user_ids[position] != exclude_user:
+                return position, float(similarities[position])
+            similarities[position] = -np.inf
+
+
+class CohortIndex:
+    """
+    Reuse recommendations from the closest already-processed user with the same profile
+
+    Users are bucketed by cohort_key() and, inside a bucket, compared by cosine
+    similarity of their spend-share vectors. A neighbour's list is reused only
+    if it was produced against the same catalog and prompt version and the
+    similarity reaches `threshold`.
+    """
+    def __init__(self, threshold=DEFAULT_SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.lookups = {}
+        self.hits = {}
+
+    @staticmethod
+    def _unit(features):
+        vector = spend_vector(features)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def add(self, user_id, user_info, features, product_type, version, product_ids):
+        """
+        Index a recommendation list produced by the model for this user
+        """
+        if not features:
+            return
+        unit = self._unit(features)
+        if unit is None:
+            return
+        key = (cohort_key(user_info, features), product_type, version)
+        with self._lock:
+            self._buckets.setdefault(key, _Bucket()).add(user_id, unit, list(product_ids))
+
+    def lookup(self, user_id, user_info, features, product_type, version):
+        """
+        Find a close enough neighbour's recommendation list
+
+        Returns:
+            tuple: (product_ids, neighbour user_id, similarity), or None to call the model
+        """
+        if not features:
+            return None
+        unit = self._unit(features)
+        key = (cohort_key(user_info, features), product_type, version)
+        with self._lock:
+            self.lookups[product_type] = self.lookups.get(product_type, 0) + 1
+            bucket = self._buckets.get(key)
+            if unit is None or bucket is None:
+                return None
+            position, similarity = bucket.nearest(unit, exclude_user=user_id)
+            if position is None or similarity < self.threshold:
+                return None
+            self.hits[product_type] = self.hits.get(product_type, 0) + 1
+            return list(bucket.product_ids[position]), bucket.user_ids[position], similarity
+
+    def seed(self, store, feature_store, user_infos, versions):
+        """
+        Index recommendations stored by earlier runs for the current catalog versions
+
+        Args:
+            store (RunStore): Run store holding previous recommendations
+            feature_store (FeatureStore): Source of the users' latest features
+            user_infos (dict): user_id -> user information
+            versions (dict): product type -> current catalog and prompt version
+
+        Returns:
+            int: Number of recommendation lists indexed
+        """
+        indexed = 0
+        for product_type, version in versions.items():
+            for user_id, product_ids in store.get_recommendations_for_version(product_type, version):
+                features = feature_store.latest(user_id)
+                if user_id in user_infos and features:
+                    self.add(user_id, user_infos[user_id], features, product_type, version, product_ids)
+                    indexed += 1
+        return indexed
+
+    def print_summary(self):
+        with self._lock:
+            lookups = dict(self.lookups)
+            hits = dict(self.hits)
+        if not lookups:
+            return
+        print(f"\n===== Cohort Reuse (similarity >= {self.threshold}) =====")
+        for product_type, count in sorted(lookups.items()):
+            hit_count = hits.get(product_type, 0)
+            print(f"{product_type:<20} {hit_count:>6} of {count:<6} reused ({hit_count / count:.0%})")
+        total_lookups = sum(lookups.values())
+        total_hits = sum(hits.values())
+        print(f"{'total':<20} {total_hits:>6} of {total_lookups:<6} reused ({total_hits / total_lookups:.0%})")
+        print("==============================================\n")
@@ -1,3 +1,8 @@
+from agents import tracing
+from agents.product_catalog import ProductCatalog
+
+
+@tracing.traced("build_final_output")
 def build_final_output(user_info, coupons, loans, credit_cards, savings, monthly_summaries, email_subjects=None, product_data=None):
     # Analyze spending tags across all months to find most representative tags
     tag_frequency = {}
@@ -37,53 +42,23 @@ def build_final_output(user_info, coupons, loans, credit_cards, savings, monthly
     
     # Map product IDs to full details if product_data is provided
     if product_data:
-        # Map coupons to full details
-        coupon_details = []
-        for coupon_id in coupons:
-            coupon_info = next((c for c in product_data.get('coupons', []) if c.get('coupon_id') == coupon_id), None)
-            if coupon_info:
-                coupon_details.append(coupon_info)
-            else:
-                # If coupon not found, include only the ID
-                coupon_details.append({"Coupon_id": coupon_id})
-        
-        # Map loans to full details
-        loan_details = []
-        for loan_id in loans:
-            loan_info = next((l for l in product_data.get('loans', []) if l.get('loan_id') == loan_id), None)
-            if loan_info:
-                loan_details.append(loan_info)
-            else:
-                # If loan not found, include only the ID
-                loan_details.append({"Loan_id": loan_id})
-        
-        # Map credit cards to full details
-        credit_card_details = []
-        for cc_id in credit_cards:
-            cc_info = next((c for c in product_data.get('credit_cards', []) if c.get('card_id') == cc_id), None)
-            if cc_info:
-                credit_card_details.append(cc_info)
-            else:
-                # If credit card not found, include only the ID
-                credit_card_details.append({"Credit_card_id": cc_id})
-        
-        # Map savings accounts to full details
-        savings_details = []
-        for savings_id in savings:
-            savings_info = next((s for s in product_data.get('savings', []) if s.get('id') == savings_id), None)
-            if savings_info:
-                savings_details.append(savings_info)
-            else:
-                # If savings account not found, include only the ID
-                savings_details.append({"High_yield_savings_id": savings_id})
-        
-        # Add full details to output
-        output["recommendations"] = {
-            "coupons": coupon_details,
-            "loans": loan_details,
-            "credit_cards": credit_card_details,
-            "high_yield_savings": savings_details
+        catalog = ProductCatalog.ensure(product_data)
+        recommended = {
+            "coupons": ("coupons", coupons),
+            "loans": ("loans", loans),
+            "credit_cards": ("credit_cards", credit_cards),
+            "high_yield_savings": ("savings", savings),
         }
+        for output_key, (product_type, product_ids) in recommended.items():
+            details = []
+            for product_id in product_ids:
+                product_info = catalog.get_product(product_type, product_id)
+                if product_info is None:
+                    # Unknown IDs are dropped rather than written as stub entries
+                    print(f"Warning: {product_type} product {product_id} not found in catalog, skipping")
+                    continue
+                details.append(product_info)
+            output["recommendations"][output_key] = details
     else:
         # If product_data is not provided, just use the IDs
         output["recommendations"] = {
@@ -97,6 +72,22 @@ def build_final_output(user_info, coupons, loans, credit_cards, savings, monthly
     output["monthly_spend_analysis_data"] = monthly_summaries
     
     # Add email subjects if provided
+    attach_email_notifications(output, email_subjects)
+    
+    return output
+
+
+def attach_email_notifications(output, email_subjects):
+    """
+    Add the email subject lines to a final output, filling in defaults for missing ones
+    
+    Args:
+        output (dict): Output from build_final_output
+        email_subjects (dict): Subjects from the email notification agent (nothing is added if empty)
+        
+    Returns:
+        dict: The same output
+    """
     if email_subjects:
         output["email_notifications"] = {
             "spending_summary_email": "Your Monthly Financial Insights Are Ready!",
@@ -105,5 +96,4 @@ def build_final_output(user_info, coupons, loans, credit_cards, savings, monthly
             "credit_cards_email": email_subjects.get("credit_cards_email", "Amazing Credit Card Benefits!"),
             "savings_email": email_subjects.get("savings_email", "Grow Your Money Faster!")
         }
-    
     return output
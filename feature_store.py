@@ -0,0 +1,256 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from agents.cash_flow import cash_flow
+
+
+DEFAULT_FEATURE_PATH = "state/features.npz"
+
+# Bump when the feature definitions change so stale files are rebuilt
+FEATURE_VERSION = 2
+
+# Spend groups in the feature vector and the Txn Category prefixes counted toward each
+FEATURE_GROUPS = {
+    "groceries": ("FOOD_AND_DRINK_GROCERIES", "GENERAL_MERCHANDISE_GROCERIES"),
+    "dining": ("FOOD_AND_DRINK_",),
+    "transportation": ("TRANSPORTATION_",),
+    "entertainment": ("ENTERTAINMENT_",),
+    "shopping": ("GENERAL_MERCHANDISE_", "PERSONAL_CARE_HAIR_AND_BEAUTY"),
+    "housing": ("RENT_AND_UTILITIES_", "UTILITIES_", "HOME_IMPROVEMENT_", "LOAN_PAYMENTS_MORTGAGE_PAYMENT"),
+    "health": ("MEDICAL_", "PERSONAL_CARE_GYMS_AND_FITNESS_CENTERS"),
+    "education": ("GENERAL_SERVICES_EDUCATION", "LOAN_PAYMENTS_STUDENT_LOAN_PAYMENT"),
+    "travel": ("TRAVEL_",),
+    "debt": ("LOAN_PAYMENTS_",),
+    "investing": ("TRANSFER_OUT_",),
+}
+
+SUMMARY_COLUMNS = ["income", "spending", "spending_ratio", "savings", "txn_count", "avg_spend_txn", "top_merchant_share"]
+SPEND_COLUMNS = [f"spend_{group}" for group in FEATURE_GROUPS]
+SHARE_COLUMNS = [f"share_{group}" for group in FEATURE_GROUPS]
+
+# Fixed-width numeric vector per (user, month)
+FEATURE_COLUMNS = SUMMARY_COLUMNS + SPEND_COLUMNS + SHARE_COLUMNS
+MERCHANT_COLUMNS = ["top_merchant_1", "top_merchant_2", "top_merchant_3"]
+
+
+def category_groups(categories):
+    """
+    Map Txn Category values to feature groups (first matching group wins, else "other")
+
+    Args:
+        categories (pd.Series): Txn Category values
+
+    Returns:
+        pd.Series: Group name per row
+    """
+    categories = categories.astype(str)
+    mapping = {}
+    for category in categories.unique():
+        mapping[category] = next(
+            (group for group, prefixes in FEATURE_GROUPS.items() if category.startswith(prefixes)), "other"
+        )
+    return categories.map(mapping)
+
+
+def compute_features(transactions):
+    """
+    Feature vector for every (user, month) in one pass over a transaction table
+
+    Args:
+        transactions (pd.DataFrame): Transactions with User_id, Txn Amount, Txn Date,
+            Txn Category, Merchant Name and optionally month_year
+
+    Returns:
+        pd.DataFrame: Indexed by (User_id, month_year 'YYYY-MM') with FEATURE_COLUMNS and MERCHANT_COLUMNS
+    """
+    columns = FEATURE_COLUMNS + MERCHANT_COLUMNS
+    if transactions.empty:
+        return pd.DataFrame(columns=columns, index=pd.MultiIndex.from_tuples([], names=['User_id', 'month_year']))
+
+    if 'month_year' in transactions.columns:
+        months = transactions['month_year'].astype(str)
+    else:
+        months = pd.to_datetime(transactions['Txn Date'], errors='coerce').dt.strftime('%Y-%m')
+    categories = transactions['Txn Category'].astype(str)
+    income, spend, saved = cash_flow(categories, transactions['Txn Amount'])
+    frame = pd.DataFrame({
+        'User_id': transactions['User_id'].values,
+        'month_year': months.values,
+        'group': category_groups(categories).values,
+        'merchant': transactions['Merchant Name'].astype(str).values if 'Merchant Name' in transactions else '',
+        'income': income,
+        'spend': spend,
+        # Savings and investment transfers land in the "investing" group, outside spending
+        'outflow': spend + saved
+    })
+    frame = frame.dropna(subset=['month_year'])
+    frame = frame[frame['month_year'] != 'NaT']
+    keys = ['User_id', 'month_year']
+
+    spend = frame.pivot_table(index=keys, columns='group', values='outflow', aggfunc='sum', fill_value=0.0)
+    spend = spend.reindex(columns=list(FEATURE_GROUPS) + ['other'], fill_value=0.0)
+    grouped = frame.groupby(keys)
+    totals = grouped.agg(income=('income', 'sum'), spending=('spend', 'sum'), txn_count=('outflow', 'size'))
+    is_spend = frame['spend'] > 0
+    spend_txns = frame[is_spend].groupby(keys)['outflow'].size().reindex(spend.index, fill_value=0)
+
+    features = pd.DataFrame(index=spend.index)
+    features['income'] = totals['income']
+    features['spending'] = totals['spending']
+    income = features['income'].to_numpy()
+    spending = features['spending'].to_numpy()
+    features['spending_ratio'] = np.divide(spending * 100, income, out=np.zeros_like(spending), where=income > 0)
+    features['savings'] = income - spending
+    features['txn_count'] = totals['txn_count']
+    features['avg_spend_txn'] = np.divide(spending, spend_txns.to_numpy(), out=np.zeros_like(spending),
+                                          where=spend_txns.to_numpy() > 0)
+    for group in FEATURE_GROUPS:
+        features[f"spend_{group}"] = spend[group]
+    for group in FEATURE_GROUPS:
+        features[f"share_{group}"] = np.divide(spend[group].to_numpy(), spending,
+                                               out=np.zeros_like(spending), where=spending > 0)
+
+    # Top merchants by spend per (user, month)
+    merchant_spend = (frame[is_spend].groupby(keys + ['merchant'])['outflow'].sum()
+                      .reset_index().sort_values(keys + ['outflow'], ascending=[True, True, False]))
+    merchant_spend['rank'] = merchant_spend.groupby(keys).cumcount()
+    top = merchant_spend[merchant_spend['rank'] < len(MERCHANT_COLUMNS)]
+    names = top.pivot(index=keys, columns='rank', values='merchant').reindex(features.index)
+    first = top[top['rank'] == 0].set_index(keys)['outflow'].reindex(features.index, fill_value=0.0).to_numpy()
+    features['top_merchant_share'] = np.divide(first, spending, out=np.zeros_like(spending), where=spending > 0)
+    for rank, column in enumerate(MERCHANT_COLUMNS):
+        features[column] = names[rank].fillna('') if rank in names.columns else ''
+
+    return features[columns]
+
+
+class FeatureStore:
+    """
+    Per (user, month) feature vectors persisted as a columnar .npz file
+
+    Each feature is stored as one array, so the table loads without parsing
+    rows. update() recomputes only the months it is given and save() writes
+    the file once per run. Users processed concurrently may update and read
+    the store from several threads.
+    """
+    def __init__(self, path=DEFAULT_FEATURE_PATH):
+        self.path = path
+        self.frame = self._load()
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        empty = compute_features(pd.DataFrame())
+        if not self.path or not os.path.exists(self.path):
+            return empty
+        with np.load(self.path, allow_pickle=False) as data:
+            if int(data['feature_version']) != FEATURE_VERSION:
+                print(f"Feature file {self.path} is from an older version, rebuilding")
+                return empty
+            index = pd.MultiIndex.from_arrays([data['User_id'], data['month_year']], names=['User_id', 'month_year'])
+            frame = pd.DataFrame({column: data[column] for column in FEATURE_COLUMNS + MERCHANT_COLUMNS}, index=index)
+        return frame
+
+    def update(self, transactions, months=None):
+        """
+        Recompute features for the users in `transactions`
+
+        Call it once per run with every user's transactions: each call rewrites
+        and re-sorts the whole table.
+
+        Args:
+            transactions (pd.DataFrame): Transactions of one or more users (full history or just the changed months)
+            months (list or dict): Only recompute these 'YYYY-MM' months (None = every month present), or
+                user_id -> months (None = every month) when users changed in different months;
+                users not yet in the store always get every month
+
+        Returns:
+            int: Number of (user, month) rows written
+        """
+        features = compute_features(transactions)
+        with self._lock:
+            if months is not None:
+                users = features.index.get_level_values('User_id')
+                feature_months = features.index.get_level_values('month_year')
+                if isinstance(months, dict):
+                    # (user, month) pairs to keep, with users recomputed in full listed by month None
+                    wanted = {(user_id, None if user_months is None else str(month))
+                              for user_id, user_months in months.items()
+                              for month in (user_months if user_months is not None else [None])}
+                    keep = np.array([(user_id, month) in wanted or (user_id, None) in wanted
+                                     for user_id, month in zip(users, feature_months)], dtype=bool)
+                else:
+                    keep = feature_months.isin([str(m) for m in months])
+                known_users = self.frame.index.get_level_values('User_id').unique()
+                features = features[keep | ~users.isin(known_users)]
+            if features.empty:
+                return 0
+            self.frame = pd.concat([self.frame.drop(features.index, errors='ignore'), features]).sort_index()
+            self._dirty = True
+        return len(features)
+
+    def get_user(self, user_id):
+        """
+        All stored months of one user, oldest first
+
+        Returns:
+            pd.DataFrame: Indexed by month_year
+        """
+        frame = self.frame
+        if user_id not in frame.index.get_level_values('User_id'):
+            return frame.iloc[0:0].droplevel('User_id')
+        return frame.xs(user_id, level='User_id')
+
+    def latest(self, user_id):
+        """
+        Features of a user's most recent month
+
+        Returns:
+            dict: Feature name -> value, plus 'month_year'; None if the user has no features
+        """
+        months = self.get_user(user_id)
+        if months.empty:
+            return None
+        row = months.iloc[-1]
+        features = {column: float(row[column]) for column in FEATURE_COLUMNS}
+        features.update({column: str(row[column]) for column in MERCHANT_COLUMNS})
+        features['month_year'] = months.index[-1]
+        return features
+
+    def vectors(self):
+        """
+        The numeric feature matrix for all users and months
+
+        Returns:
+            tuple: (index of (user_id, month_year), np.ndarray of shape (rows, len(FEATURE_COLUMNS)))
+        """
+        return self.frame.index, self.frame[FEATURE_COLUMNS].to_numpy(dtype=float)
+
+    def save(self):
+        """
+        Write the feature file if anything changed (atomically, via a temporary file)
+        """
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        if not self._dirty or not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        arrays = {
+            'feature_version': np.array(FEATURE_VERSION),
+            'User_id': self.frame.index.get_level_values('User_id').to_numpy(dtype=str),
+            'month_year': self.frame.index.get_level_values('month_year').to_numpy(dtype=str)
+        }
+        for column in FEATURE_COLUMNS:
+            arrays[column] = self.frame[column].to_numpy(dtype=float)
+        for column in MERCHANT_COLUMNS:
+            arrays[column] = self.frame[column].to_numpy(dtype=str)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
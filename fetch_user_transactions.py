@@ -2,6 +2,58 @@ import boto3
 import pandas as pd
 from io import StringIO
 
+# Rows parsed at a time when only some users' transactions are kept
+CHUNK_ROWS = 200_000
+
+
+def load_all_transactions(user_ids=None):
+    """
+    Load the full transaction table from S3 in a single read
+    
+    Args:
+        user_ids (list): Only keep these users' transactions (None = everyone). The
+            file is streamed and filtered chunk by chunk, so memory is bounded by
+            the selected users, e.g. one shard of the population
+    
+    Returns:
+        pd.DataFrame: All transactions for all (or the selected) users
+    """
+    s3_client = boto3.client('s3')
+    bucket_name = "notifi-transaction-dataset"
+    key = "notifi-dump/transaction_data_final.csv"
+    
+    response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    if user_ids is None:
+        csv_content = response['Body'].read().decode('utf-8')
+        return pd.read_csv(StringIO(csv_content))
+    
+    selected = set(user_ids)
+    chunks = [
+        chunk[chunk['User_id'].isin(selected)]
+        for chunk in pd.read_csv(response['Body'], chunksize=CHUNK_ROWS)
+    ]
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
+def split_user_transactions(transactions, user_ids):
+    """
+    Per-user frames of a loaded transaction table, shaped like get_user_transactions()
+    
+    Args:
+        transactions (pd.DataFrame): Transactions of several users, e.g. from load_all_transactions(user_ids)
+        user_ids (list): Users to return frames for
+        
+    Returns:
+        dict: user_id -> pd.DataFrame with parsed Txn Date (empty for users without transactions)
+    """
+    by_user = {}
+    if not transactions.empty:
+        transactions = transactions.copy()
+        transactions['Txn Date'] = pd.to_datetime(transactions['Txn Date'], errors='coerce')
+        by_user = {user_id: frame for user_id, frame in transactions.groupby('User_id', sort=False)}
+    return {user_id: by_user.get(user_id, pd.DataFrame()) for user_id in user_ids}
+
+
 def get_user_transactions(user_id):
     """
     Get user transactions from S3 CSV file
@@ -0,0 +1,69 @@
+"""
+Local stand-in for a Bedrock chat model that fails on demand, shared by the manual tests
+"""
+import random
+import threading
+
+
+class InjectedModelError(Exception):
+    """
+    Error raised by FailureInjectingLLM, shaped like a botocore ClientError
+    """
+    def __init__(self, code):
+        super().__init__(f"An error occurred ({code}) when calling the InvokeModel operation")
+        self.response = {"Error": {"Code": code, "Message": "injected failure"}}
+
+
+class FailureInjectingLLM:
+    """
+    Local stand-in for a chat model that fails on demand
+
+    Either replays a fixed `failures` sequence (error codes, or None for a
+    successful call) or fails randomly with `failure_rate`. Successful calls
+    return `respond(prompt)` wrapped in a message-like object.
+
+    Example:
+        llm = FailureInjectingLLM(lambda p: '["CO1", "CO2", "CO3"]',
+                                  failures=["ThrottlingException", None])
+    """
+    def __init__(self, respond, failures=None, failure_rate=0.0, failure_code="ThrottlingException", seed=None):
+        self.respond = respond
+        self.failures = list(failures or [])
+        self.failure_rate = failure_rate
+        self.failure_code = failure_code
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _maybe_fail(self):
+        with self._lock:
+            self.calls += 1
+            if self.failures:
+                code = self.failures.pop(0)
+            elif self._random.random() < self.failure_rate:
+                code = self.failure_code
+            else:
+                code = None
+        if code:
+            raise InjectedModelError(code)
+
+    def invoke(self, prompt):
+        self._maybe_fail()
+        return _StubMessage(self.respond(prompt))
+
+    def stream(self, prompt):
+        self._maybe_fail()
+        text = self.respond(prompt)
+        for start in range(0, len(text), 8):
+            yield _StubMessage(text[start:start + 8])
+
+
+class _StubMessage:
+    """
+    Message-like object with the attributes agent_template reads from model responses
+    """
+    def __init__(self, content):
+        self.content = content
+        self.tool_calls = []
+        self.tool_call_chunks = []
+        self.usage_metadata = None
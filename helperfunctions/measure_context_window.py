@@ -104,6 +104,17 @@ def main():
     
     if optimized_pct_of_limit < 50:
         print("GOOD: Optimized data leaves plenty of room for other context and responses.")
+    
+    # Per-agent projections replace the rows with the aggregates each agent needs
+    sys.path.append('.')
+    from agents import projections
+    projection_input = user_transactions.rename(columns={'Amount': 'Txn Amount', 'Category': 'Txn Category', 'Mode': 'Txn Mode'})
+    print("\nPer-agent projections:")
+    for agent in projections.PROJECTIONS:
+        view = projections.project(agent, projection_input)
+        view_tokens = estimate_token_size(view)
+        print(f"{agent:<14} {len(view):>3} records / ~{view_tokens:,} tokens "
+              f"({(1 - view_tokens / optimized_tokens) * 100 if optimized_tokens else 0:.1f}% smaller than optimized rows)")
 
 if __name__ == "__main__":
     main()
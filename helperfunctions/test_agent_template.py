@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Exercise response parsing: the streaming JSON scanner and payload validation against the agent profiles
+"""
+import sys
+sys.path.append('.')
+from fake_llm import FailureInjectingLLM
+from agents import resilience
+from agents.agent_template import JsonPayloadScanner, parse_agent_response, stream_model, validate_payload
+from agents.generation_profiles import GENERATION_PROFILES
+
+
+def test_scanner_returns_values_split_across_chunks():
+    """A value should be returned once its closing bracket arrives, ignoring brackets inside strings"""
+    scanner = JsonPayloadScanner()
+    chunks = ['Here you go: {"note": "a } and', ' a \\" quote", "ids": ["CO', '1", "CO2"]', '} and then', ' more text']
+    values = [scanner.feed(chunk) for chunk in chunks]
+    assert values[:3] == [None, None, None]
+    assert values[3] == '{"note": "a } and a \\" quote", "ids": ["CO1", "CO2"]}'
+    assert values[4] is None
+    print("✓ value split over 4 chunks returned once complete")
+
+
+def test_scanner_continues_after_rejected_value():
+    """feed() without text should resume after a value the caller rejected"""
+    scanner = JsonPayloadScanner()
+    assert scanner.feed('[1, 2] then ["CO1", "CO2", "CO3"]') == '[1, 2]'
+    assert scanner.feed() == '["CO1", "CO2", "CO3"]'
+    assert scanner.feed() is None
+    print("✓ second value found after the first was rejected")
+
+
+def test_validate_id_lists():
+    """Recommendation payloads keep only well-formed IDs of the agent's catalog, up to the list length"""
+    coupons = GENERATION_PROFILES["coupons"]
+    assert validate_payload(["CO1", " CO2 ", "CO3", "CO4"], coupons) == ["CO1", "CO2", "CO3"]
+    assert validate_payload({"ids": ["CO7", "LN1", 5, "CO8"]}, coupons) == ["CO7", "CO8"]
+    for payload in (None, [], ["LN1"], {"ids": "CO1"}, "CO1"):
+        assert validate_payload(payload, coupons) is None, payload
+    print("✓ ID lists trimmed, filtered by prefix and rejected when empty")
+
+
+def test_validate_objects():
+    """Summary payloads need every required key"""
+    summary = GENERATION_PROFILES["financial_summary"]
+    complete = {"month": "06", "year": "2023", "ai_summary": "Steady month", "categories_expenses": {}}
+    assert validate_payload(complete, summary) == complete
+    assert validate_payload({"month": "06", "year": "2023"}, summary) is None
+    assert validate_payload(["06"], summary) is None
+    assert parse_agent_response("```json\n" + '{"month": "06", "year": "2023", "ai_summary": "", '
+                                '"categories_expenses": {}}\n```', summary)["month"] == "06"
+    print("✓ objects accepted only with every required key, also inside code fences")
+
+
+def test_stream_stops_at_first_valid_payload():
+    """Streaming should skip an invalid value and stop at the first payload that validates"""
+    llm = FailureInjectingLLM(
+        lambda prompt: 'Considering ["XX1"] first. Final: ["CO4", "CO5", "CO6"]\n\nBecause the user...' + "x" * 400)
+    raw_output, payload, call_stats = stream_model(llm, "prompt", GENERATION_PROFILES["coupons"])
+    assert payload == ["CO4", "CO5", "CO6"]
+    assert call_stats["stopped_early"]
+    assert len(raw_output) < 100, "the trailing text should not have been read"
+    print(f"✓ stream stopped after {len(raw_output)} characters with {payload}")
+
+
+if __name__ == "__main__":
+    test_scanner_returns_values_split_across_chunks()
+    test_scanner_continues_after_rejected_value()
+    test_validate_id_lists()
+    test_validate_objects()
+    test_stream_stops_at_first_valid_payload()
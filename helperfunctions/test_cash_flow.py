@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Check that the feature store, spending tags and agent projections agree on income and spending
+"""
+import os
+import sys
+import pandas as pd
+sys.path.append('.')
+from agents.projections import loans_projection, savings_projection
+from feature_store import compute_features
+from spending_tags import build_spend_matrix
+
+
+# Sample data generated by data/data_generation
+TRANSACTIONS_PATH = "data/data_generation/transaction_data/transaction_data_final.csv"
+
+
+def edge_case_transactions():
+    """One month holding a refund, a transfer in, a savings transfer and an unparseable amount"""
+    rows = [
+        ("INCOME_WAGES", -3000.0),
+        ("INCOME_WAGES", 120.0),
+        ("TRANSFER_IN_SAVINGS", 500.0),
+        ("TRANSFER_OUT_SAVINGS", 400.0),
+        ("TRANSFER_OUT_INVESTMENT_AND_RETIREMENT_FUNDS", 250.0),
+        ("FOOD_AND_DRINK_RESTAURANT", 80.0),
+        ("FOOD_AND_DRINK_RESTAURANT", -15.0),
+        ("LOAN_PAYMENTS_MORTGAGE_PAYMENT", 1200.0),
+        ("TRAVEL_FLIGHTS", "n/a"),
+    ]
+    return pd.DataFrame({
+        "User_id": "U1",
+        "Txn Date": "2025-06-15",
+        "Txn Category": [category for category, _ in rows],
+        "Txn Amount": [amount for _, amount in rows],
+        "Merchant Name": "Merchant",
+        "Txn Mode": "Card",
+    })
+
+
+def totals_by_module(transactions):
+    """(user, month) -> {module: (income, spending, saved)} from each module's own aggregation"""
+    totals = {}
+    features = compute_features(transactions)
+    for key, row in features.iterrows():
+        totals.setdefault(key, {})["feature_store"] = (row["income"], row["spending"], row["spend_investing"])
+
+    matrix, income, spending = build_spend_matrix(transactions)
+    saved = matrix[[c for c in matrix.columns if c.startswith("TRANSFER_OUT_")]].sum(axis=1)
+    for key in matrix.index:
+        totals.setdefault(key, {})["spending_tags"] = (income[key], spending[key], saved[key])
+
+    for user_id, user_transactions in transactions.groupby("User_id"):
+        loans = {record["month"]: record for record in loans_projection(user_transactions)[1:]}
+        savings = {record["month"]: record for record in savings_projection(user_transactions)[1:]}
+        for month, record in loans.items():
+            totals.setdefault((user_id, month), {})["projections"] = (
+                record["income"], record["spend"], savings[month]["saved"])
+    return totals
+
+
+def assert_modules_agree(transactions):
+    totals = totals_by_module(transactions)
+    for key, modules in totals.items():
+        assert set(modules) == {"feature_store", "spending_tags", "projections"}, (key, modules)
+        for module, values in modules.items():
+            for name, value, expected in zip(("income", "spending", "saved"), values, modules["feature_store"]):
+                assert abs(value - expected) < 0.01, f"{key} {name}: {module} has {value}, feature store {expected}"
+    return totals
+
+
+def test_modules_agree_on_edge_cases():
+    """Refunds, transfers in and bad amounts count the same way in every module"""
+    totals = assert_modules_agree(edge_case_transactions())
+    income, spending, saved = totals[("U1", "2025-06")]["feature_store"]
+    assert (income, spending, saved) == (3000.0, 1280.0, 650.0), (income, spending, saved)
+    print(f"✓ income {income:,.0f}, spending {spending:,.0f} and saved {saved:,.0f} agree across modules")
+
+
+def test_modules_agree_on_sample_data():
+    """Every user and month of the sample data has the same totals in every module"""
+    if not os.path.exists(TRANSACTIONS_PATH):
+        print(f"Skipping: {TRANSACTIONS_PATH} not found")
+        return
+    totals = assert_modules_agree(pd.read_csv(TRANSACTIONS_PATH))
+    print(f"✓ {len(totals)} user months agree across the feature store, spending tags and projections")
+
+
+if __name__ == "__main__":
+    test_modules_agree_on_edge_cases()
+    test_modules_agree_on_sample_data()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Exercise segment email templates with many users of one segment processed concurrently
+"""
+import json
+import sys
+import threading
+import time
+sys.path.append('.')
+from agents import email_notification_agent
+
+
+TEMPLATES = {key: f"{{first_name}}, your {key.replace('_email', '')} update"
+             for key in ("spending_summary_email", "coupons_email", "loans_email", "credit_cards_email",
+                         "savings_email")}
+
+
+def email_context(first_name):
+    return {"user": {"first_name": first_name}, "latest_month": {},
+            "segment": {"credit_tier": "good", "life_stage": "early career", "top_category": "dining",
+                        "top_product_ids": {"top_coupon": "CO1"}}}
+
+
+def run_concurrently(users, response):
+    """Email every user from its own thread with a slow model returning `response`
+
+    Returns:
+        tuple: (results by user, number of template calls, most calls in flight at once)
+    """
+    calls = {"count": 0, "active": 0, "peak": 0}
+    lock = threading.Lock()
+    results = {}
+
+    def generate(segment):
+        with lock:
+            calls["count"] += 1
+            calls["active"] += 1
+            calls["peak"] = max(calls["peak"], calls["active"])
+        time.sleep(0.05)
+        with lock:
+            calls["active"] -= 1
+        return response
+
+    original = email_notification_agent.generate_segment_templates
+    email_notification_agent.generate_segment_templates = generate
+    try:
+        store = email_notification_agent._TemplateCache()
+        threads = [threading.Thread(target=lambda name=name: results.__setitem__(
+            name, email_notification_agent.segment_email_notifications(email_context(name), store)))
+            for name in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        email_notification_agent.generate_segment_templates = original
+    return results, calls["count"], calls["peak"]
+
+
+def test_one_model_call_per_segment():
+    """Concurrent users of one segment should share a single template call"""
+    users = [f"User{i}" for i in range(8)]
+    results, calls, _ = run_concurrently(users, json.dumps(TEMPLATES))
+    assert calls == 1, f"{calls} template calls for one segment"
+    assert json.loads(results["User3"])["coupons_email"] == "User3, your coupons update"
+    assert email_notification_agent._segment_locks == {}, "segment locks should be released"
+    print(f"✓ {len(users)} concurrent users of one segment made 1 template call")
+
+
+def test_unparseable_templates_release_the_lock():
+    """Templates that fail to parse should be retried one user at a time and leave no lock behind"""
+    users = [f"User{i}" for i in range(4)]
+    results, calls, peak = run_concurrently(users, "not a template")
+    assert all(result == "not a template" for result in results.values())
+    assert calls == len(users) and peak == 1, (calls, peak)
+    assert email_notification_agent._segment_locks == {}, "segment locks should be released"
+    print(f"✓ {calls} failed template calls made one at a time, no segment lock left behind")
+
+
+if __name__ == "__main__":
+    test_one_model_call_per_segment()
+    test_unparseable_templates_release_the_lock()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Exercise delta ingestion: watermarks and the users found to have new transactions
+"""
+import sys
+import pandas as pd
+sys.path.append('.')
+from ingestion import find_user_deltas, latest_watermark
+
+
+def transactions(rows):
+    return pd.DataFrame(rows, columns=['User_id', 'Txn ID', 'Txn Date', 'Txn Amount'])
+
+
+def test_watermark_orders_ids_numerically():
+    """TU1010010 is newer than TU101002 on the same day, although it sorts first as text"""
+    frame = transactions([
+        ("U1", "TU101001", "2023-06-30", 10.0),
+        ("U1", "TU101002", "2023-06-30", 20.0),
+        ("U1", "TU1010010", "2023-06-30", 30.0),
+        ("U1", "TU1010011", "2023-05-01", 40.0),
+    ])
+    assert latest_watermark(frame) == ("2023-06-30", "TU1010010")
+    assert latest_watermark(frame.iloc[0:0]) is None
+    print("✓ watermark is the numerically latest ID of the latest day")
+
+
+def test_deltas_after_watermark():
+    """Only users with transactions after their watermark are returned, with their affected months"""
+    frame = transactions([
+        ("U1", "TU101001", "2023-06-29", 10.0),
+        ("U1", "TU101002", "2023-06-30", 20.0),
+        ("U1", "TU1010010", "2023-06-30", 30.0),
+        ("U1", "TU1010011", "2023-07-02", 40.0),
+        ("U2", "TU201001", "2023-06-30", 50.0),
+        ("U3", "TU301001", "2023-05-15", 60.0),
+    ])
+    watermarks = {"U1": ("2023-06-30", "TU101002"), "U2": ("2023-06-30", "TU201001")}
+    deltas = {delta.user_id: delta for delta in find_user_deltas(frame, watermarks)}
+
+    assert sorted(deltas) == ["U1", "U3"], sorted(deltas)
+    assert deltas["U1"].new_rows == 2
+    assert deltas["U1"].affected_months == ["2023-06", "2023-07"]
+    assert deltas["U1"].watermark == ("2023-07-02", "TU1010011")
+    assert len(deltas["U1"].transactions) == 4, "a delta carries the user's full history"
+    assert deltas["U3"].new_rows == 1 and deltas["U3"].watermark == ("2023-05-15", "TU301001")
+
+    # Processing up to the new watermarks leaves nothing to do
+    watermarks.update({user_id: delta.watermark for user_id, delta in deltas.items()})
+    assert find_user_deltas(frame, watermarks) == []
+    assert [d.user_id for d in find_user_deltas(frame, {}, ["U3", "U2"])] == ["U3", "U2"]
+    print(f"✓ {len(deltas)} users with new transactions found, none after advancing their watermarks")
+
+
+if __name__ == "__main__":
+    test_watermark_orders_ids_numerically()
+    test_deltas_after_watermark()
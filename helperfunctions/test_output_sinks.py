@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Exercise the output sinks and background writer against a local DynamoDB stand-in
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import zstandard
+sys.path.append('.')
+from output_sinks import (BackgroundWriter, DynamoDBSink, FanOutSink, FileSink, LocalDynamoDBClient,
+                          LocalDynamoDBTable, SkipUnchangedSink, build_item)
+from run_artifact import RunArtifact, RunArtifactWriter
+from run_store import RunManifest, RunStore
+from output_codec import OutputCodec, train_dictionary
+from upload_to_dynamodb import BatchUploader, read_output_files
+
+
+def sample_output(user_id):
+    return {
+        "userinfo": {"User_id": user_id, "Credit_score": 720},
+        "tags": ["Foodie", "Commuter"],
+        "recommendations": {"coupons": [{"coupon_id": "CO1"}]},
+        "monthly_spend_analysis_data": [{"month": "06", "year": "2025", "total_spending": 2100.5}],
+    }
+
+
+def test_fan_out_writes_file_and_table():
+    """Every submitted output should reach both sinks and run its callback"""
+    table = LocalDynamoDBTable()
+    written = []
+    with tempfile.TemporaryDirectory() as directory:
+        writer = BackgroundWriter(FanOutSink([FileSink(directory), DynamoDBSink(table=table)]), max_pending=2)
+        for i in range(10):
+            writer.submit(f"U{i}", sample_output(f"U{i}"), on_written=lambda i=i: written.append(i))
+        writer.close()
+
+        assert len(os.listdir(directory)) == 10
+        with open(os.path.join(directory, "output_U3.json")) as f:
+            assert json.load(f) == sample_output("U3")
+    item = table.get_item(Key={'user_id': 'U3'})['Item']
+    assert json.loads(item['output']) == sample_output("U3")
+    assert sorted(written) == list(range(10))
+    print(f"✓ {writer.written} outputs written to file and table")
+
+
+def test_failed_write_is_reported():
+    """An item over the 400 KB limit should be reported without stopping the writer"""
+    table = LocalDynamoDBTable()
+    writer = BackgroundWriter(DynamoDBSink(table=table))
+    huge = sample_output("U1")
+    huge["monthly_spend_analysis_data"] = [{"ai_summary": "x" * 500_000}]
+    writer.submit("U1", huge)
+    writer.submit("U2", sample_output("U2"))
+    writer.close()
+
+    assert writer.failed_users == ["U1"]
+    assert list(table.items) == ["U2"]
+    print("✓ oversized item reported, later items still written")
+
+
+def test_submit_blocks_when_queue_is_full():
+    """A slow sink should hold back producers once max_pending outputs are waiting"""
+    release = threading.Event()
+
+    class SlowSink:
+        def write(self, user_id, output):
+            release.wait()
+
+        def close(self):
+            pass
+
+    writer = BackgroundWriter(SlowSink(), max_pending=1)
+    writer.submit("U1", {})
+    writer.submit("U2", {})
+    producer = threading.Thread(target=writer.submit, args=("U3", {}))
+    producer.start()
+    producer.join(timeout=0.2)
+    assert producer.is_alive(), "submit should block while the queue is full"
+    release.set()
+    producer.join()
+    writer.close()
+    assert writer.written == 3
+    print("✓ submit blocked until the writer caught up")
+
+
+def test_compressed_item_round_trip():
+    """Compressed Binary items should decode to the original output, with or without a dictionary"""
+    outputs = [sample_output(f"U{i}") for i in range(200)]
+    for codec in (OutputCodec(), OutputCodec(train_dictionary(outputs, size=4096))):
+        table = LocalDynamoDBTable()
+        DynamoDBSink(table=table, codec=codec).write("U1", outputs[1])
+        item = table.get_item(Key={'user_id': 'U1'})['Item']
+        assert isinstance(item['output'], bytes)
+        assert codec.decode_item(item) == outputs[1]
+        print(f"✓ {item['output_format']} item of {len(item['output'])} bytes "
+              f"(JSON {len(json.dumps(outputs[1]))} bytes) decoded")
+
+
+def test_switching_file_format_keeps_one_file_per_user():
+    """Switching --compress on should replace a user's JSON file, and uploads should read each user once"""
+    codec = OutputCodec()
+    with tempfile.TemporaryDirectory() as directory:
+        FileSink(directory).write("U1", sample_output("U1"))
+        updated = sample_output("U1")
+        updated["tags"] = ["Saver"]
+        FileSink(directory, codec=codec).write("U1", updated)
+        assert os.listdir(directory) == ["output_U1.json.zst"]
+
+        # Both formats left behind by an older version: the newer file wins
+        FileSink(directory, codec=codec).write("U2", sample_output("U2"))
+        with open(os.path.join(directory, "output_U2.json"), 'w') as f:
+            json.dump(updated, f)
+        os.utime(os.path.join(directory, "output_U2.json.zst"), (0, 0))
+        outputs = dict(read_output_files(directory, codec))
+        assert sorted(outputs) == ["U1", "U2"]
+        assert outputs["U1"] == updated and outputs["U2"] == updated
+    print("✓ one output file per user after a format switch, newest file uploaded")
+
+
+def test_unchanged_outputs_are_skipped():
+    """A second run with one changed user should write only that user"""
+    table = LocalDynamoDBTable()
+    with tempfile.TemporaryDirectory() as directory:
+        store = RunStore(os.path.join(directory, "run_store.sqlite"))
+        for run, changed in enumerate([None, "U4"]):
+            sink = SkipUnchangedSink(DynamoDBSink(table=table), store)
+            for i in range(10):
+                output = sample_output(f"U{i}")
+                if f"U{i}" == changed:
+                    output["tags"] = ["Saver"]
+                sink.write(f"U{i}", output)
+            sink.close()
+        store.close()
+
+    assert (sink.written, sink.skipped) == (1, 9)
+    assert table.put_calls == 11
+    assert 'output_digest' in table.get_item(Key={'user_id': 'U4'})['Item']
+    print("✓ rerun wrote 1 changed output and skipped 9")
+
+
+def test_run_artifact_round_trip():
+    """A multi-shard artifact should stream back every output in order and serve single users by offset"""
+    with tempfile.TemporaryDirectory() as directory:
+        writer = BackgroundWriter(RunArtifactWriter(directory, shard_bytes=2048))
+        for i in range(100):
+            writer.submit(f"U{i}", sample_output(f"U{i}"))
+        writer.close()
+
+        artifact = RunArtifact(directory)
+        records = list(artifact)
+        assert [user_id for user_id, _ in records] == [f"U{i}" for i in range(100)]
+        assert records[42][1] == sample_output("U42")
+        assert artifact.get("U77") == sample_output("U77")
+        assert artifact.get("U1000") is None
+        print(f"✓ {len(artifact)} outputs read back from {len(artifact.manifest['shards'])} shards")
+
+
+def test_unclosed_run_artifact_is_readable():
+    """An artifact still being written should be readable from its index without a manifest"""
+    with tempfile.TemporaryDirectory() as directory:
+        writer = RunArtifactWriter(directory, shard_bytes=2048)
+        for i in range(20):
+            writer.write(f"U{i}", sample_output(f"U{i}"))
+        artifact = RunArtifact(directory)
+        assert [user_id for user_id, _ in artifact] == [f"U{i}" for i in range(20)]
+        assert artifact.get("U7") == sample_output("U7") and artifact.manifest["records"] == 20
+        writer.close()
+    print(f"✓ {len(artifact)} outputs read from an open artifact before its manifest was written")
+
+
+def test_run_manifest_resume():
+    """A resumed run should see the stages and outputs the interrupted run recorded"""
+    with tempfile.TemporaryDirectory() as directory:
+        store = RunStore(os.path.join(directory, "run_store.sqlite"))
+        manifest = RunManifest.start(store, {"delta": False}, "run-1")
+        manifest.put("U1", "recommendations", {"coupons": ["CO1"]})
+        manifest.put("U1", "output")
+        manifest.put("U2", "summary:2025-06", {"month": "06"})
+
+        try:
+            RunManifest.start(store, {"delta": False}, "run-1")
+        except ValueError as e:
+            assert "--resume run-1" in str(e)
+        else:
+            raise AssertionError("starting an existing run ID should fail")
+
+        resumed = RunManifest.resume(store, {"delta": False})
+        assert resumed.run_id == "run-1"
+        assert resumed.get("U1", "recommendations") == {"coupons": ["CO1"]}
+        assert resumed.get("U2", "summary:2025-06") == {"month": "06"}
+        assert resumed.get("U2", "email") is None
+        assert resumed.completed_users() == {"U1"} and resumed.reused == 2
+        resumed.finish()
+        assert store.latest_unfinished_run() is None
+        store.close()
+    print("✓ resumed run read back 2 stage results and 1 completed user")
+
+
+def test_run_artifact_resume_after_crash():
+    """Resuming should cut a torn record, drop records the manifest never marked done and keep one per user"""
+    with tempfile.TemporaryDirectory() as directory:
+        writer = RunArtifactWriter(directory, shard_bytes=512)
+        for i in range(10):
+            writer.write(f"U{i}", sample_output(f"U{i}"))
+        # Crash: U3, U8 and U9 were written but the manifest only marked the other users done,
+        # and the last record and index line were cut short
+        writer._shard.write(b"\x28\xb5\x2f\xfd partial frame")
+        writer._index.write("U10\t3\t")
+        writer._shard.close()
+        writer._index.close()
+
+        # Readable before the resumed run closes it, without a manifest
+        crashed = RunArtifact(directory)
+        assert len(crashed) == 10 and crashed.get("U9") == sample_output("U9")
+
+        writer = RunArtifactWriter(directory, shard_bytes=512, resume=True,
+                                   completed_users={f"U{i}" for i in range(8)} - {"U3"})
+        assert writer.records == 7
+        for i in (3, 8, 9, 10):
+            output = sample_output(f"U{i}")
+            output["tags"] = ["Resumed"]
+            writer.write(f"U{i}", output)
+        writer.close()
+
+        artifact = RunArtifact(directory)
+        user_ids = [user_id for user_id, _ in artifact]
+        assert sorted(user_ids) == sorted(f"U{i}" for i in range(11)), user_ids
+        assert len(artifact) == 11 and artifact.manifest["records"] == 11
+        assert artifact.get("U9")["tags"] == ["Resumed"] and artifact.get("U3")["tags"] == ["Resumed"]
+        assert artifact.get("U4") == sample_output("U4")
+
+        # Decompressing whole shards, as `zstd -d` does, yields no superseded records
+        streamed = []
+        for name in artifact.manifest["shards"]:
+            assert os.path.getsize(os.path.join(directory, name)) > 0, f"{name} is empty"
+            with open(os.path.join(directory, name), 'rb') as f:
+                reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+                streamed += [json.loads(line)["user_id"] for line in reader.read().splitlines()]
+        assert sorted(streamed) == sorted(user_ids), streamed
+    print(f"✓ resumed artifact holds {len(user_ids)} users once each across {len(artifact.manifest['shards'])} shards")
+
+
+def no_sleep(seconds):
+    pass
+
+
+def test_batch_uploader_retries_unprocessed_items():
+    """Items left unprocessed by a capacity-starved table should all land after retries"""
+    client = LocalDynamoDBClient(unprocessed_rate=0.3, seed=7)
+    uploader = BatchUploader("UserRecommendations", max_workers=4, client=client, sleep=no_sleep)
+    stats = uploader.upload(build_item(f"U{i}", sample_output(f"U{i}")) for i in range(1000))
+
+    assert stats["written"] == 1000 and stats["failed"] == 0
+    assert len(client.tables["UserRecommendations"]) == 1000
+    assert stats["retries"] > 0
+    print(f"✓ 1000 items in {client.calls} batch calls with {stats['retries']} retries "
+          f"({stats['items_per_second']:,.0f} items/s)")
+
+
+if __name__ == "__main__":
+    test_fan_out_writes_file_and_table()
+    test_failed_write_is_reported()
+    test_submit_blocks_when_queue_is_full()
+    test_compressed_item_round_trip()
+    test_switching_file_format_keeps_one_file_per_user()
+    test_unchanged_outputs_are_skipped()
+    test_run_artifact_round_trip()
+    test_unclosed_run_artifact_is_readable()
+    test_run_manifest_resume()
+    test_run_artifact_resume_after_crash()
+    test_batch_uploader_retries_unprocessed_items()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Exercise the --plan dry run on the local sample data: predicted calls, skipped calls and no side effects
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import pandas as pd
+sys.path.append('.')
+import main_pipeline
+from agents import telemetry
+from agents.generation_profiles import GENERATION_PROFILES
+from planner import RunPlan, TokenCounter
+from run_store import RunManifest, RunStore
+
+
+# Sample data generated by data/data_generation, used in place of the S3 bucket
+DATA_DIRECTORY = os.path.abspath("data/data_generation")
+USERS = ["U1", "U2", "U3", "U4"]
+
+
+def use_local_data():
+    """Point the pipeline's S3 reads at the sample CSVs, limited to USERS"""
+    transactions = pd.read_csv(os.path.join(DATA_DIRECTORY, "transaction_data", "transaction_data_final.csv"))
+    transactions = transactions[transactions['User_id'].isin(USERS)]
+    main_pipeline.read_csv_from_s3 = lambda bucket, key: pd.read_csv(os.path.join(DATA_DIRECTORY, os.path.basename(key)))
+    main_pipeline.get_user_ids = lambda: list(USERS)
+    main_pipeline.load_all_transactions = lambda user_ids=None: transactions
+    return transactions
+
+
+def plan_in(directory, **options):
+    """Run a dry run with every state and log path inside `directory`"""
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        return main_pipeline.run_pipeline(store_path="state/run_store.sqlite", feature_path="state/features.npz",
+                                          telemetry_path="logs/llm_calls.jsonl", plan=True, **options)
+    finally:
+        os.chdir(cwd)
+
+
+def dump(path):
+    connection = sqlite3.connect(path)
+    try:
+        return list(connection.iterdump())
+    finally:
+        connection.close()
+
+
+def test_plan_counts_calls_without_side_effects():
+    """Every agent request is either a planned call or a skip, and nothing is written"""
+    transactions = use_local_data()
+    months = int(transactions.assign(month=transactions['Txn Date'].str[:7]).groupby('User_id')['month'].nunique().sum())
+    with tempfile.TemporaryDirectory() as directory:
+        plan = plan_in(directory)
+        assert os.listdir(directory) == [], f"a dry run should leave no files: {os.listdir(directory)}"
+
+    expected = {"coupons": len(USERS), "loans": len(USERS), "credit_cards": len(USERS), "savings": len(USERS),
+                "financial_summary": months, "email_notification": len(USERS)}
+    for agent, requests in expected.items():
+        stats = plan.agents.get(agent, {"calls": 0, "skipped": {}})
+        assert stats["calls"] + sum(stats["skipped"].values()) == requests, (agent, stats)
+    assert plan.agents["financial_summary"]["calls"] == months
+    assert plan.agents["credit_cards"]["skipped"] == {"rules": 1}, "U1's card list is decided by the rules"
+    assert set(plan.users) == set(USERS)
+    assert plan.totals()["calls"] == sum(stats["calls"] for stats in plan.agents.values())
+    print(f"✓ {plan.totals()['calls']} calls planned for {len(USERS)} users ({months} months), no files written")
+
+
+def test_plan_of_resume_skips_checkpoints_and_leaves_store_alone():
+    """Planning a resume counts checkpointed stages as skipped and completed users not at all"""
+    use_local_data()
+    with tempfile.TemporaryDirectory() as directory:
+        store_path = os.path.join(directory, "state", "run_store.sqlite")
+        store = RunStore(store_path)
+        config = {"delta": False, "cohort_threshold": None, "email_segments": False, "outputs": ["file"],
+                  "compress": False}
+        manifest = RunManifest.start(store, config, "run-1")
+        manifest.put("U1", "output")
+        for rec_key, product_ids in [("coupons", ["CO1", "CO2", "CO3"]), ("loans", ["LN1", "LN2", "LN3"]),
+                                     ("credit_cards", ["CC1", "CC2", "CC3"]),
+                                     ("high_yield_savings", ["HY1", "HY2", "HY3"])]:
+            manifest.put("U2", f"recommendations:{rec_key}", product_ids)
+        manifest.put("U3", "recommendations:coupons", ["CO4", "CO5", "CO6"])
+        store.close()
+        before = dump(store_path)
+
+        plan = plan_in(directory, resume="run-1")
+        assert dump(store_path) == before, "a dry run must not write to the run store"
+        assert not os.path.exists(os.path.join(directory, "output"))
+
+    assert set(plan.users) == {"U2", "U3", "U4"}, "the completed user needs no calls"
+    assert plan.agents["coupons"]["calls"] == 1 and plan.agents["coupons"]["skipped"] == {"checkpoint": 2}
+    assert plan.agents["loans"]["calls"] == 2 and plan.agents["loans"]["skipped"] == {"checkpoint": 1}
+    print(f"✓ resume planned for 3 users, skipped {plan.agents['coupons']['skipped']}, run store unchanged")
+
+
+def email_context(first_name, products):
+    return {"user": {"first_name": first_name}, "latest_month": {}, "products": products,
+            "segment": {"credit_tier": "good", "life_stage": "early career", "top_category": "dining",
+                        "top_product_ids": {"top_coupon": "CO1"}, "products": products}}
+
+
+def test_segment_templates_are_planned_once():
+    """Users of one segment share a single template call, whatever their trimmed products"""
+    plan = RunPlan(counter=TokenCounter(encoding=None), output_tokens={})
+    telemetry.set_sink(plan)
+    try:
+        plan.add_email_call(email_context("Ana", [{"product_id": "CO1", "key_feature": "10% off dining"}]), True)
+        plan.add_email_call(email_context("Ben", []), True)
+        plan.add_email_call(email_context("Cy", []), True)
+        plan.add_email_call(email_context("Di", []), False)
+    finally:
+        telemetry.set_sink(None)
+
+    stats = plan.agents["email_notification"]
+    assert stats["calls"] == 2 and stats["skipped"] == {"segment": 2}, stats
+    assert stats["output_tokens"] == 2 * GENERATION_PROFILES["email_notification"].max_tokens
+    print(f"✓ 3 users of one segment planned as 1 template call, {stats['skipped']['segment']} skipped")
+
+
+if __name__ == "__main__":
+    test_plan_counts_calls_without_side_effects()
+    test_plan_of_resume_skips_checkpoints_and_leaves_store_alone()
+    test_segment_templates_are_planned_once()
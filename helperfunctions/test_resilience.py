@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Exercise the model call retry and concurrency layer against a local failure-injecting stub
+"""
+import sys
+import threading
+sys.path.append('.')
+from fake_llm import FailureInjectingLLM
+from agents import resilience
+
+
+def no_sleep(seconds):
+    pass
+
+
+def test_retry_recovers_from_throttling():
+    """Two throttled calls followed by a success should return the answer after 2 retries"""
+    llm = FailureInjectingLLM(
+        lambda prompt: '["CO1", "CO2", "CO3"]',
+        failures=["ThrottlingException", "ThrottlingException", None]
+    )
+    limiter = resilience.AdaptiveConcurrencyLimiter(initial_limit=8)
+    counters = resilience.ResilienceStats()
+
+    response, retries = resilience.call_with_retry(
+        lambda: llm.invoke("prompt"), limiter=limiter, counters=counters, sleep=no_sleep
+    )
+
+    assert response.content == '["CO1", "CO2", "CO3"]'
+    assert retries == 2
+    assert counters.snapshot()["throttled"] == 2
+    assert limiter.limit < 8, "throttling should shrink the concurrency limit"
+    print(f"✓ recovered after {retries} retries, limit shrank to {limiter.limit:.2f}")
+
+
+def test_permanent_error_is_not_retried():
+    """Validation errors must surface immediately instead of becoming default output"""
+    llm = FailureInjectingLLM(lambda prompt: "[]", failures=["ValidationException"])
+    counters = resilience.ResilienceStats()
+
+    try:
+        resilience.call_with_retry(lambda: llm.invoke("prompt"), counters=counters, sleep=no_sleep)
+        raise AssertionError("expected ModelCallError")
+    except resilience.ModelCallError as e:
+        assert e.category == resilience.PERMANENT
+        assert e.attempts == 1
+    print("✓ permanent error raised without retrying")
+
+
+def test_exhausted_retries_raise():
+    """A model that keeps throttling should fail loudly after max_attempts"""
+    llm = FailureInjectingLLM(lambda prompt: "[]", failure_rate=1.0)
+    policy = resilience.RetryPolicy(max_attempts=3)
+
+    try:
+        resilience.call_with_retry(lambda: llm.invoke("prompt"), policy=policy, sleep=no_sleep)
+        raise AssertionError("expected ModelCallError")
+    except resilience.ModelCallError as e:
+        assert e.category == resilience.THROTTLED
+        assert llm.calls == 3
+    print("✓ gave up after 3 throttled attempts")
+
+
+def test_limiter_caps_in_flight_calls():
+    """Concurrent callers should never exceed the shared limit"""
+    limiter = resilience.AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+    llm = FailureInjectingLLM(lambda prompt: "[]", failure_rate=0.3, seed=7)
+    peak = {"value": 0}
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            peak["value"] = max(peak["value"], limiter.in_flight)
+        return llm.invoke("prompt")
+
+    def worker():
+        for _ in range(20):
+            resilience.call_with_retry(call, limiter=limiter, sleep=no_sleep)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak["value"] <= 2
+    print(f"✓ peak in-flight calls {peak['value']} with {limiter.throttle_events} throttle events")
+
+
+if __name__ == "__main__":
+    test_retry_recovers_from_throttling()
+    test_permanent_error_is_not_retried()
+    test_exhausted_retries_raise()
+    test_limiter_caps_in_flight_calls()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Exercise the rules fast path: decisive rankings are decided locally, everything else goes to the model
+"""
+import sys
+sys.path.append('.')
+from agents import rules_recommender
+
+
+def loan(loan_id, loan_type, required_credit_score="600+"):
+    return {"loan_id": loan_id, "loan_type": loan_type, "required_credit_score": required_credit_score}
+
+
+LOANS = [
+    loan("LN1", "Federal Student Loan"),
+    loan("LN2", "Private Student Loan"),
+    loan("LN3", "Student Loan Refinance"),
+    loan("LN4", "Personal Loan"),
+    loan("LN5", "Auto Loan"),
+    loan("LN6", "Personal Line of Credit"),
+]
+
+
+def test_decisive_ranking_is_decided():
+    """A clear top 3 (goal matches far ahead of the rest) should be decided without the model"""
+    user = {"Credit_score": 700, "Financial_goals": "Pay for education"}
+    decision = rules_recommender.recommend("loans", user, None, LOANS)
+    assert decision is not None
+    product_ids, reason = decision
+    assert sorted(product_ids) == ["LN1", "LN2", "LN3"] and "margin" in reason
+    print(f"✓ decided {product_ids} ({reason})")
+
+
+def test_close_ranking_goes_to_the_model():
+    """Without a goal match the scores are close, so the model should decide"""
+    user = {"Credit_score": 700, "Financial_goals": "Travel the world"}
+    assert rules_recommender.recommend("loans", user, None, LOANS) is None
+    print("✓ close ranking deferred to the model")
+
+
+def test_emergency_goal_does_not_favour_loans():
+    """An emergency fund is a savings goal; it must not push personal loans to the top"""
+    user = {"Credit_score": 700, "Financial_goals": "Build an emergency fund"}
+    scores = dict(rules_recommender.score_loans(user, None, LOANS))
+    assert scores["LN4"] == scores["LN5"], scores
+    assert rules_recommender.recommend("loans", user, None, LOANS) is None
+    print("✓ emergency fund goal gives personal loans no bonus")
+
+
+def test_short_lists_are_never_decided():
+    """With fewer eligible products than the list length the rules decline; exactly enough is decided"""
+    user = {"Credit_score": 620, "Financial_goals": "Pay for education"}
+    one_eligible = [loan("LN1", "Federal Student Loan")] + [loan(f"LN{i}", "Auto Loan", "750+") for i in range(2, 6)]
+    assert rules_recommender.recommend("loans", user, None, one_eligible) is None
+    three_eligible = LOANS[:3] + [loan("LN9", "Auto Loan", "750+")]
+    product_ids, reason = rules_recommender.recommend("loans", user, None, three_eligible)
+    assert len(product_ids) == 3 and reason == "only 3 eligible"
+    print(f"✓ 1 eligible product deferred to the model, 3 decided ({reason})")
+
+
+if __name__ == "__main__":
+    test_decisive_ranking_is_decided()
+    test_close_ranking_goes_to_the_model()
+    test_emergency_goal_does_not_favour_loans()
+    test_short_lists_are_never_decided()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Exercise user sharding and the merge of shard manifests
+"""
+import sys
+sys.path.append('.')
+from sharding import Shard, shard_of
+from merge_shards import merge_manifests
+
+
+USERS = [f"U{i}" for i in range(10000)]
+
+
+def test_shards_partition_the_users():
+    """Every user should land in exactly one shard, with shards of similar size"""
+    shards = [Shard(index, 8) for index in range(8)]
+    selected = [shard.select(USERS) for shard in shards]
+    assert sorted(user for users in selected for user in users) == sorted(USERS)
+    assert sum(len(users) for users in selected) == len(set(user for users in selected for user in users))
+    sizes = [len(users) for users in selected]
+    assert max(sizes) - min(sizes) < len(USERS) / 8 * 0.15, sizes
+    assert selected[3] == [user for user in USERS if user in set(selected[3])], "selection keeps the input order"
+    print(f"✓ {len(USERS)} users split into 8 disjoint shards of {min(sizes)}-{max(sizes)}")
+
+
+def test_assignment_is_stable():
+    """The same user maps to the same shard every time and for any input order"""
+    first = {user: shard_of(user, 8) for user in USERS[:500]}
+    assert all(shard_of(user, 8) == shard for user, shard in first.items())
+    assert Shard(5, 8).select(list(reversed(USERS))) == list(reversed(Shard(5, 8).select(USERS)))
+    assert shard_of(42, 8) == shard_of("42", 8), "IDs read as numbers or text share a shard"
+    assert Shard(2, 8).path("state/run_store.sqlite") == "state/run_store.shard-002-of-008.sqlite"
+    for index, count in [(-1, 4), (4, 4), (0, 0)]:
+        try:
+            Shard(index, count)
+        except ValueError:
+            continue
+        raise AssertionError(f"Shard({index}, {count}) should be rejected")
+    print("✓ shard assignment stable across calls and input order")
+
+
+def manifest(index, count=4, failed=(), run_id="run-1"):
+    return {"run_id": run_id, "shard_index": index, "shard_count": count, "users": 10, "processed": 10,
+            "completed": 10 - len(failed), "failed_users": list(failed), "elapsed": 10.0 + index,
+            "call_stats": {"coupons": {"calls": 10, "cache_hits": 2, "input_tokens": 100, "output_tokens": 10,
+                                       "retries": 1, "fallbacks": 0, "latency_p50": 1.0,
+                                       "latency_p95": 2.0 + index, "latency_p99": 3.0}},
+            "retries": {"retries": 1}, "rules": {"considered": {"loans": 10}, "decided": {"loans": 2}}}
+
+
+def test_merge_reports_missing_shards():
+    """Merging 3 of 4 shards should add up their totals and name the missing one"""
+    summary = merge_manifests([manifest(0), manifest(1, failed=["U7"]), manifest(3)])
+    assert summary["missing_shards"] == [2]
+    assert (summary["shards_merged"], summary["users"], summary["completed"]) == (3, 30, 29)
+    assert summary["failed_users"] == ["U7"]
+    assert summary["call_stats"]["coupons"]["calls"] == 30
+    assert summary["call_stats"]["coupons"]["latency_p95"] == 5.0 and not summary["exact_latency"]
+    assert summary["elapsed"] == 13.0
+    assert summary["rules"]["decided"]["loans"] == 6
+    print(f"✓ 3 of 4 shards merged, missing shard {summary['missing_shards']} reported")
+
+
+def test_merge_rejects_inconsistent_manifests():
+    """Manifests from differently sharded runs, or the same shard twice, cannot be merged"""
+    for manifests, message in [
+        ([manifest(0, count=4), manifest(1, count=8)], "shard count"),
+        ([manifest(0), manifest(0)], "Several manifests"),
+        ([], "No shard manifests"),
+    ]:
+        try:
+            merge_manifests(manifests)
+        except ValueError as e:
+            assert message in str(e), e
+        else:
+            raise AssertionError(f"expected a {message} error")
+    print("✓ mismatched shard counts, duplicate shards and empty input rejected")
+
+
+if __name__ == "__main__":
+    test_shards_partition_the_users()
+    test_assignment_is_stable()
+    test_merge_reports_missing_shards()
+    test_merge_rejects_inconsistent_manifests()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Exercise the stage scheduler with sleeping stages in place of model calls
+"""
+import sys
+import threading
+import time
+sys.path.append('.')
+from stage_graph import Stage, StageScheduler, validate
+
+
+def user_stages(months, counter, fail_month=None):
+    """Recommendations and one summary per month on the model, joined by an email stage"""
+    def model_call(name):
+        def run(**inputs):
+            with counter["lock"]:
+                counter["active"] += 1
+                counter["peak"] = max(counter["peak"], counter["active"])
+            time.sleep(0.02)
+            with counter["lock"]:
+                counter["active"] -= 1
+            if name == fail_month:
+                raise RuntimeError(f"{name} failed")
+            return name
+        return run
+
+    month_names = [f"summary:{month}" for month in range(months)]
+    stages = [Stage("recommendations", model_call("recommendations"), returns=str, resource="model")]
+    stages += [Stage(name, model_call(name), returns=str, resource="model") for name in month_names]
+    stages.append(Stage("summaries", lambda **summaries: [summaries[name] for name in month_names],
+                        tuple(month_names), list))
+    stages.append(Stage("email", model_call("email"), ("recommendations", "summaries"), str, "model"))
+    return stages
+
+
+def test_model_limit_is_respected():
+    """Users with uneven month counts should keep the model busy without exceeding its limit"""
+    counter = {"lock": threading.Lock(), "active": 0, "peak": 0}
+    finished = []
+    scheduler = StageScheduler(max_workers=8, limits={"model": 3})
+    for user in range(10):
+        scheduler.submit(f"U{user}", user_stages(1 + user % 6, counter),
+                         on_done=lambda results, user=user: finished.append((user, results["summaries"])))
+    scheduler.close()
+
+    assert len(finished) == 10
+    assert counter["peak"] == 3, f"expected 3 concurrent model stages, saw {counter['peak']}"
+    assert dict(finished)[5] == [f"summary:{month}" for month in range(6)], "summaries must keep month order"
+    print(f"✓ 10 users finished with at most {counter['peak']} model stages at once")
+
+
+def test_failure_is_isolated():
+    """A failing stage should fail only its own user and skip that user's later stages"""
+    counter = {"lock": threading.Lock(), "active": 0, "peak": 0}
+    done, errors = [], []
+    scheduler = StageScheduler(max_workers=4, limits={"model": 2})
+    scheduler.submit("U1", user_stages(3, counter, fail_month="summary:1"), on_done=done.append,
+                     on_error=errors.append)
+    scheduler.submit("U2", user_stages(3, counter), on_done=done.append, on_error=errors.append)
+    scheduler.close()
+
+    assert len(done) == 1 and done[0]["email"] == "email"
+    assert len(errors) == 1 and "summary:1 failed" in str(errors[0])
+    assert (scheduler.completed, scheduler.failed) == (1, 1)
+    print("✓ failed user reported, other user completed")
+
+
+def test_invalid_graphs_are_rejected():
+    """Cycles and unknown inputs should be caught before anything runs"""
+    for stages, message in [
+        ([Stage("a", lambda b: b, ("b",)), Stage("b", lambda a: a, ("a",))], "cycle"),
+        ([Stage("a", lambda c: c, ("c",))], "unknown"),
+    ]:
+        try:
+            validate(stages)
+        except ValueError as e:
+            assert message in str(e)
+        else:
+            raise AssertionError(f"expected a {message} error")
+    print("✓ cyclic and incomplete graphs rejected")
+
+
+if __name__ == "__main__":
+    test_model_limit_is_respected()
+    test_failure_is_isolated()
+    test_invalid_graphs_are_rejected()
@@ -0,0 +1,133 @@
+import pandas as pd
+from dataclasses import dataclass, field
+from typing import List
+
+
+@dataclass
+class UserDelta:
+    """
+    New activity for one user since their last processed transaction
+
+    Attributes:
+        user_id (str): User ID
+        transactions (pd.DataFrame): The user's full transaction history
+        new_rows (int): Number of transactions after the watermark
+        affected_months (list): month_year strings ("2023-06") containing new transactions
+        watermark (tuple): (Txn Date, Txn ID) of the newest transaction, to store once processed
+    """
+    user_id: str
+    transactions: pd.DataFrame
+    new_rows: int
+    affected_months: List[str] = field(default_factory=list)
+    watermark: tuple = None
+
+
+# Txn IDs are a prefix and a counter ("TU101002"); the counter is compared as a number
+TXN_ID_PATTERN = r'^(.*?)(\d*)$'
+
+SORT_KEYS = ['_txn_date', '_txn_prefix', '_txn_number']
+
+
+def _txn_id_parts(txn_ids):
+    """
+    Split Txn IDs into (prefix, numeric suffix) so TU101002 sorts before TU1010010
+
+    Returns:
+        tuple: (prefix Series, suffix Series as float; -1 for IDs without digits)
+    """
+    parts = txn_ids.astype(str).str.extract(TXN_ID_PATTERN)
+    return parts[0], pd.to_numeric(parts[1], errors='coerce').fillna(-1)
+
+
+def _with_sort_keys(transactions):
+    """
+    Add normalized date/ID columns used to order transactions against watermarks
+    """
+    keyed = transactions.copy()
+    keyed['_txn_date'] = pd.to_datetime(keyed['Txn Date'], errors='coerce').dt.strftime('%Y-%m-%d')
+    keyed['_txn_id'] = keyed['Txn ID'].astype(str)
+    keyed['_txn_prefix'], keyed['_txn_number'] = _txn_id_parts(keyed['_txn_id'])
+    return keyed.dropna(subset=['_txn_date'])
+
+
+def latest_watermark(transactions):
+    """
+    Watermark of the newest transaction in a frame
+
+    Args:
+        transactions (pd.DataFrame): Transactions with 'Txn Date' and 'Txn ID'
+
+    Returns:
+        tuple: (txn_date 'YYYY-MM-DD', txn_id), or None for an empty frame
+    """
+    keyed = _with_sort_keys(transactions)
+    if keyed.empty:
+        return None
+    newest = keyed.sort_values(SORT_KEYS).iloc[-1]
+    return newest['_txn_date'], newest['_txn_id']
+
+
+def find_user_deltas(transactions, watermarks, user_ids=None):
+    """
+    Find the users with transactions newer than their stored watermark
+
+    A transaction is new if its (Txn Date, Txn ID) sorts after the user's
+    watermark, comparing the numeric part of the IDs as numbers. Users
+    without a watermark count as entirely new.
+
+    Args:
+        transactions (pd.DataFrame): Full transaction table
+        watermarks (dict): user_id -> (txn_date, txn_id) from RunStore.get_watermarks()
+        user_ids (list): Optional subset of users to consider
+
+    Returns:
+        list: UserDelta for each user with new activity, in user_ids order when given
+    """
+    keyed = _with_sort_keys(transactions)
+    if user_ids is not None:
+        keyed = keyed[keyed['User_id'].isin(user_ids)]
+
+    watermark_df = pd.DataFrame(
+        [(user_id, date, txn_id) for user_id, (date, txn_id) in watermarks.items()],
+        columns=['User_id', '_wm_date', '_wm_id']
+    )
+    watermark_df['_wm_prefix'], watermark_df['_wm_number'] = _txn_id_parts(watermark_df['_wm_id'])
+    keyed = keyed.merge(watermark_df, on='User_id', how='left')
+
+    # Vectorized (date, prefix, number) > (wm_date, wm_prefix, wm_number) comparison
+    id_is_later = (
+        (keyed['_txn_prefix'] > keyed['_wm_prefix'])
+        | ((keyed['_txn_prefix'] == keyed['_wm_prefix']) & (keyed['_txn_number'] > keyed['_wm_number']))
+    )
+    is_new = (
+        keyed['_wm_date'].isna()
+        | (keyed['_txn_date'] > keyed['_wm_date'])
+        | ((keyed['_txn_date'] == keyed['_wm_date']) & id_is_later)
+    )
+    new_rows = keyed[is_new]
+    if new_rows.empty:
+        return []
+
+    changed = new_rows.groupby('User_id').agg(
+        new_rows=('_txn_id', 'size'),
+        affected_months=('_txn_date', lambda dates: sorted({d[:7] for d in dates}))
+    )
+
+    # Newest (date, id) per changed user becomes the watermark once the user is processed
+    changed_rows = keyed[keyed['User_id'].isin(changed.index)].sort_values(SORT_KEYS)
+    newest = changed_rows.groupby('User_id')[['_txn_date', '_txn_id']].last()
+    grouped = transactions[transactions['User_id'].isin(changed.index)].groupby('User_id')
+
+    order = user_ids if user_ids is not None else sorted(changed.index)
+    deltas = []
+    for user_id in order:
+        if user_id not in changed.index:
+            continue
+        deltas.append(UserDelta(
+            user_id=user_id,
+            transactions=grouped.get_group(user_id),
+            new_rows=int(changed.at[user_id, 'new_rows']),
+            affected_months=list(changed.at[user_id, 'affected_months']),
+            watermark=(newest.at[user_id, '_txn_date'], newest.at[user_id, '_txn_id'])
+        ))
+    return deltas
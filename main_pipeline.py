@@ -1,11 +1,30 @@
 from fetch_user_ids import get_user_ids
-from fetch_user_transactions import get_user_transactions
+from fetch_user_transactions import load_all_transactions, split_user_transactions
 from agents import coupons_agent, agent_template, credit_cards_agent, financial_summary_agent, loans_agent, savings_agent, email_notification_agent
-from agents.agent_template import check_context_window_limit
+from agents.agent_template import check_context_window_limit, parse_agent_response
+from agents.generation_profiles import GENERATION_PROFILES
+from agents import projections, resilience, rules_recommender, telemetry, tracing
+from agents.product_catalog import ProductCatalog
 
-from combine_outputs import build_final_output
+from combine_outputs import attach_email_notifications, build_final_output
+from run_store import RunStore, RunManifest, DEFAULT_STORE_PATH, digest_records, catalog_fingerprint, new_run_id
+from ingestion import find_user_deltas, latest_watermark
+from spending_tags import compute_spending_tags, FALLBACK_TAGS
+from feature_store import FeatureStore, DEFAULT_FEATURE_PATH
+from cohorts import CohortIndex
+from output_sinks import BackgroundWriter, DynamoDBSink, FanOutSink, FileSink, SkipUnchangedSink
+from output_codec import OutputCodec
+from run_artifact import RunArtifactWriter, DEFAULT_ARTIFACT_ROOT
+from stage_graph import Stage, StageScheduler
+from sharding import Shard, write_shard_manifest
+from planner import RunPlan, DEFAULT_PROMPT_BUDGET, output_token_estimates
 import pandas as pd
 import json
+import argparse
+import contextlib
+import functools
+import os
+import time
 import boto3
 from io import StringIO
 
@@ -76,122 +95,274 @@ def preprocess_transactions(transactions):
     return transactions_filtered
 
 
-def get_product_recommendations(user_info, transactions_for_agents, product_data):
+# Model stages allowed to run at once across all users; the shared limiter still
+# gates the calls themselves, so this only needs to keep it supplied with work
+DEFAULT_MODEL_STAGES = resilience.shared_limiter.max_limit
+
+# Threads running stages: every model stage plus a few for feature and output stages
+DEFAULT_STAGE_WORKERS = DEFAULT_MODEL_STAGES + 8
+
+
+# (recommendation key, catalog key, agent module, agent function, default IDs)
+RECOMMENDATION_AGENTS = [
+    ('coupons', 'coupons', coupons_agent, coupons_agent.run_coupons_agent, ["CO1", "CO2", "CO3"]),
+    ('loans', 'loans', loans_agent, loans_agent.run_loans_agent, ["LN1", "LN2", "LN3"]),
+    ('credit_cards', 'credit_cards', credit_cards_agent, credit_cards_agent.run_credit_cards_agent, ["CC1", "CC2", "CC3"]),
+    ('high_yield_savings', 'savings', savings_agent, savings_agent.run_savings_agent, ["HY1", "HY2", "HY3"])
+]
+
+
+def recommendation_version(catalog_versions, catalog_key, agent_module):
+    """
+    Version of a recommendation list: the catalog it was chosen from and the agent prompt
     """
-    Get product recommendations from different agents
+    return f"{catalog_versions[catalog_key]}:{agent_module.PROMPT_VERSION}"
+
+
+def recommendation_input_digest(user_info, transactions_for_agents):
+    """
+    Digest of everything a stored recommendation depends on besides the catalog and the prompt
+    """
+    return digest_records(transactions_for_agents.to_dict('records'),
+                          extra=[user_info, projections.PROJECTION_VERSION])
+
+
+def recommend_products(agent, user_info, transactions_for_agents, product_data, store=None, catalog_versions=None,
+                       cohorts=None, features=None, agent_view=None, plan=None, input_digest=None):
+    """
+    Get one agent's product recommendations
+    
+    With a run store, the agent only runs if its catalog, its prompt or the
+    user's inputs changed since the stored recommendation was produced. With a
+    cohort index, a close enough neighbour's list is reused before calling the agent.
+    Clear-cut loan, card and savings cases are decided by local rules first.
+    The agent receives its own projection of the transactions, not the rows.
     
     Args:
+        agent (tuple): Entry of RECOMMENDATION_AGENTS
         user_info (dict): User information
         transactions_for_agents (pd.DataFrame): Preprocessed transaction data
-        product_data (dict): Dictionary containing all product data
+        product_data (ProductCatalog): Product catalog of the run
+        store (RunStore): Optional persistent store of previous recommendations
+        catalog_versions (dict): Catalog key -> fingerprint of the loaded catalog
+        cohorts (CohortIndex): Optional index of other users' recommendations
+        features (dict): The user's latest feature vector, used by the rules and the cohort lookup
+        agent_view (list): Precomputed projection of the transactions for this agent
+        plan (RunPlan): Dry run: count the agent call in the plan and use the default IDs instead
+        input_digest (str): recommendation_input_digest() of the user, if already computed
         
     Returns:
-        dict: Dictionary containing all recommendations
+        list: Recommended product IDs
     """
-    # Get recommendations from each agent
-    coupons_rec = coupons_agent.run_coupons_agent(user_info, transactions_for_agents, product_data['coupons'])
-    loans_rec = loans_agent.run_loans_agent(user_info, transactions_for_agents, product_data['loans'])
-    credit_rec = credit_cards_agent.run_credit_cards_agent(user_info, transactions_for_agents, product_data['credit_cards'])
-    savings_rec = savings_agent.run_savings_agent(user_info, transactions_for_agents, product_data['savings'])
+    rec_key, catalog_key, agent_module, run_agent, default_ids = agent
+    user_id = user_info.get('User_id')
+    decision = rules_recommender.recommend(catalog_key, user_info, features, product_data[catalog_key])
+    if decision is not None:
+        product_ids, reason = decision
+        print(f"Rules decided {rec_key} recommendations ({reason})")
+        telemetry.record_cache_hit(catalog_key, cache_status="rules")
+        return product_ids
     
-    # Process recommendations into standard format
-    recommendations = {}
+    version = recommendation_version(catalog_versions, catalog_key, agent_module)
+    if store is not None:
+        input_digest = input_digest or recommendation_input_digest(user_info, transactions_for_agents)
+        stored_ids = store.get_recommendation(user_id, rec_key, version, input_digest)
+        if stored_ids is not None:
+            telemetry.record_cache_hit(catalog_key)
+            return stored_ids
     
-    # Process coupons recommendations
-    try:
-        recommendations['coupons'] = json.loads(coupons_rec) if isinstance(coupons_rec, str) else coupons_rec
-        if not isinstance(recommendations['coupons'], list):
-            recommendations['coupons'] = ["CO1", "CO2", "CO3"]
-    except:
-        recommendations['coupons'] = ["CO1", "CO2", "CO3"]
-        
-    # Process loans recommendations
-    try:
-        recommendations['loans'] = json.loads(loans_rec) if isinstance(loans_rec, str) else loans_rec
-        if not isinstance(recommendations['loans'], list):
-            recommendations['loans'] = ["LN1", "LN2", "LN3"]
-    except:
-        recommendations['loans'] = ["LN1", "LN2", "LN3"]
+    if cohorts is not None:
+        neighbour = cohorts.lookup(user_id, user_info, features, rec_key, version)
+        if neighbour is not None:
+            product_ids, neighbour_id, similarity = neighbour
+            print(f"Reusing {rec_key} recommendations of {neighbour_id} (similarity {similarity:.3f})")
+            telemetry.record_cache_hit(catalog_key, cache_status="cohort")
+            return product_ids
+    
+    # Get recommendations from the agent and process them into standard format
+    if agent_view is None:
+        agent_view = projections.project(catalog_key, transactions_for_agents)
+    if plan is not None:
+        plan.add_call(GENERATION_PROFILES[catalog_key], agent_module.system_prompt, user_info, agent_view,
+                      product_data[catalog_key])
+        if cohorts is not None:
+            # Later neighbours of this user reuse its list, as they would in the run
+            cohorts.add(user_id, user_info, features, rec_key, version, default_ids)
+        return default_ids
+    raw_rec = run_agent(user_info, agent_view, product_data[catalog_key])
+    parsed = parse_agent_response(raw_rec, GENERATION_PROFILES[catalog_key])
+    if parsed is not None:
+        # Keep only IDs that exist in the catalog so the output never needs stub entries
+        unknown_ids = [product_id for product_id in parsed if not product_data.contains(catalog_key, product_id)]
+        if unknown_ids:
+            print(f"Warning: dropping {rec_key} IDs not in the catalog: {unknown_ids}")
+        parsed = product_data.known_ids(catalog_key, parsed) or None
+    if parsed is None:
+        print(f"Warning: could not parse {rec_key} recommendations, using defaults. Response: {str(raw_rec)[:200]}")
+        return default_ids
+    if store is not None:
+        store.put_recommendation(user_id, rec_key, version, input_digest, parsed)
+    if cohorts is not None:
+        # Only model-produced lists are indexed, so reuse never chains through neighbours
+        cohorts.add(user_id, user_info, features, rec_key, version, parsed)
+    return parsed
+
+
+def get_product_recommendations(user_info, transactions_for_agents, product_data, store=None, catalog_versions=None,
+                                cohorts=None, features=None, agent_views=None, plan=None):
+    """
+    Get product recommendations from every agent, one after another (see recommend_products)
+    
+    Args:
+        agent_views (dict): Catalog key -> precomputed projection of the transactions for that agent
+        (the remaining arguments are those of recommend_products)
         
-    # Process credit card recommendations
-    try:
-        recommendations['credit_cards'] = json.loads(credit_rec) if isinstance(credit_rec, str) else credit_rec
-        if not isinstance(recommendations['credit_cards'], list):
-            recommendations['credit_cards'] = ["CC1", "CC2", "CC3"]
-    except:
-        recommendations['credit_cards'] = ["CC1", "CC2", "CC3"]
+    Returns:
+        dict: Dictionary containing all recommendations
+    """
+    product_data = ProductCatalog.ensure(product_data)
+    catalog_versions = catalog_versions or {
+        name: catalog_fingerprint(records) for name, records in product_data.items()
+    }
+    input_digest = recommendation_input_digest(user_info, transactions_for_agents) if store is not None else None
+    agent_views = agent_views or {}
+    return {
+        agent[0]: recommend_products(agent, user_info, transactions_for_agents, product_data, store,
+                                     catalog_versions, cohorts, features, agent_views.get(agent[1]), plan,
+                                     input_digest)
+        for agent in RECOMMENDATION_AGENTS
+    }
+
+
+def summarize_month(user_info, transactions, month_year, month_tags, store=None, manifest=None, plan=None):
+    """
+    Summarize one month of a user's transactions
+    
+    The month is read from the run manifest or the run store when its inputs
+    were already summarized; otherwise the model is called.
+    
+    Args:
+        user_info (dict): User information
+        transactions (pd.DataFrame): Preprocessed transaction data (all months)
+        month_year: The month to summarize
+        month_tags (dict): (user_id, 'YYYY-MM') -> spending tags from compute_spending_tags
+        store (RunStore): Optional persistent store of previous summaries
+        manifest (RunManifest): Optional progress of the current run
+        plan (RunPlan): Dry run: count the call in the plan and return an empty summary instead
         
-    # Process savings recommendations
-    try:
-        recommendations['high_yield_savings'] = json.loads(savings_rec) if isinstance(savings_rec, str) else savings_rec
-        if not isinstance(recommendations['high_yield_savings'], list):
-            recommendations['high_yield_savings'] = ["HY1", "HY2", "HY3"]
-    except:
-        recommendations['high_yield_savings'] = ["HY1", "HY2", "HY3"]
+    Returns:
+        tuple: (summary dict, True if it was reused from the run store)
+    """
+    user_id = user_info.get('User_id')
     
-    return recommendations
+    # A resumed run reuses the months it already summarized
+    if manifest is not None:
+        checkpointed = manifest.get(user_id, f"summary:{month_year}")
+        if checkpointed is not None:
+            telemetry.record_cache_hit('financial_summary', cache_status="checkpoint", month=str(month_year))
+            return checkpointed, False
+    
+    monthly_data = transactions[transactions['month_year'] == month_year].copy()
+    
+    # Using all available transactions for each month
+    print(f"Processing all {len(monthly_data)} transactions for month {month_year}")
+    
+    # Convert datetime columns to strings for the agent
+    monthly_data_for_agent = monthly_data.copy()
+    monthly_data_for_agent['Txn Date'] = monthly_data_for_agent['Txn Date'].dt.strftime('%Y-%m-%d')
+    monthly_data_for_agent['month_year'] = monthly_data['month_year'].astype(str)
+    
+    # Reuse the stored summary if this month's inputs have not changed
+    if store is not None:
+        txn_digest = digest_records(monthly_data_for_agent.to_dict('records'), extra=user_info)
+        cached_summary = store.get_summary(user_id, month_year, txn_digest, financial_summary_agent.PROMPT_VERSION)
+        if cached_summary is not None:
+            telemetry.record_cache_hit('financial_summary', month=str(month_year))
+            cached_summary["spending_tags"] = month_tags.get((user_id, str(month_year)), list(FALLBACK_TAGS))
+            return cached_summary, True
+    
+    if plan is not None:
+        plan.add_call(GENERATION_PROFILES['financial_summary'], financial_summary_agent.system_prompt, user_info,
+                      monthly_data_for_agent, [])
+        return {
+            "month": str(month_year).split('-')[1],
+            "year": str(month_year).split('-')[0],
+            "ai_summary": "",
+            "categories_expenses": {},
+            "spending_tags": month_tags.get((user_id, str(month_year)), list(FALLBACK_TAGS))
+        }, False
+    
+    # Check context window for monthly summary
+    check_context_window_limit(user_info, monthly_data_for_agent, [], f"Financial Summary Agent - {month_year}")
+    
+    # Print monthly data size
+    monthly_data_size = len(json.dumps(monthly_data_for_agent.to_dict('records')))
+    print(f"Month {month_year} data size: {monthly_data_size:,} chars ({len(monthly_data_for_agent)} transactions)")
+    
+    with telemetry.call_context(month=str(month_year)), tracing.span("monthly_summary", month=str(month_year)):
+        summary = financial_summary_agent.summarize_user(user_info, monthly_data_for_agent)
+    
+    # Parse the summary, falling back to the raw text if it is not valid JSON
+    summary_dict = parse_agent_response(summary, GENERATION_PROFILES['financial_summary'])
+    if summary_dict is None:
+        print(f"Warning: could not parse summary for month {month_year}, using raw text")
+        summary_dict = {
+            "month": str(month_year).split('-')[1],
+            "year": str(month_year).split('-')[0],
+            "ai_summary": summary,
+            "categories_expenses": {}
+        }
+    elif store is not None:
+        store.put_summary(user_id, month_year, txn_digest, financial_summary_agent.PROMPT_VERSION, summary_dict)
+    
+    # Tags are attached after storing so threshold changes do not invalidate stored summaries
+    summary_dict["spending_tags"] = month_tags.get((user_id, str(month_year)), list(FALLBACK_TAGS))
+    if manifest is not None:
+        manifest.put(user_id, f"summary:{month_year}", summary_dict)
+    return summary_dict, False
 
 
-def generate_monthly_summaries(user_info, transactions):
+def generate_monthly_summaries(user_info, transactions, store=None, manifest=None):
     """
-    Generate monthly summaries for all available months
+    Generate monthly summaries for all available months, one after another
+    
+    Months whose transactions were already summarized with the current prompt
+    are read from the run store; only new or changed months call the model.
+    Spending tags are computed from the transactions, not by the model.
+    The pipeline itself summarizes months concurrently as separate stages
+    (see build_user_stages).
     
     Args:
         user_info (dict): User information
         transactions (pd.DataFrame): Preprocessed transaction data
+        store (RunStore): Optional persistent store of previous summaries
+        manifest (RunManifest): Optional progress of the current run; months it completed are reused
         
     Returns:
         list: List of monthly summary dictionaries
     """
-    monthly_summary = []
+    # Tags for every month at once from the category x month spend matrix
+    month_tags = compute_spending_tags(transactions)
     
     # Check all available months
-    available_months = transactions['month_year'].unique()
-    print(f"Found {len(available_months)} months of data: {', '.join(str(m) for m in sorted(available_months))}")
+    available_months = sorted(transactions['month_year'].unique())
+    print(f"Found {len(available_months)} months of data: {', '.join(str(m) for m in available_months)}")
     
-    # Group transactions by month and create monthly summaries
-    for month_year in sorted(available_months):
-        monthly_data = transactions[transactions['month_year'] == month_year].copy()
-        
-        # Using all available transactions for each month
-        print(f"Processing all {len(monthly_data)} transactions for month {month_year}")
-        
-        # Convert datetime columns to strings for the agent
-        monthly_data_for_agent = monthly_data.copy()
-        monthly_data_for_agent['Txn Date'] = monthly_data_for_agent['Txn Date'].dt.strftime('%Y-%m-%d')
-        monthly_data_for_agent['month_year'] = monthly_data['month_year'].astype(str)
-        
-        # Check context window for monthly summary
-        check_context_window_limit(user_info, monthly_data_for_agent, [], f"Financial Summary Agent - {month_year}")
-        
-        # Print monthly data size
-        monthly_data_size = len(json.dumps(monthly_data_for_agent.to_dict('records')))
-        print(f"Month {month_year} data size: {monthly_data_size:,} chars ({len(monthly_data_for_agent)} transactions)")
-        
-        summary = financial_summary_agent.summarize_user(user_info, monthly_data_for_agent)
-        
-        # Try to parse the summary as JSON if it's a string
-        if isinstance(summary, str):
-            try:
-                summary_dict = json.loads(summary)
-            except:
-                summary_dict = {
-                    "month": str(month_year).split('-')[1],
-                    "year": str(month_year).split('-')[0],
-                    "ai_summary": summary,
-                    "spending_tags": ["Budget Master", "Balanced Spender"],  # Default tags
-                    "categories_expenses": {}
-                }
-        else:
-            summary_dict = summary
-            
-        # Add the summary to the list
+    monthly_summary = []
+    cache_hits = 0
+    for month_year in available_months:
+        summary_dict, reused = summarize_month(user_info, transactions, month_year, month_tags, store, manifest)
         monthly_summary.append(summary_dict)
+        cache_hits += reused
+    
+    if store is not None:
+        print(f"Monthly summaries reused from store: {cache_hits} of {len(available_months)}")
     
     return monthly_summary
 
 
-def get_email_notifications(user_info, recommendations, monthly_summary, product_data):
+def get_email_notifications(user_info, recommendations, monthly_summary, product_data, store=None, catalog_versions=None,
+                            features=None, segment_mode=False, plan=None):
     """
     Generate email notifications
     
@@ -200,30 +371,64 @@ def get_email_notifications(user_info, recommendations, monthly_summary, product
         recommendations (dict): Product recommendations
         monthly_summary (list): Monthly summaries
         product_data (dict): Product data
+        store (RunStore): Optional persistent store of previous email subjects
+        catalog_versions (dict): Catalog key -> fingerprint of the loaded catalog
+        features (dict): Latest month's feature vector from the feature store
+        segment_mode (bool): Fill per-segment subject templates instead of one model call per user
+        plan (RunPlan): Dry run: count the call in the plan and return no subjects
         
     Returns:
         dict: Email notification subjects
     """
-    # Check context window for email notifications
-    email_data = {
-        "user_info": user_info,
-        "recommendations": recommendations,
-        "monthly_summary": monthly_summary
-    }
-    check_context_window_limit(email_data, [], product_data, "Email Notification Agent")
+    # Reuse the stored subjects if none of the email inputs changed
+    if store is not None:
+        user_id = user_info.get('User_id')
+        input_digest = digest_records([], extra={
+            "user_info": user_info,
+            "recommendations": recommendations,
+            "monthly_summary": monthly_summary,
+            "features": features,
+            "catalog_versions": catalog_versions or {
+                name: catalog_fingerprint(records) for name, records in product_data.items()
+            },
+            "prompt_version": (email_notification_agent.SEGMENT_PROMPT_VERSION if segment_mode
+                               else email_notification_agent.PROMPT_VERSION)
+        })
+        stored_subjects = store.get_email_subjects(user_id, input_digest)
+        if stored_subjects is not None:
+            telemetry.record_cache_hit('email_notification')
+            return stored_subjects
+    
+    # Build the slim email context and check its size like the other agents
+    email_context = email_notification_agent.prepare_email_context(
+        user_info,
+        recommendations,
+        monthly_summary,
+        product_data,
+        features
+    )
+    if plan is not None:
+        plan.add_email_call(email_context, segment_mode, store)
+        return {}
+    check_context_window_limit(email_context['user'], [email_context['latest_month']], email_context['products'],
+                               "Email Notification Agent")
     
     # Generate email notifications
     email_notifications_result = email_notification_agent.run_email_notification_agent(
         user_info,
         recommendations,
         monthly_summary,
-        product_data
+        product_data,
+        features,
+        email_context,
+        segment_mode,
+        store
     )
     
     # Parse email notifications
-    try:
-        email_subjects = json.loads(email_notifications_result) if isinstance(email_notifications_result, str) else email_notifications_result
-    except:
+    email_subjects = parse_agent_response(email_notifications_result, GENERATION_PROFILES['email_notification'])
+    if email_subjects is None:
+        print("Warning: could not parse email notifications, using defaults")
         email_subjects = {
             "spending_summary_email": "Your Monthly Financial Insights Are Ready!",
             "coupons_email": "Great Savings Await You!",
@@ -231,111 +436,595 @@ def get_email_notifications(user_info, recommendations, monthly_summary, product
             "credit_cards_email": "Amazing Credit Card Benefits!",
             "savings_email": "Grow Your Money Faster!"
         }
+    elif store is not None:
+        store.put_email_subjects(user_id, input_digest, email_subjects)
         
     return email_subjects
 
 
-def process_user(user_id, user_info, transactions, product_data):
+def build_user_stages(user_id, user_info, transactions, product_data, store=None, catalog_versions=None,
+                      feature_store=None, cohorts=None, email_segments=False, manifest=None, plan=None):
     """
-    Process a single user
+    Declare the work for one user as a graph of stages
+    
+    Each agent's recommendations and every monthly summary only depend on the
+    preprocessed transactions, so they run concurrently; the output is built
+    from them while the email subjects are generated, and the subjects are attached last.
+    Stages that call the model hold the "model" resource of the scheduler.
     
     Args:
         user_id (str): User ID
         user_info (dict): User information
         transactions (pd.DataFrame): Raw transaction data
-        product_data (dict): Dictionary containing all product data
+        product_data (ProductCatalog): Product catalog of the run
+        store (RunStore): Optional persistent store for reusing earlier results
+        catalog_versions (dict): Catalog key -> fingerprint, computed once per run
+        feature_store (FeatureStore): Optional per-month feature vectors, already updated with these transactions
+        cohorts (CohortIndex): Optional index for reusing similar users' recommendations
+        email_segments (bool): Generate email subjects once per segment and fill them per user
+        manifest (RunManifest): Optional progress of the current run; stages it completed are reused
+        plan (RunPlan): Dry run: model calls are counted in the plan and nothing is stored
         
     Returns:
-        dict: Final output data
+        list: Stages for StageScheduler.submit; the "final_output" stage returns the output
+    """
+    # Preprocessing is cheap and determines the months, so it runs before the graph is built
+    with tracing.span("preprocess", user_id=user_id) as stage:
+        transactions_processed = preprocess_transactions(transactions)
+        
+        # Convert datetime columns to strings for JSON serialization
+        transactions_for_agents = transactions_processed.copy()
+        transactions_for_agents['Txn Date'] = transactions_for_agents['Txn Date'].dt.strftime('%Y-%m-%d')
+        transactions_for_agents['month_year'] = transactions_processed['month_year'].astype(str)
+        month_tags = compute_spending_tags(transactions_processed)
+        available_months = sorted(transactions_processed['month_year'].unique())
+        if stage:
+            stage.set(transactions=len(transactions_processed), months=len(available_months))
+    print(f"User {user_id}: {len(available_months)} months of data: {', '.join(str(m) for m in available_months)}")
+    
+    def features():
+        if feature_store is None:
+            return None
+        return feature_store.latest(user_id)
+    
+    def agent_views():
+        # Project the transactions for each agent and check context window limits
+        views = {
+            catalog_key: projections.project(catalog_key, transactions_for_agents)
+            for catalog_key in ('coupons', 'loans', 'credit_cards', 'savings')
+        }
+        if plan is not None:
+            # The plan checks the exact prompts against its budget instead
+            return views
+        for agent_name, catalog_key in [
+            ("Coupons Agent", 'coupons'),
+            ("Loans Agent", 'loans'),
+            ("Credit Cards Agent", 'credit_cards'),
+            ("Savings Agent", 'savings')
+        ]:
+            check_context_window_limit(user_info, views[catalog_key], product_data[catalog_key], agent_name)
+        return views
+    
+    # Computed once for the four recommendation stages
+    catalog_versions = catalog_versions or {
+        name: catalog_fingerprint(records) for name, records in product_data.items()
+    }
+    input_digest = recommendation_input_digest(user_info, transactions_for_agents) if store is not None else None
+    
+    def recommendation(agent):
+        rec_key, catalog_key = agent[0], agent[1]
+        
+        def run(features, agent_views):
+            checkpointed = manifest.get(user_id, f"recommendations:{rec_key}") if manifest is not None else None
+            if checkpointed is not None:
+                telemetry.record_cache_hit(catalog_key, cache_status="checkpoint")
+                return checkpointed
+            result = recommend_products(agent, user_info, transactions_for_agents, product_data, store,
+                                        catalog_versions, cohorts, features, agent_views[catalog_key], plan,
+                                        input_digest)
+            if manifest is not None and plan is None:
+                manifest.put(user_id, f"recommendations:{rec_key}", result)
+            return result
+        return run
+    
+    recommendation_stages = [f"recommendations:{agent[0]}" for agent in RECOMMENDATION_AGENTS]
+    
+    def recommendations(**lists):
+        return {agent[0]: lists[name] for agent, name in zip(RECOMMENDATION_AGENTS, recommendation_stages)}
+    
+    def month_summary(month_year):
+        return lambda: summarize_month(user_info, transactions_processed, month_year, month_tags, store, manifest,
+                                       plan)[0]
+    
+    month_stages = [f"summary:{month_year}" for month_year in available_months]
+    
+    def monthly_summaries(**summaries):
+        return [summaries[name] for name in month_stages]
+    
+    def output(recommendations, monthly_summaries):
+        # Built without the email subjects, which are attached once they are ready
+        return build_final_output(
+            user_info,
+            recommendations['coupons'],
+            recommendations['loans'],
+            recommendations['credit_cards'],
+            recommendations['high_yield_savings'],
+            monthly_summaries,
+            None,
+            product_data  # Pass product data for mapping
+        )
+    
+    def email(recommendations, monthly_summaries, features):
+        checkpointed = manifest.get(user_id, "email") if manifest is not None else None
+        if checkpointed is not None:
+            telemetry.record_cache_hit('email_notification', cache_status="checkpoint")
+            return checkpointed
+        result = get_email_notifications(user_info, recommendations, monthly_summaries, product_data,
+                                         store, catalog_versions, features, email_segments, plan)
+        if manifest is not None and plan is None:
+            manifest.put(user_id, "email", result)
+        return result
+    
+    def final_output(output, email):
+        return attach_email_notifications(output, email)
+    
+    stages = [
+        Stage("features", features),
+        Stage("agent_views", agent_views, returns=dict),
+    ]
+    for agent, name in zip(RECOMMENDATION_AGENTS, recommendation_stages):
+        stages.append(Stage(name, recommendation(agent), ("features", "agent_views"), list, resource="model"))
+    stages.append(Stage("recommendations", recommendations, tuple(recommendation_stages), dict))
+    for month_year, name in zip(available_months, month_stages):
+        stages.append(Stage(name, month_summary(month_year), returns=dict, resource="model"))
+    stages += [
+        Stage("monthly_summaries", monthly_summaries, tuple(month_stages), list),
+        Stage("output", output, ("recommendations", "monthly_summaries"), dict),
+        Stage("email", email, ("recommendations", "monthly_summaries", "features"), dict, resource="model"),
+        Stage("final_output", final_output, ("output", "email"), dict),
+    ]
+    return stages
+
+
+def stage_context(user_id, parent=None):
+    """
+    Wrapper for StageScheduler.submit: attributes model calls and trace spans of each stage to the user
+    
+    Stages run on the scheduler's worker threads, so their spans are parented
+    explicitly to `parent` (the span open where the user was submitted).
+    """
+    @contextlib.contextmanager
+    def wrap(stage):
+        with telemetry.call_context(user_id=user_id), tracing.span(stage.name, parent, user_id=user_id):
+            yield
+    return wrap
+
+
+def submit_user(scheduler, user_id, user_info, transactions, product_data, store=None, catalog_versions=None,
+                feature_store=None, cohorts=None, email_segments=False,
+                output_writer=None, on_written=None, on_error=None, manifest=None, on_output=None):
+    """
+    Schedule one user's stages; their output is written once all of them finished
+    
+    Args:
+        scheduler (StageScheduler): Scheduler shared by every user of the run
+        output_writer (BackgroundWriter): Queue the output for a background sink (None = write the JSON file)
+        on_written (callable): Called once the output is written
+        on_error (callable): on_error(exception) if a stage of this user failed
+        on_output (callable): on_output(final_output) after the output was handed off
+        (the remaining arguments are those of build_user_stages)
     """
     print(f"\n===== Processing User {user_id} =====")
+    stages = build_user_stages(user_id, user_info, transactions, product_data, store, catalog_versions,
+                               feature_store, cohorts, email_segments, manifest)
     
-    # Step 1: Preprocess transactions
-    transactions_processed = preprocess_transactions(transactions)
-    
-    # Convert datetime columns to strings for JSON serialization
-    transactions_for_agents = transactions_processed.copy()
-    transactions_for_agents['Txn Date'] = transactions_for_agents['Txn Date'].dt.strftime('%Y-%m-%d')
-    transactions_for_agents['month_year'] = transactions_processed['month_year'].astype(str)
-    
-    # Step 2: Check context window limits
-    print(f"\n===== Context Window Check for User {user_id} =====")
-    for agent_name, product_list in [
-        ("Coupons Agent", product_data['coupons']), 
-        ("Loans Agent", product_data['loans']),
-        ("Credit Cards Agent", product_data['credit_cards']), 
-        ("Savings Agent", product_data['savings'])
-    ]:
-        check_context_window_limit(user_info, transactions_for_agents, product_list, agent_name)
-    print("================================================\n")
-    
-    # Step 3: Get product recommendations
-    print("Getting product recommendations...")
-    recommendations = get_product_recommendations(user_info, transactions_for_agents, product_data)
-    
-    # Step 4: Generate monthly summaries
-    print("Generating monthly summaries...")
-    monthly_summary = generate_monthly_summaries(user_info, transactions_processed)
-    
-    # Step 5: Generate email notifications
-    print("Generating email notifications...")
-    email_subjects = get_email_notifications(user_info, recommendations, monthly_summary, product_data)
-    
-    # Step 6: Build final output
-    final_output = build_final_output(
-        user_info, 
-        recommendations['coupons'], 
-        recommendations['loans'], 
-        recommendations['credit_cards'], 
-        recommendations['high_yield_savings'], 
-        monthly_summary,
-        email_subjects,
-        product_data  # Pass product data for mapping
-    )
+    def done(results):
+        final_output = results["final_output"]
+        # Hand the output to the writer, or save it to file
+        if output_writer is not None:
+            output_writer.submit(user_id, final_output, on_written)
+            print(f"Output queued for user {user_id}")
+        else:
+            with tracing.span("write_output", user_id=user_id):
+                FileSink().write(user_id, final_output)
+            if on_written is not None:
+                on_written()
+            print(f"Output saved for user {user_id}")
+        if on_output is not None:
+            on_output(final_output)
+    
+    scheduler.submit(str(user_id), stages, on_done=done, on_error=on_error,
+                     wrap=stage_context(user_id, tracing.current_span()))
+
+
+def process_user(user_id, user_info, transactions, product_data, store=None, catalog_versions=None,
+                 feature_store=None, affected_months=None, cohorts=None, email_segments=False,
+                 output_writer=None, on_written=None, manifest=None):
+    """
+    Process a single user and wait for the output
     
-    # Step 7: Save output to file
-    with open(f'output/output_{user_id}.json', 'w') as f:
-        json.dump(final_output, f, indent=2)
+    Runs the user's stage graph on its own scheduler; run_pipeline shares one
+    scheduler across users and updates the feature store once for all of them
+    instead (see submit_user).
     
-    print(f"Output saved for user {user_id}")
-    return final_output
+    Args:
+        user_id (str): User ID
+        user_info (dict): User information
+        transactions (pd.DataFrame): Raw transaction data
+        product_data (dict): Dictionary containing all product data
+        store (RunStore): Optional persistent store for reusing earlier results
+        catalog_versions (dict): Catalog key -> fingerprint, computed once per run
+        feature_store (FeatureStore): Optional per-month feature vectors, updated for this user
+        affected_months (list): Months with new transactions (None = recompute every month of the features)
+        cohorts (CohortIndex): Optional index for reusing similar users' recommendations
+        email_segments (bool): Generate email subjects once per segment and fill them per user
+        output_writer (BackgroundWriter): Queue the output for a background sink (None = write the JSON file now)
+        on_written (callable): Called once the output is written
+        manifest (RunManifest): Optional progress of the current run; stages it completed are reused
+        
+    Returns:
+        dict: Final output data
+    """
+    if feature_store is not None:
+        feature_store.update(transactions, affected_months)
+    outcome = {}
+    scheduler = StageScheduler(DEFAULT_STAGE_WORKERS, limits={"model": DEFAULT_MODEL_STAGES})
+    try:
+        submit_user(scheduler, user_id, user_info, transactions, ProductCatalog.ensure(product_data), store,
+                    catalog_versions, feature_store, cohorts, email_segments, output_writer,
+                    on_written, functools.partial(outcome.__setitem__, "error"), manifest,
+                    functools.partial(outcome.__setitem__, "output"))
+    finally:
+        scheduler.close()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["output"]
 
 
-def run_pipeline():
+def plan_users(run_plan, work, userinfo_df, product_data, store, catalog_versions, feature_store, cohorts,
+               email_segments, manifest, workers=DEFAULT_STAGE_WORKERS):
+    """
+    Run every user's stages as a dry run, counting model calls in the plan instead of making them
+    
+    Args:
+        run_plan (RunPlan): Receives the predicted calls and the skipped ones
+        work (list): (user_id, transactions, watermark, affected_months) per user, as in run_pipeline
+        (the remaining arguments are those of build_user_stages)
+    """
+    scheduler = StageScheduler(workers, limits={"model": workers})
+    for user_id, transactions, _, _ in work:
+        user_info = userinfo_df[userinfo_df['User_id'] == user_id].iloc[0].to_dict()
+        stages = build_user_stages(user_id, user_info, transactions, product_data, store, catalog_versions,
+                                   feature_store, cohorts, email_segments, manifest, run_plan)
+        scheduler.submit(str(user_id), stages, on_error=functools.partial(print, f"✗ Could not plan user {user_id}:"),
+                         wrap=stage_context(user_id))
+    scheduler.close()
+
+
+def output_written(store, manifest, user_id, watermark):
+    """
+    Record that a user's output was written: advance the watermark and complete the run stage
+    """
+    if store is not None and watermark is not None:
+        store.set_watermark(user_id, watermark)
+    if manifest is not None:
+        manifest.put(user_id, "output")
+
+
+def run_pipeline(telemetry_path="logs/llm_calls.jsonl", trace_path=None, store_path=DEFAULT_STORE_PATH,
+                 delta=False, feature_path=DEFAULT_FEATURE_PATH, cohort_threshold=None, email_segments=False,
+                 outputs=("file",), dynamodb_table="UserRecommendations", compress=False, rewrite_outputs=False,
+                 resume=None, workers=DEFAULT_STAGE_WORKERS, model_stages=DEFAULT_MODEL_STAGES, shard=None,
+                 run_id=None, plan=False, plan_budget=DEFAULT_PROMPT_BUDGET):
     """
     Main pipeline function
+    
+    Args:
+        telemetry_path (str): JSONL file receiving one event per model call (None to disable)
+        trace_path (str): Chrome trace-event file the stage timeline is streamed to (None = no tracing)
+        store_path (str): sqlite run store used to reuse results across runs (None to disable)
+        delta (bool): Only process users with transactions newer than their stored watermark
+        feature_path (str): Columnar file of per-user monthly feature vectors (None to disable)
+        cohort_threshold (float): Enable cohort reuse of recommendations at this cosine similarity (None to disable)
+        email_segments (bool): Generate email subject templates per segment instead of per user
+        outputs (tuple): Where outputs go as users finish: any of "file", "dynamodb" and "artifact"
+        dynamodb_table (str): DynamoDB table of the "dynamodb" output
+        compress (bool): Write outputs as zstd-compressed binary (with the trained dictionary, if any)
+        rewrite_outputs (bool): Write every output even if it matches the digest last written
+        resume (str): ID of an interrupted run to continue, or "latest" (None starts a new run)
+        workers (int): Threads running user stages concurrently
+        model_stages (int): Stages that call the model allowed to run at once across all users
+        shard (Shard): Only process this shard of the users (None = everyone)
+        run_id (str): ID of a new run (default run-<timestamp>-<suffix>); give every shard of a run the same ID
+        plan (bool): Dry run: predict model calls, tokens and cost without calling a model or writing anything
+        plan_budget (int): Token budget a planned prompt plus its output cap must fit in
+        
+    Returns:
+        RunPlan: The prediction, for a dry run (None otherwise)
     """
+    started_at = time.time()
+    if shard is not None:
+        # Shards keep separate state, logs and outputs so they never contend for a file
+        store_path, feature_path, telemetry_path, trace_path = (
+            shard.path(path) for path in (store_path, feature_path, telemetry_path, trace_path)
+        )
+        print(f"Running {shard.name}")
+    if plan and store_path and not os.path.exists(store_path):
+        # A dry run creates no state; an empty in-memory store stands in for a first run
+        store_path = ":memory:"
+    store = RunStore(store_path) if store_path else None
+    
+    # Every run records per-user stage results so it can be resumed after a crash
+    # (a dry run records nothing, but planning a resume reads the interrupted run's progress)
+    manifest = None
+    if store is not None and (resume or not plan):
+        run_config = {"delta": delta, "cohort_threshold": cohort_threshold, "email_segments": email_segments,
+                      "outputs": list(outputs), "compress": compress}
+        manifest = (RunManifest.resume(store, run_config, resume) if resume
+                    else RunManifest.start(store, run_config, run_id))
+        print(f"{'Resuming' if resume else 'Starting'} run {manifest.run_id}")
+    elif resume:
+        raise ValueError("Resuming a run needs a run store")
+    feature_store = FeatureStore(feature_path) if feature_path else None
+    
+    tracer = tracing.Tracer(trace_path) if trace_path and not plan else None
+    tracing.set_tracer(tracer)
+    
+    # Record every model call; the aggregator prints the per-agent summary at the end
+    call_stats = telemetry.InMemoryAggregator()
+    sinks = [call_stats]
+    if telemetry_path and not plan:
+        sinks.append(telemetry.JsonlFileSink(telemetry_path))
+    telemetry.set_sink(telemetry.FanOutSink(sinks))
+    run_plan = None
+    if plan:
+        # Earlier calls in the telemetry log predict output tokens; the plan receives the skip events
+        run_plan = RunPlan(output_tokens=output_token_estimates(telemetry_path), budget=plan_budget)
+        telemetry.set_sink(run_plan)
+    
     # S3 configuration
     S3_BUCKET = "notifi-transaction-dataset"
     S3_PREFIX = "notifi-dump/"
     
     # Step 1: Get user IDs
     user_ids = get_user_ids()
+    if shard is not None:
+        population = len(user_ids)
+        user_ids = shard.select(user_ids)
+        print(f"{shard.name}: {len(user_ids)} of {population} users")
     
     # Step 2: Load all data from S3
     print("Loading data from S3...")
-    userinfo_df = read_csv_from_s3(S3_BUCKET, f"{S3_PREFIX}user.csv")
-    
-    # Load all product data
-    product_data = {
-        'coupons': read_csv_from_s3(S3_BUCKET, f"{S3_PREFIX}product_coupons_data.csv").to_dict(orient='records'),
-        'loans': read_csv_from_s3(S3_BUCKET, f"{S3_PREFIX}loan_data.csv").to_dict(orient='records'),
-        'credit_cards': read_csv_from_s3(S3_BUCKET, f"{S3_PREFIX}credit_card_data.csv").to_dict(orient='records'),
-        'savings': read_csv_from_s3(S3_BUCKET, f"{S3_PREFIX}high_yield_savings_data.csv").to_dict(orient='records')
-    }
+    with tracing.span("load_data"):
+        userinfo_df = read_csv_from_s3(S3_BUCKET, f"{S3_PREFIX}user.csv")
+        
+        # Load all product data
+        product_data = {
+            'coupons': read_csv_from_s3(S3_BUCKET, f"{S3_PREFIX}product_coupons_data.csv").to_dict(orient='records'),
+            'loans': read_csv_from_s3(S3_BUCKET, f"{S3_PREFIX}loan_data.csv").to_dict(orient='records'),
+            'credit_cards': read_csv_from_s3(S3_BUCKET, f"{S3_PREFIX}credit_card_data.csv").to_dict(orient='records'),
+            'savings': read_csv_from_s3(S3_BUCKET, f"{S3_PREFIX}high_yield_savings_data.csv").to_dict(orient='records')
+        }
+        # Indexed once by product ID and shared by every agent, the email context and the output builder
+        product_data = ProductCatalog(product_data)
     print("Data loaded successfully from S3!")
+    
+    # Fingerprint each catalog so unchanged recommendations can be reused
+    catalog_versions = {name: catalog_fingerprint(records) for name, records in product_data.items()}
+    changed_catalogs = store.changed_catalogs(catalog_versions) if store is not None else []
+    if changed_catalogs:
+        print(f"Catalogs changed since the last run: {', '.join(changed_catalogs)}")
 
-    # Step 3: Process each user
-    for user_id in user_ids:
-        # Print separator for clarity
-        print(f"\n{'='*50}")
-        print(f"Processing User {user_id}")
-        print(f"{'='*50}")
+    cohorts = None
+    if cohort_threshold is not None:
+        if store is None or feature_store is None:
+            raise ValueError("Cohort reuse needs a run store and a feature store")
+        cohorts = CohortIndex(cohort_threshold)
+        versions = {
+            rec_key: recommendation_version(catalog_versions, catalog_key, agent_module)
+            for rec_key, catalog_key, agent_module, _, _ in RECOMMENDATION_AGENTS
+        }
+        user_infos = {info['User_id']: info for info in userinfo_df.to_dict('records')}
+        indexed = cohorts.seed(store, feature_store, user_infos, versions)
+        print(f"Cohort index seeded with {indexed} stored recommendation lists")
+    
+    # Step 3: Decide which users need processing
+    if delta and changed_catalogs:
+        # Every user's recommendations depend on every catalog; agents with unchanged catalogs reuse stored results
+        print("Catalog change detected: processing all users, rerunning only the affected agents")
+    if delta and not changed_catalogs:
+        if store is None:
+            raise ValueError("Delta ingestion needs a run store for watermarks")
+        print("Finding users with new transactions since their watermark...")
+        with tracing.span("delta_ingestion") as stage:
+            all_transactions = load_all_transactions(user_ids if shard is not None else None)
+            deltas = find_user_deltas(all_transactions, store.get_watermarks(), user_ids)
+            if stage:
+                stage.set(changed_users=len(deltas), users=len(user_ids))
+        print(f"{len(deltas)} of {len(user_ids)} users have new transactions; the rest keep their previous output")
+        work = [(d.user_id, d.transactions, d.watermark, d.affected_months) for d in deltas]
+    else:
+        # One read of the (shard's) transactions instead of one full read per user
+        print(f"Loading transactions of {len(user_ids)} users...")
+        with tracing.span("load_transactions", users=len(user_ids)):
+            shard_users = user_ids if shard is not None else None
+            user_transactions = split_user_transactions(load_all_transactions(shard_users), user_ids)
+        work = [(user_id, user_transactions[user_id], None, None) for user_id in user_ids]
+    
+    # Users whose output an interrupted run already wrote are done
+    if resume:
+        completed = manifest.completed_users()
+        work = [entry for entry in work if str(entry[0]) not in completed]
+        print(f"{len(completed)} users already completed in {manifest.run_id}; {len(work)} left")
+    
+    # Features of every user in one pass; the per-user stages only read them
+    if feature_store is not None and work:
+        with tracing.span("features", users=len(work)):
+            feature_store.update(pd.concat([transactions for _, transactions, _, _ in work]),
+                                 {user_id: affected_months for user_id, _, _, affected_months in work})
+    
+    if run_plan is not None:
+        plan_users(run_plan, work, userinfo_df, product_data, store, catalog_versions, feature_store, cohorts,
+                   email_segments, manifest, workers)
+        run_plan.print_summary()
+        return run_plan
+    
+    # Outputs are written in the background while later users are processed
+    codec = OutputCodec.load() if compress else None
+    output_sinks = []
+    if "file" in outputs:
+        output_sinks.append(FileSink(codec=codec))
+    if "dynamodb" in outputs:
+        output_sinks.append(DynamoDBSink(dynamodb_table, codec=codec))
+    if store is not None and not rewrite_outputs:
+        output_sinks = [SkipUnchangedSink(sink, store) for sink in output_sinks]
+    if "artifact" in outputs:
+        # The run artifact holds every output of the run, changed or not
+        artifact_directory = os.path.join(DEFAULT_ARTIFACT_ROOT, manifest.run_id) if manifest is not None else None
+        if artifact_directory and shard is not None:
+            artifact_directory = os.path.join(artifact_directory, shard.name)
+        artifact_writer = RunArtifactWriter(artifact_directory, codec=codec, resume=bool(resume),
+                                            completed_users=completed if resume else None)
+        artifact_directory = artifact_writer.directory
+        output_sinks.append(artifact_writer)
+    else:
+        artifact_directory = None
+    output_writer = BackgroundWriter(FanOutSink(output_sinks))
+    
+    # Step 4: Schedule every user's stages; ready stages of all users share the workers
+    scheduler = StageScheduler(workers, limits={"model": model_stages})
+    failed_users = []
+    
+    def user_failed(user_id, error):
+        if isinstance(error, resilience.ModelCallError):
+            # Leave no output for this user rather than writing default recommendations
+            print(f"✗ Skipping user {user_id}: {error}")
+        else:
+            print(f"✗ Error processing user {user_id}: {error}")
+        failed_users.append(user_id)
+    
+    with tracing.span("process_users", users=len(work)):
+        for user_id, transactions, watermark, affected_months in work:
+            # Print separator for clarity
+            print(f"\n{'='*50}")
+            print(f"Processing User {user_id}")
+            print(f"{'='*50}")
+            if affected_months:
+                print(f"New transactions in: {', '.join(affected_months)}")
         
-        user_info = userinfo_df[userinfo_df['User_id'] == user_id].iloc[0].to_dict()
-        transactions = get_user_transactions(user_id)
-        process_user(user_id, user_info, transactions, product_data)
+            user_info = userinfo_df[userinfo_df['User_id'] == user_id].iloc[0].to_dict()
+            if watermark is None and not transactions.empty:
+                watermark = latest_watermark(transactions)
+            # Only advance the watermark and mark the user done once the output is written
+            on_written = functools.partial(output_written, store, manifest, user_id, watermark)
+            submit_user(scheduler, user_id, user_info, transactions, product_data, store, catalog_versions,
+                        feature_store, cohorts, email_segments, output_writer, on_written,
+                        functools.partial(user_failed, user_id), manifest)
+    
+        # Every output is queued once the scheduler is closed
+        scheduler.close()
+    print(f"Users processed: {scheduler.completed}, failed: {scheduler.failed}")
+    output_writer.close()
+    failed_users.extend(output_writer.failed_users)
+    
+    if feature_store is not None:
+        feature_store.save()
+    
+    if store is not None:
+        # Users without output lose their watermark, so the next delta run retries them in full;
+        # the catalogs then count as processed even if some users failed
+        for user_id in failed_users:
+            store.clear_watermark(user_id)
+        store.save_catalog_versions(catalog_versions)
+    
+    call_stats.print_summary()
+    rules_recommender.stats.print_summary()
+    if cohorts is not None:
+        cohorts.print_summary()
+    retry_counts = resilience.stats.snapshot()
+    print(f"Model call retries: {retry_counts['retries']} "
+          f"(throttled {retry_counts['throttled']}, transient {retry_counts['transient']}, "
+          f"permanent {retry_counts['permanent']}, gave up {retry_counts['gave_up']}); "
+          f"final concurrency limit {resilience.shared_limiter.limit:.1f}")
+    if failed_users:
+        print(f"Users without output due to model or write errors ({len(failed_users)}): {', '.join(failed_users)}")
+    if manifest is not None:
+        if resume:
+            print(f"Stage results reused from the interrupted run: {manifest.reused}")
+        if failed_users:
+            print(f"Run {manifest.run_id} is incomplete; rerun with --resume {manifest.run_id} to finish it")
+        else:
+            manifest.finish()
+    if tracer:
+        tracer.close()
+    
+    # Each shard leaves a manifest next to the run's outputs; merge_shards.py combines them
+    if shard is not None:
+        shard_run_id = manifest.run_id if manifest is not None else run_id or new_run_id()
+        manifest_path = write_shard_manifest(os.path.join(DEFAULT_ARTIFACT_ROOT, shard_run_id), shard, shard_run_id, {
+            "users": len(user_ids),
+            "processed": len(work),
+            "completed": scheduler.completed,
+            "failed_users": failed_users,
+            "elapsed": time.time() - started_at,
+            "call_stats": call_stats.summary(),
+            "retries": retry_counts,
+            "rules": {"considered": dict(rules_recommender.stats.considered),
+                      "decided": dict(rules_recommender.stats.decided)},
+            "outputs": list(outputs),
+            "artifact": artifact_directory,
+            "telemetry": telemetry_path,
+            "run_store": store_path,
+        })
+        print(f"Shard manifest written to {manifest_path}")
 
 
 if __name__ == "__main__":
-    run_pipeline()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the transaction analysis pipeline")
+    parser.add_argument("--delta", action="store_true",
+                        help="only process users with new transactions since the last run")
+    parser.add_argument("--cohort-threshold", type=float, default=None, metavar="SIMILARITY",
+                        help="reuse recommendations of a similar user at or above this cosine similarity (e.g. 0.97)")
+    parser.add_argument("--email-segments", action="store_true",
+                        help="generate email subject templates once per user segment and fill them per user")
+    parser.add_argument("--output", choices=["file", "dynamodb", "artifact"], action="append",
+                        help="where each user's output goes as soon as it is built: output/output_<user>.json, "
+                             "DynamoDB, or one run artifact under output/runs/ (repeat for several; default file)")
+    parser.add_argument("--dynamodb-table", default="UserRecommendations",
+                        help="DynamoDB table for --output dynamodb")
+    parser.add_argument("--compress", action="store_true",
+                        help="store outputs as zstd-compressed binary; train a dictionary with output_codec.py --train")
+    parser.add_argument("--resume", nargs="?", const="latest", default=None, metavar="RUN_ID",
+                        help="continue an interrupted run (default: the latest unfinished one), "
+                             "skipping users and stages it already completed")
+    parser.add_argument("--rewrite-outputs", action="store_true",
+                        help="write every output, including those unchanged since they were last written")
+    parser.add_argument("--workers", type=int, default=DEFAULT_STAGE_WORKERS,
+                        help="threads running user stages concurrently")
+    parser.add_argument("--shard-index", type=int, default=None,
+                        help="process only this shard of the users (0-based; needs --shard-count)")
+    parser.add_argument("--shard-count", type=int, default=None,
+                        help="number of shards the users are split into by a stable hash of User_id")
+    parser.add_argument("--run-id", default=None,
+                        help="ID of the new run (default run-<timestamp>-<suffix>); give every shard the same ID "
+                             "so merge_shards.py finds their manifests under output/runs/<run-id>")
+    parser.add_argument("--plan", action="store_true",
+                        help="dry run: predict model calls, tokens and cost of the run without calling a model")
+    parser.add_argument("--plan-budget", type=int, default=DEFAULT_PROMPT_BUDGET,
+                        help="token budget each planned prompt plus its output cap must fit in")
+    parser.add_argument("--model-stages", type=int, default=DEFAULT_MODEL_STAGES,
+                        help="stages that call the model allowed to run at once across all users")
+    parser.add_argument("--trace", nargs="?", const="logs/pipeline_trace.json", default=None, metavar="PATH",
+                        help="record a Chrome trace of every stage (default logs/pipeline_trace.json); "
+                             "open it in chrome://tracing or ui.perfetto.dev")
+    args = parser.parse_args()
+    if (args.shard_index is None) != (args.shard_count is None):
+        parser.error("--shard-index and --shard-count must be given together")
+    
+    shard = Shard(args.shard_index, args.shard_count) if args.shard_count is not None else None
+    outputs = tuple(args.output or ["file"])
+    run_pipeline(delta=args.delta, cohort_threshold=args.cohort_threshold, email_segments=args.email_segments,
+                 outputs=outputs, dynamodb_table=args.dynamodb_table, compress=args.compress,
+                 rewrite_outputs=args.rewrite_outputs, resume=args.resume, workers=args.workers,
+                 model_stages=args.model_stages, shard=shard, run_id=args.run_id, plan=args.plan,
+                 plan_budget=args.plan_budget, trace_path=args.trace)
\ No newline at end of file
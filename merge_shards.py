@@ -0,0 +1,164 @@
+import argparse
+import glob
+import json
+import os
+from agents import telemetry
+
+
+# Per-agent call statistics that add up across shards
+ADDITIVE_CALL_STATS = ("calls", "cache_hits", "input_tokens", "output_tokens", "retries", "fallbacks")
+LATENCY_STATS = ("latency_p50", "latency_p95", "latency_p99")
+
+
+def load_shard_manifests(paths):
+    """
+    Read shard manifests from run directories and/or manifest files
+
+    Args:
+        paths (list): Run directories (output/runs/<run_id>) or shard-*.json files copied from other nodes
+
+    Returns:
+        list: Manifests ordered by shard index
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "shard-*-of-*.json"))))
+        else:
+            files.append(path)
+    manifests = []
+    for path in files:
+        with open(path) as f:
+            manifests.append(json.load(f))
+    return sorted(manifests, key=lambda manifest: manifest["shard_index"])
+
+
+def merge_call_stats(manifests):
+    """
+    Per-agent call statistics of the whole run
+
+    Counts and tokens are summed. Latency percentiles are recomputed from the
+    shards' telemetry logs when all of them are readable here; otherwise the
+    slowest shard's percentile is reported as an upper bound.
+
+    Returns:
+        tuple: (agent -> statistics, True if latencies are exact)
+    """
+    telemetry_paths = [manifest.get("telemetry") for manifest in manifests]
+    if telemetry_paths and all(path and os.path.exists(path) for path in telemetry_paths):
+        aggregator = telemetry.InMemoryAggregator()
+        for path in telemetry_paths:
+            with open(path) as f:
+                for line in f:
+                    aggregator.emit(telemetry.LLMCallEvent(**json.loads(line)))
+        return aggregator.summary(), True
+
+    merged = {}
+    for manifest in manifests:
+        for agent, stats in manifest.get("call_stats", {}).items():
+            totals = merged.setdefault(agent, {name: 0 for name in ADDITIVE_CALL_STATS + LATENCY_STATS})
+            for name in ADDITIVE_CALL_STATS:
+                totals[name] += stats.get(name, 0)
+            for name in LATENCY_STATS:
+                totals[name] = max(totals[name], stats.get(name, 0))
+    return dict(sorted(merged.items())), False
+
+
+def merge_manifests(manifests):
+    """
+    Combine the shard manifests of one run
+
+    Args:
+        manifests (list): Manifests from load_shard_manifests()
+
+    Returns:
+        dict: Run-level totals, failed users, per-agent metrics, artifacts and missing shards
+
+    Raises:
+        ValueError: If there are no manifests or they disagree on the shard count
+    """
+    if not manifests:
+        raise ValueError("No shard manifests found")
+    shard_counts = {manifest["shard_count"] for manifest in manifests}
+    if len(shard_counts) != 1:
+        raise ValueError(f"Shard manifests disagree on the shard count: {sorted(shard_counts)}")
+    shard_count = shard_counts.pop()
+    indexes = [manifest["shard_index"] for manifest in manifests]
+    duplicates = sorted({index for index in indexes if indexes.count(index) > 1})
+    if duplicates:
+        raise ValueError(f"Several manifests for shard(s) {duplicates}")
+
+    call_stats, exact_latency = merge_call_stats(manifests)
+    retries, rules = {}, {"considered": {}, "decided": {}}
+    for manifest in manifests:
+        for name, count in manifest.get("retries", {}).items():
+            retries[name] = retries.get(name, 0) + count
+        for kind in rules:
+            for agent, count in manifest.get("rules", {}).get(kind, {}).items():
+                rules[kind][agent] = rules[kind].get(agent, 0) + count
+
+    return {
+        "run_ids": sorted({manifest["run_id"] for manifest in manifests}),
+        "shard_count": shard_count,
+        "shards_merged": len(manifests),
+        "missing_shards": sorted(set(range(shard_count)) - set(indexes)),
+        "users": sum(manifest["users"] for manifest in manifests),
+        "processed": sum(manifest["processed"] for manifest in manifests),
+        "completed": sum(manifest["completed"] for manifest in manifests),
+        "failed_users": [user for manifest in manifests for user in manifest["failed_users"]],
+        # Shards run side by side, so the run took as long as its slowest shard
+        "elapsed": max(manifest["elapsed"] for manifest in manifests),
+        "shard_elapsed": {manifest["shard_index"]: manifest["elapsed"] for manifest in manifests},
+        "call_stats": call_stats,
+        "exact_latency": exact_latency,
+        "retries": retries,
+        "rules": rules,
+        "artifacts": [manifest["artifact"] for manifest in manifests if manifest.get("artifact")],
+    }
+
+
+def print_merged_summary(summary):
+    print(f"\n===== Sharded Run {', '.join(summary['run_ids'])} =====")
+    print(f"Shards merged: {summary['shards_merged']} of {summary['shard_count']}")
+    if summary["missing_shards"]:
+        print(f"Missing shards: {', '.join(str(index) for index in summary['missing_shards'])}")
+    print(f"Users: {summary['users']:,}, processed {summary['processed']:,}, completed {summary['completed']:,}, "
+          f"failed {len(summary['failed_users']):,}")
+    slowest = max(summary["shard_elapsed"].values())
+    fastest = min(summary["shard_elapsed"].values())
+    print(f"Elapsed: {summary['elapsed']:.1f}s (fastest shard {fastest:.1f}s, slowest {slowest:.1f}s)")
+    if summary["call_stats"]:
+        latency_note = "" if summary["exact_latency"] else " (latency: slowest shard)"
+        print(f"\n{'agent':<20} {'calls':>8} {'hits':>7} {'p95 s':>7} {'tokens in':>12} {'tokens out':>12} "
+              f"{'retries':>7}{latency_note}")
+        for agent, stats in summary["call_stats"].items():
+            print(f"{agent:<20} {stats['calls']:>8,} {stats['cache_hits']:>7,} {stats['latency_p95']:>7.2f} "
+                  f"{stats['input_tokens']:>12,} {stats['output_tokens']:>12,} {stats['retries']:>7,}")
+    if summary["retries"]:
+        print(f"\nModel call retries: {summary['retries'].get('retries', 0)} "
+              f"(throttled {summary['retries'].get('throttled', 0)}, gave up {summary['retries'].get('gave_up', 0)})")
+    if summary["artifacts"]:
+        print(f"Run artifacts: {', '.join(summary['artifacts'])}")
+    if summary["failed_users"]:
+        print(f"Users without output ({len(summary['failed_users'])}): "
+              f"{', '.join(str(user) for user in summary['failed_users'])}")
+    print("========================================\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Combine the shard manifests and metrics of a sharded run")
+    parser.add_argument("paths", nargs="+",
+                        help="run directories (output/runs/<run-id>) or shard manifest files")
+    parser.add_argument("--output", default=None,
+                        help="where to write the merged summary (default: run_summary.json in the first directory)")
+    args = parser.parse_args()
+
+    summary = merge_manifests(load_shard_manifests(args.paths))
+    print_merged_summary(summary)
+    output_path = args.output
+    if output_path is None and os.path.isdir(args.paths[0]):
+        output_path = os.path.join(args.paths[0], "run_summary.json")
+    if output_path:
+        with open(output_path, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Merged summary written to {output_path}")
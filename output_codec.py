@@ -0,0 +1,242 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import threading
+from decimal import Decimal
+import orjson
+import zstandard
+
+
+# First byte of every encoded output; bump when the layout changes
+FORMAT_VERSION = 1
+
+# Value of the item's output_format attribute, so readers know how to decode 'output'
+FORMAT_TAG = f"zstd-json/{FORMAT_VERSION}"
+
+# Trained dictionaries, one file per dictionary ID, plus a CURRENT file naming the one used for writing
+DEFAULT_DICTIONARY_DIR = "state/output_dictionaries"
+
+COMPRESSION_LEVEL = 10
+DICTIONARY_SIZE = 64 * 1024
+
+# Suffix of compressed per-user output files
+COMPRESSED_SUFFIX = ".json.zst"
+
+
+def _default(obj):
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return str(obj)
+
+
+def to_json_bytes(output):
+    """
+    Compact JSON encoding of an output (numpy scalars and Decimals included)
+    """
+    return orjson.dumps(output, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+
+def output_digest(output):
+    """
+    Stable SHA-256 digest of an output's content (key order does not matter)
+    """
+    payload = orjson.dumps(output, default=_default,
+                           option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
+def train_dictionary(outputs, size=DICTIONARY_SIZE):
+    """
+    Train a zstd dictionary on sample outputs
+
+    Outputs share most of their keys, product records and summary phrasing, so
+    a dictionary lets even a single small output compress well.
+
+    Args:
+        outputs (list): Sample output dicts (a few hundred is plenty)
+        size (int): Dictionary size in bytes
+
+    Returns:
+        zstandard.ZstdCompressionDict: The trained dictionary
+    """
+    samples = [to_json_bytes(output) for output in outputs]
+    return zstandard.train_dictionary(size, samples)
+
+
+def save_dictionary(dictionary, directory=DEFAULT_DICTIONARY_DIR):
+    """
+    Store a dictionary and make it the one new outputs are encoded with
+
+    Earlier dictionaries are kept so outputs written with them stay readable.
+    """
+    os.makedirs(directory, exist_ok=True)
+    dict_id = dictionary.dict_id()
+    with open(os.path.join(directory, f"{dict_id}.zstd"), 'wb') as f:
+        f.write(dictionary.as_bytes())
+    with open(os.path.join(directory, "CURRENT"), 'w') as f:
+        f.write(str(dict_id))
+    return dict_id
+
+
+class OutputCodec:
+    """
+    Encode outputs as a version byte followed by a zstd frame of compact JSON
+
+    Decoding accepts the binary format as well as the legacy JSON string and
+    nested-map forms, so readers can handle items written before the codec.
+
+    Example:
+        codec = OutputCodec.load()
+        data = codec.encode(output)
+        assert codec.decode(data) == output
+    """
+    def __init__(self, dictionary=None, decode_dictionaries=None, level=COMPRESSION_LEVEL):
+        self.dictionary = dictionary
+        self.level = level
+        self._dictionaries = dict(decode_dictionaries or {})
+        if dictionary is not None:
+            self._dictionaries[dictionary.dict_id()] = dictionary
+            dictionary.precompute_compress(level=level)
+        self._local = threading.local()
+
+    @classmethod
+    def load(cls, directory=DEFAULT_DICTIONARY_DIR, level=COMPRESSION_LEVEL):
+        """
+        Codec using the current trained dictionary, or none if no dictionary was trained
+        """
+        dictionaries = {}
+        current = None
+        if os.path.isdir(directory):
+            for filename in os.listdir(directory):
+                if filename.endswith(".zstd"):
+                    with open(os.path.join(directory, filename), 'rb') as f:
+                        dictionary = zstandard.ZstdCompressionDict(f.read())
+                    dictionaries[dictionary.dict_id()] = dictionary
+            current_path = os.path.join(directory, "CURRENT")
+            if os.path.exists(current_path):
+                with open(current_path) as f:
+                    current = dictionaries.get(int(f.read().strip()))
+        return cls(current, dictionaries, level)
+
+    def dictionary_for(self, dict_id):
+        """
+        Trained dictionary with this ID (raises ValueError if it is not available)
+        """
+        dictionary = self._dictionaries.get(dict_id)
+        if dictionary is None:
+            raise ValueError(f"Output was compressed with dictionary {dict_id}, which is not available")
+        return dictionary
+
+    def _compressor(self):
+        # zstd (de)compressors are not thread-safe, so each writer thread gets its own
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+            self._local.compressor = compressor
+        return compressor
+
+    def encode(self, output):
+        """
+        Args:
+            output (dict): One user's final output
+
+        Returns:
+            bytes: Format version byte + zstd frame
+        """
+        return bytes([FORMAT_VERSION]) + self._compressor().compress(to_json_bytes(output))
+
+    def decode(self, data):
+        """
+        Decode an output stored in any supported form
+
+        Args:
+            data: bytes from encode(), a boto3 Binary, a JSON string or an already nested dict
+
+        Returns:
+            dict: The output
+        """
+        data = getattr(data, 'value', data)
+        if isinstance(data, dict):
+            return data
+        if isinstance(data, str):
+            return json.loads(data)
+        data = bytes(data)
+        if data[:1] in (b'{', b'['):
+            return orjson.loads(data)
+        if data[0] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported output format version {data[0]}")
+        frame = data[1:]
+        dict_id = zstandard.get_frame_parameters(frame).dict_id
+        dictionary = self.dictionary_for(dict_id) if dict_id else None
+        return orjson.loads(zstandard.ZstdDecompressor(dict_data=dictionary).decompress(frame))
+
+    def decode_item(self, item):
+        """
+        Output held by a DynamoDB item, whichever way it was written
+        """
+        return self.decode(item['output'])
+
+
+def wcu(size):
+    """
+    Write capacity units of one standard put of an item of `size` bytes
+    """
+    return max(1, math.ceil(size / 1024))
+
+
+def report_sizes(outputs, codec):
+    """
+    Print total bytes and WCUs of the outputs as pretty JSON, compact JSON and encoded
+    """
+    encodings = {
+        "pretty JSON": lambda output: json.dumps(output, indent=2, default=_default).encode('utf-8'),
+        "compact JSON": to_json_bytes,
+        FORMAT_TAG + (" + dictionary" if codec.dictionary is not None else ""): codec.encode,
+    }
+    print(f"\n===== Output Size ({len(outputs)} outputs) =====")
+    baseline = None
+    for name, encode in encodings.items():
+        sizes = [len(encode(output)) for output in outputs]
+        total = sum(sizes)
+        baseline = baseline or total
+        print(f"{name:<32} {total:>12,} bytes  max {max(sizes):>9,}  "
+              f"{sum(wcu(size) for size in sizes):>8,} WCU  ({total / baseline:.0%})")
+    print("========================================\n")
+
+
+def load_output_files(directory="output", limit=None):
+    outputs = []
+    codec = OutputCodec.load()
+    for filename in sorted(os.listdir(directory)):
+        path = os.path.join(directory, filename)
+        if filename.endswith(".json"):
+            with open(path) as f:
+                outputs.append(json.load(f))
+        elif filename.endswith(COMPRESSED_SUFFIX):
+            with open(path, 'rb') as f:
+                outputs.append(codec.decode(f.read()))
+        if limit and len(outputs) >= limit:
+            break
+    return outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the output compression dictionary and report output sizes")
+    parser.add_argument("--outputs", default="output", help="directory of per-user outputs to sample")
+    parser.add_argument("--train", action="store_true", help="train a new dictionary on the sampled outputs")
+    parser.add_argument("--samples", type=int, default=1000, help="number of outputs to sample")
+    args = parser.parse_args()
+
+    outputs = load_output_files(args.outputs, args.samples)
+    if not outputs:
+        print(f"No outputs found in {args.outputs}")
+    else:
+        if args.train:
+            try:
+                dict_id = save_dictionary(train_dictionary(outputs))
+                print(f"Trained dictionary {dict_id} on {len(outputs)} outputs")
+            except zstandard.ZstdError as e:
+                print(f"Could not train a dictionary on {len(outputs)} outputs ({e}); more samples are needed")
+        report_sizes(outputs, OutputCodec.load())
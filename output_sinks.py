@@ -0,0 +1,320 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+from decimal import Decimal
+from agents import tracing
+from output_codec import COMPRESSED_SUFFIX, FORMAT_TAG, output_digest
+
+
+# DynamoDB rejects items larger than this
+DYNAMODB_ITEM_LIMIT = 400 * 1024
+
+
+def decimal_default(obj):
+    """JSON serializer function that handles Decimal objects"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+
+def convert_floats_to_decimal(obj):
+    """Convert float values to Decimal for DynamoDB compatibility"""
+    if isinstance(obj, list):
+        return [convert_floats_to_decimal(item) for item in obj]
+    elif isinstance(obj, dict):
+        return {key: convert_floats_to_decimal(value) for key, value in obj.items()}
+    elif isinstance(obj, float):
+        return Decimal(str(obj))
+    else:
+        return obj
+
+
+def build_item(user_id, output_data, use_json_string=True, codec=None, digest=None):
+    """
+    DynamoDB item holding one user's output
+
+    Args:
+        user_id (str): The user ID
+        output_data (dict): The complete output data from the pipeline
+        use_json_string (bool): If True, store output as JSON string; if False, store as nested DynamoDB structure
+        codec (OutputCodec): If given, store output as a compressed Binary attribute (overrides use_json_string)
+        digest (str): Content digest from output_digest(), stored as 'output_digest' if given
+
+    Returns:
+        dict: Item with 'user_id' and 'output' attributes ('output_format' too when compressed)
+    """
+    if codec is not None:
+        item = {
+            'user_id': user_id,
+            'output': codec.encode(output_data),
+            'output_format': FORMAT_TAG
+        }
+    elif use_json_string:
+        # Store as JSON string - much shorter and simpler
+        item = {
+            'user_id': user_id,
+            'output': json.dumps(output_data, default=decimal_default)
+        }
+    else:
+        # Convert floats to Decimal for DynamoDB compatibility (nested structure)
+        item = {
+            'user_id': user_id,
+            'output': convert_floats_to_decimal(output_data)
+        }
+    if digest is not None:
+        item['output_digest'] = digest
+    return item
+
+
+class FileSink:
+    """
+    Write each user's output to output/output_{user_id}.json, or output_{user_id}.json.zst with a codec
+    """
+    def __init__(self, directory="output", codec=None):
+        self.directory = directory
+        self.codec = codec
+        self.destination = f"file:{directory}:{FORMAT_TAG if codec is not None else 'json'}"
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, user_id, output):
+        json_path = os.path.join(self.directory, f"output_{user_id}.json")
+        compressed_path = os.path.join(self.directory, f"output_{user_id}{COMPRESSED_SUFFIX}")
+        if self.codec is not None:
+            with open(compressed_path, 'wb') as f:
+                f.write(self.codec.encode(output))
+            stale_path = json_path
+        else:
+            with open(json_path, 'w') as f:
+                json.dump(output, f, indent=2)
+            stale_path = compressed_path
+        # Keep one file per user: drop the one an earlier run wrote in the other format
+        try:
+            os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        pass
+
+
+class DynamoDBSink:
+    """
+    Put each user's output into a DynamoDB table
+
+    The table resource is created once and reused for every item. Pass `table`
+    to write somewhere else, e.g. a LocalDynamoDBTable in tests.
+    """
+    def __init__(self, table_name="UserRecommendations", use_json_string=True, table=None, region_name='us-east-1',
+                 codec=None):
+        if table is None:
+            import boto3
+            table = boto3.resource('dynamodb', region_name=region_name).Table(table_name)
+        self.table = table
+        self.use_json_string = use_json_string
+        self.codec = codec
+        self.destination = self.destination_for(table_name, use_json_string, codec)
+
+    @staticmethod
+    def destination_for(table_name, use_json_string=True, codec=None):
+        """
+        Output digest destination of a table and item format
+        """
+        item_format = FORMAT_TAG if codec is not None else 'json' if use_json_string else 'map'
+        return f"dynamodb:{table_name}:{item_format}"
+
+    def write(self, user_id, output):
+        item = build_item(user_id, output, self.use_json_string, self.codec, output_digest(output))
+        self.table.put_item(Item=item)
+
+    def close(self):
+        pass
+
+
+class FanOutSink:
+    """
+    Write every output to several sinks
+    """
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def write(self, user_id, output):
+        for sink in self.sinks:
+            sink.write(user_id, output)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class SkipUnchangedSink:
+    """
+    Skip outputs identical to the one last written to the same destination
+
+    The digest of each written output is recorded in the run store per user
+    and destination, so an unchanged output costs neither a write nor, for
+    DynamoDB, any write capacity. Digests are recorded only after the wrapped
+    sink's write succeeds.
+    """
+    def __init__(self, sink, store):
+        self.sink = sink
+        self.store = store
+        self.destination = sink.destination
+        self.written = 0
+        self.skipped = 0
+
+    def write(self, user_id, output):
+        digest = output_digest(output)
+        if self.store.get_output_digest(user_id, self.destination) == digest:
+            self.skipped += 1
+            return
+        self.sink.write(user_id, output)
+        self.store.put_output_digest(user_id, self.destination, digest)
+        self.written += 1
+
+    def close(self):
+        self.sink.close()
+        print(f"{self.destination}: {self.written} written, {self.skipped} unchanged and skipped")
+
+
+class LocalDynamoDBTable:
+    """
+    In-memory stand-in for a boto3 DynamoDB Table
+
+    Keeps items by `key_name` and enforces the 400 KB item limit so sinks can be
+    exercised without AWS.
+
+    Example:
+        table = LocalDynamoDBTable()
+        DynamoDBSink(table=table).write("U1", output)
+        table.get_item(Key={'user_id': 'U1'})['Item']
+    """
+    def __init__(self, key_name='user_id'):
+        self.key_name = key_name
+        self.items = {}
+        self.put_calls = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def item_size(item):
+        """
+        Approximate DynamoDB item size: attribute names plus serialized values
+        """
+        size = 0
+        for name, value in item.items():
+            size += len(name.encode('utf-8'))
+            if isinstance(value, (bytes, bytearray)):
+                size += len(value)
+            elif isinstance(value, str):
+                size += len(value.encode('utf-8'))
+            else:
+                size += len(json.dumps(value, default=str).encode('utf-8'))
+        return size
+
+    def put_item(self, Item, **kwargs):
+        if self.item_size(Item) > DYNAMODB_ITEM_LIMIT:
+            raise ValueError(f"Item size has exceeded the maximum allowed size ({self.item_size(Item):,} bytes)")
+        with self._lock:
+            self.items[Item[self.key_name]] = dict(Item)
+            self.put_calls += 1
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def get_item(self, Key, **kwargs):
+        with self._lock:
+            item = self.items.get(Key[self.key_name])
+        return {'Item': dict(item)} if item is not None else {}
+
+
+class LocalDynamoDBClient:
+    """
+    In-memory stand-in for the low-level DynamoDB client's batch_write_item
+
+    Stores items in wire format ({'S': ...}) per table. Each request leaves a
+    random `unprocessed_rate` share of its items in UnprocessedItems, like a
+    table short of write capacity.
+    """
+    def __init__(self, unprocessed_rate=0.0, key_name='user_id', seed=None):
+        self.unprocessed_rate = unprocessed_rate
+        self.key_name = key_name
+        self.tables = {}
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        unprocessed = {}
+        with self._lock:
+            self.calls += 1
+            for table_name, requests in RequestItems.items():
+                if len(requests) > 25:
+                    raise ValueError("Too many items requested for the BatchWriteItem call")
+                table = self.tables.setdefault(table_name, {})
+                for request in requests:
+                    if self._random.random() < self.unprocessed_rate:
+                        unprocessed.setdefault(table_name, []).append(request)
+                        continue
+                    item = request['PutRequest']['Item']
+                    table[next(iter(item[self.key_name].values()))] = item
+        return {'UnprocessedItems': unprocessed}
+
+
+_CLOSE = object()
+
+
+class BackgroundWriter:
+    """
+    Hand outputs to a sink on a background thread as soon as they are built
+
+    At most `max_pending` outputs wait in the queue; submit() blocks beyond
+    that so a slow sink applies backpressure instead of buffering the whole run.
+    A failed write is counted and reported but does not stop the writer.
+
+    Example:
+        writer = BackgroundWriter(FileSink())
+        writer.submit("U1", output, on_written=lambda: print("U1 stored"))
+        writer.close()
+    """
+    def __init__(self, sink, max_pending=64):
+        self.sink = sink
+        self.written = 0
+        self.failed_users = []
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="output-writer", daemon=True)
+        self._started = time.time()
+        self._thread.start()
+
+    def submit(self, user_id, output, on_written=None):
+        """
+        Queue one user's output; on_written() runs on the writer thread after a successful write
+        """
+        self._queue.put((user_id, output, on_written))
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is _CLOSE:
+                break
+            user_id, output, on_written = entry
+            try:
+                with tracing.span("write_output", user_id=user_id):
+                    self.sink.write(user_id, output)
+                self.written += 1
+                if on_written is not None:
+                    on_written()
+            except Exception as e:
+                print(f"✗ Error writing output for user {user_id}: {e}")
+                self.failed_users.append(user_id)
+
+    def close(self):
+        """
+        Wait for every queued output to be written, then close the sink
+        """
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self.sink.close()
+        elapsed = time.time() - self._started
+        print(f"Outputs written: {self.written}, failed: {len(self.failed_users)} ({elapsed:.1f}s)")
+        if self.failed_users:
+            print(f"Users whose output could not be written: {', '.join(self.failed_users)}")
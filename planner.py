@@ -0,0 +1,204 @@
+import json
+import os
+import threading
+import tiktoken
+from agents import email_notification_agent, telemetry
+from agents.agent_template import build_user_context, estimate_text_tokens
+from agents.generation_profiles import GENERATION_PROFILES
+
+
+# Bedrock on-demand price of the pipeline's model (Claude 3.5 Sonnet), USD per million tokens
+PRICE_PER_MILLION_INPUT = 3.00
+PRICE_PER_MILLION_OUTPUT = 15.00
+
+# A prompt plus its output cap above this many tokens is reported (check_context_window_limit's default)
+DEFAULT_PROMPT_BUDGET = 100000
+
+# Claude's tokenizer is not published; cl100k_base counts English and JSON text closely
+TOKENIZER_ENCODING = "cl100k_base"
+
+
+class TokenCounter:
+    """
+    Count prompt tokens with a tiktoken encoding
+
+    tiktoken downloads the encoding on first use; without network access or a
+    TIKTOKEN_CACHE_DIR holding it, counts fall back to the 4-characters-per-token
+    estimate used elsewhere in the pipeline.
+    """
+    def __init__(self, encoding=TOKENIZER_ENCODING):
+        try:
+            self._encoding = tiktoken.get_encoding(encoding)
+            self.name = encoding
+        except Exception as e:
+            print(f"Warning: tokenizer {encoding} is not available ({e}); estimating 4 characters per token")
+            self._encoding = None
+            self.name = "4 chars/token estimate"
+
+    def count(self, text):
+        if self._encoding is None:
+            return estimate_text_tokens(text)
+        return len(self._encoding.encode(text, disallowed_special=()))
+
+
+def output_token_estimates(telemetry_path=None):
+    """
+    Expected output tokens per agent
+
+    The mean of earlier calls whose usage the model reported, read from the
+    telemetry log; agents without history are assumed to use their whole cap.
+
+    Args:
+        telemetry_path (str): JSONL log written by telemetry.JsonlFileSink (None = no history)
+
+    Returns:
+        dict: Agent name -> output tokens per call
+    """
+    estimates = {profile.name: profile.max_tokens for profile in GENERATION_PROFILES.values()}
+    if not telemetry_path or not os.path.exists(telemetry_path):
+        return estimates
+    totals = {}
+    with open(telemetry_path) as f:
+        for line in f:
+            event = json.loads(line)
+            if (event.get("usage_source") != "response" or event.get("outcome") == "error"
+                    or event.get("cache_status") in telemetry.SKIPPED_CALL_STATUSES):
+                continue
+            count, tokens = totals.get(event["agent"], (0, 0))
+            totals[event["agent"]] = (count + 1, tokens + event["output_tokens"])
+    for agent, (count, tokens) in totals.items():
+        estimates[agent] = tokens / count
+    return estimates
+
+
+def cost(input_tokens, output_tokens):
+    return input_tokens * PRICE_PER_MILLION_INPUT / 1e6 + output_tokens * PRICE_PER_MILLION_OUTPUT / 1e6
+
+
+class RunPlan:
+    """
+    Predicted model calls, tokens and cost of a run, collected by a dry run of the pipeline
+
+    During a plan the pipeline runs every stage as usual but calls add_call()
+    with the exact prompt inputs where it would call a model. The plan is also
+    installed as the telemetry sink, so results the run would take from the run
+    store, a cohort neighbour, the rules, segment templates or an interrupted
+    run arrive as the same skip events a real run records.
+
+    Example:
+        plan = RunPlan(output_tokens=output_token_estimates("logs/llm_calls.jsonl"))
+        telemetry.set_sink(plan)
+        ...  # run the stages with plan=plan
+        plan.print_summary()
+    """
+    def __init__(self, counter=None, output_tokens=None, budget=DEFAULT_PROMPT_BUDGET):
+        self.counter = counter or TokenCounter()
+        self.output_tokens = output_tokens or output_token_estimates()
+        self.budget = budget
+        self.agents = {}
+        self.users = {}
+        self.over_budget = []
+        self._segments = set()
+        self._lock = threading.Lock()
+
+    def _agent(self, agent):
+        return self.agents.setdefault(agent, {"calls": 0, "input_tokens": 0, "output_tokens": 0,
+                                              "max_prompt": 0, "skipped": {}})
+
+    def emit(self, event):
+        """
+        Telemetry sink: count a call the run would skip
+        """
+        with self._lock:
+            skipped = self._agent(event.agent)["skipped"]
+            skipped[event.cache_status] = skipped.get(event.cache_status, 0) + 1
+
+    def add_call(self, profile, system_prompt, user_info, transactions, product_data):
+        """
+        Count one model call from the inputs the agent would receive
+
+        Args:
+            profile (GenerationProfile): The agent's generation profile
+            system_prompt (str): The agent's system prompt
+            user_info (dict), transactions (list or DataFrame), product_data (list): The agent's state inputs
+        """
+        if hasattr(transactions, 'to_dict'):
+            transactions = transactions.to_dict('records')
+        input_tokens = self.counter.count(system_prompt) + self.counter.count(
+            build_user_context(user_info, transactions, product_data))
+        if profile.structured_output:
+            input_tokens += self.counter.count(json.dumps(profile.tool_spec()))
+        output_tokens = self.output_tokens.get(profile.name, profile.max_tokens)
+        user_id = telemetry.current_context().get("user_id")
+
+        with self._lock:
+            stats = self._agent(profile.name)
+            stats["calls"] += 1
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["max_prompt"] = max(stats["max_prompt"], input_tokens)
+            user = self.users.setdefault(user_id, {"calls": 0, "input_tokens": 0, "output_tokens": 0})
+            user["calls"] += 1
+            user["input_tokens"] += input_tokens
+            user["output_tokens"] += output_tokens
+            if input_tokens + profile.max_tokens > self.budget:
+                self.over_budget.append((user_id, profile.name, input_tokens))
+
+    def add_email_call(self, email_context, segment_mode=False, template_store=None):
+        """
+        Count the email call of one user: per user, or once per segment without stored templates
+        """
+        profile = GENERATION_PROFILES["email_notification"]
+        if not segment_mode:
+            self.add_call(profile, email_notification_agent.system_prompt,
+                          *email_notification_agent.email_agent_inputs(email_context))
+            return
+        segment = email_context['segment']
+        key = email_notification_agent.segment_key(segment)
+        with self._lock:
+            planned = key in self._segments
+            self._segments.add(key)
+        if planned or (template_store is not None and template_store.get_email_templates(
+                key, email_notification_agent.SEGMENT_PROMPT_VERSION) is not None):
+            telemetry.record_cache_hit('email_notification', cache_status="segment")
+            return
+        self.add_call(profile, email_notification_agent.segment_system_prompt,
+                      *email_notification_agent.segment_agent_inputs(segment))
+
+    def totals(self):
+        with self._lock:
+            calls = sum(stats["calls"] for stats in self.agents.values())
+            input_tokens = sum(stats["input_tokens"] for stats in self.agents.values())
+            output_tokens = sum(stats["output_tokens"] for stats in self.agents.values())
+        return {"calls": calls, "input_tokens": input_tokens, "output_tokens": output_tokens,
+                "cost": cost(input_tokens, output_tokens)}
+
+    def print_summary(self, users_shown=20):
+        print(f"\n===== Run Plan ({len(self.users)} users with model calls, tokens by {self.counter.name}) =====")
+        print(f"{'agent':<20} {'calls':>8} {'skipped':>8} {'tokens in':>12} {'tokens out':>11} "
+              f"{'max prompt':>10} {'cost $':>9}  skipped by")
+        for agent, stats in sorted(self.agents.items()):
+            skipped = stats["skipped"]
+            reasons = ", ".join(f"{reason} {count}" for reason, count in sorted(skipped.items()))
+            print(f"{agent:<20} {stats['calls']:>8,} {sum(skipped.values()):>8,} {stats['input_tokens']:>12,} "
+                  f"{stats['output_tokens']:>11,.0f} {stats['max_prompt']:>10,} "
+                  f"{cost(stats['input_tokens'], stats['output_tokens']):>9,.2f}  {reasons}")
+        totals = self.totals()
+        print(f"{'total':<20} {totals['calls']:>8,} {'':>8} {totals['input_tokens']:>12,} "
+              f"{totals['output_tokens']:>11,.0f} {'':>10} {totals['cost']:>9,.2f}")
+        if self.over_budget:
+            # Largest prompt and number of prompts over budget per user
+            users = {}
+            for user_id, agent, tokens in self.over_budget:
+                count, largest = users.get(user_id, (0, (0, agent)))
+                users[user_id] = (count + 1, max(largest, (tokens, agent)))
+            print(f"\n⚠️ {len(users)} user(s) have prompts that with their output cap exceed the "
+                  f"{self.budget:,} token budget:")
+            ranked = sorted(users.items(), key=lambda item: -item[1][1][0])
+            for user_id, (count, (tokens, agent)) in ranked[:users_shown]:
+                print(f"  {user_id}: {count} prompt(s), largest {agent} with {tokens:,} input tokens")
+            if len(ranked) > users_shown:
+                print(f"  ... and {len(ranked) - users_shown} more")
+        else:
+            print(f"\nNo prompt exceeds the {self.budget:,} token budget")
+        print("==========================================\n")
@@ -0,0 +1,264 @@
+import json
+import os
+import threading
+import time
+import orjson
+import zstandard
+from output_codec import COMPRESSION_LEVEL, OutputCodec, to_json_bytes
+
+
+# Run artifacts are written to DEFAULT_ARTIFACT_ROOT/run-<timestamp>/
+DEFAULT_ARTIFACT_ROOT = "output/runs"
+
+# A new shard is started once the current one reaches this size
+DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+
+INDEX_FILE = "index.tsv"
+MANIFEST_FILE = "manifest.json"
+
+
+def shard_name(number):
+    return f"part-{number:05d}.jsonl.zst"
+
+
+def new_artifact_directory(root=DEFAULT_ARTIFACT_ROOT):
+    return os.path.join(root, time.strftime("run-%Y%m%d-%H%M%S"))
+
+
+class RunArtifactWriter:
+    """
+    Append every user's output to one run-level dataset instead of one file per user
+
+    Layout of the artifact directory:
+    - part-00000.jsonl.zst, ...: one {"user_id", "output"} JSON line per user,
+      each compressed as its own zstd frame, so a single record can be read by
+      offset and a closed artifact's shard decompresses as a whole with
+      `zstd -d` (plus `-D` and the dictionary if one was used)
+    - index.tsv: user_id, shard, byte offset and length of each record
+    - manifest.json: shards, record count and compression dictionary, written on close
+
+    Implements the output sink interface (write/close), so it can be handed to
+    a BackgroundWriter like the file and DynamoDB sinks. With `resume`, an
+    artifact left behind by a crashed run is continued in new shards; records
+    of users outside `completed_users` (written, but never marked done in the
+    run manifest) and earlier records of users written twice are removed from
+    the index and the shards, as the resumed run writes them again.
+    """
+    def __init__(self, directory=None, shard_bytes=DEFAULT_SHARD_BYTES, codec=None, resume=False,
+                 completed_users=None):
+        self.directory = directory or new_artifact_directory()
+        self.destination = f"artifact:{self.directory}"
+        self.shard_bytes = shard_bytes
+        self.dictionary = codec.dictionary if codec is not None else None
+        self.records = 0
+        self.shards = []
+        self._compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL, dict_data=self.dictionary)
+        self._lock = threading.Lock()
+        self._shard = None
+        self._offset = 0
+        os.makedirs(self.directory, exist_ok=True)
+        if resume:
+            self._recover(completed_users)
+        self._index = open(os.path.join(self.directory, INDEX_FILE), 'a' if resume else 'w')
+
+    def _recover(self, completed_users=None):
+        """
+        Keep the records a crashed run indexed and remove every other frame from the shards
+
+        A shard whose kept records are contiguous is truncated after the last
+        one; a shard with superseded or dropped records between them is
+        rewritten with only the kept records, and a shard left with none is
+        removed.
+
+        Args:
+            completed_users (set): User IDs whose records to keep (None = every indexed user);
+                only the last record of each user is kept
+        """
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        latest = {}
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    # A crash can leave a partial last line
+                    if len(fields) == 4 and line.endswith("\n"):
+                        latest.pop(fields[0], None)
+                        latest[fields[0]] = line
+        entries = {}
+        frames = {}
+        for user_id, line in latest.items():
+            if completed_users is not None and user_id not in completed_users:
+                continue
+            _, shard, offset, length = line.rstrip("\n").split("\t")
+            entries[user_id] = (int(shard), int(offset), int(length))
+            frames.setdefault(int(shard), []).append((int(offset), int(length), user_id))
+        shard_count = len([name for name in os.listdir(self.directory) if name.endswith(".jsonl.zst")])
+        self.shards = []
+        for number in range(shard_count):
+            path = os.path.join(self.directory, shard_name(number))
+            kept = sorted(frames.get(number, []))
+            if not kept:
+                # An empty file is not a valid zstd stream
+                os.remove(path)
+                continue
+            # Shards left empty are removed, so later shards move down to keep the numbering contiguous
+            new_number = len(self.shards)
+            self.shards.append(shard_name(new_number))
+            end = 0
+            for offset, length, user_id in kept:
+                if offset != end:
+                    break
+                entries[user_id] = (new_number, offset, length)
+                end += length
+            else:
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+                os.replace(path, os.path.join(self.directory, self.shards[-1]))
+                continue
+            # Copy the kept frames into a new shard, then move it over the old one
+            with open(path, 'rb') as source, open(path + ".tmp", 'wb') as target:
+                position = 0
+                for offset, length, user_id in kept:
+                    source.seek(offset)
+                    target.write(source.read(length))
+                    entries[user_id] = (new_number, position, length)
+                    position += length
+            os.remove(path)
+            os.replace(path + ".tmp", os.path.join(self.directory, self.shards[-1]))
+        with open(index_path, 'w') as f:
+            f.writelines(f"{user_id}\t{shard}\t{offset}\t{length}\n"
+                         for user_id, (shard, offset, length) in entries.items())
+        self.records = len(entries)
+
+    def _next_shard(self):
+        if self._shard is not None:
+            self._shard.close()
+        name = shard_name(len(self.shards))
+        self.shards.append(name)
+        self._shard = open(os.path.join(self.directory, name), 'wb')
+        self._offset = 0
+
+    def write(self, user_id, output):
+        line = to_json_bytes({"user_id": user_id, "output": output}) + b"\n"
+        with self._lock:
+            # The compressor is not thread-safe, so frames are built under the lock too
+            frame = self._compressor.compress(line)
+            if self._shard is None or self._offset >= self.shard_bytes:
+                self._next_shard()
+            self._shard.write(frame)
+            self._index.write(f"{user_id}\t{len(self.shards) - 1}\t{self._offset}\t{len(frame)}\n")
+            # Flushed per record so a crash never leaves an output marked written but missing here
+            self._shard.flush()
+            self._index.flush()
+            self._offset += len(frame)
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            if self._shard is not None:
+                self._shard.close()
+            self._index.close()
+            manifest = {
+                "records": self.records,
+                "shards": self.shards,
+                "dictionary_id": self.dictionary.dict_id() if self.dictionary is not None else None,
+                "created_at": time.time(),
+            }
+            with open(os.path.join(self.directory, MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f, indent=2)
+        print(f"Run artifact {self.directory}: {self.records} outputs in {len(self.shards)} shard(s)")
+
+
+class RunArtifact:
+    """
+    Read a run artifact written by RunArtifactWriter
+
+    Iterating reads every (user_id, output) shard by shard in index order;
+    get() reads a single user's record by offset. A user indexed twice (a
+    record rewritten by a resumed run) is read from its last index entry only.
+    An artifact without a manifest (still being written, or left by a crashed
+    run) is read from the records its index lists so far.
+
+    Example:
+        artifact = RunArtifact("output/runs/run-20250701-020000")
+        for user_id, output in artifact:
+            ...
+        artifact.get("U42")
+    """
+    def __init__(self, directory, codec=None):
+        self.directory = directory
+        self._index = None
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            self.manifest = self._manifest_from_index()
+        codec = codec or OutputCodec.load()
+        dict_id = self.manifest.get("dictionary_id")
+        self._dictionary = codec.dictionary_for(dict_id) if dict_id else None
+
+    def _manifest_from_index(self):
+        """
+        The manifest of an artifact that was not closed, rebuilt from its index and shards
+        """
+        index = self._entries()
+        shards = sorted(name for name in os.listdir(self.directory) if name.endswith(".jsonl.zst"))
+        dict_id = None
+        if index:
+            # Every frame names the dictionary it was compressed with
+            shard, offset, length = next(iter(index.values()))
+            with open(os.path.join(self.directory, shards[shard]), 'rb') as f:
+                f.seek(offset)
+                dict_id = zstandard.get_frame_parameters(f.read(length)).dict_id or None
+        return {"records": len(index), "shards": shards, "dictionary_id": dict_id, "created_at": None}
+
+    def __len__(self):
+        return len(self._entries())
+
+    def _decompressor(self):
+        return zstandard.ZstdDecompressor(dict_data=self._dictionary)
+
+    def __iter__(self):
+        # Frames not in the index (superseded records) are skipped rather than streamed
+        by_shard = {}
+        for shard, offset, length in self._entries().values():
+            by_shard.setdefault(shard, []).append((offset, length))
+        decompressor = self._decompressor()
+        for shard in sorted(by_shard):
+            with open(os.path.join(self.directory, self.manifest["shards"][shard]), 'rb') as f:
+                for offset, length in sorted(by_shard[shard]):
+                    f.seek(offset)
+                    record = orjson.loads(decompressor.decompress(f.read(length)))
+                    yield record["user_id"], record["output"]
+
+    def _load_index(self):
+        # Later entries of a user replace earlier ones
+        index = {}
+        with open(os.path.join(self.directory, INDEX_FILE)) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                # The last line of an artifact still being written may be partial
+                if len(fields) != 4 or not line.endswith("\n"):
+                    continue
+                user_id, shard, offset, length = fields
+                index[user_id] = (int(shard), int(offset), int(length))
+        return index
+
+    def _entries(self):
+        if self._index is None:
+            self._index = self._load_index()
+        return self._index
+
+    def get(self, user_id):
+        """
+        One user's output, or None if the user is not in the artifact
+        """
+        entry = self._entries().get(str(user_id))
+        if entry is None:
+            return None
+        shard, offset, length = entry
+        with open(os.path.join(self.directory, self.manifest["shards"][shard]), 'rb') as f:
+            f.seek(offset)
+            frame = f.read(length)
+        return orjson.loads(self._decompressor().decompress(frame))["output"]
@@ -0,0 +1,444 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+DEFAULT_STORE_PATH = "state/run_store.sqlite"
+
+
+def new_run_id():
+    """
+    Unique run ID: run-<timestamp>-<random suffix>, so runs started in the same second never collide
+    """
+    return f"{time.strftime('run-%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+
+def digest_records(records, extra=None):
+    """
+    Stable SHA-256 digest of a list of records (order-independent)
+
+    Args:
+        records (list): List of dicts, e.g. one month of transactions
+        extra: Optional additional JSON-serializable input to fold into the digest
+
+    Returns:
+        str: Hex digest
+    """
+    rows = sorted(json.dumps(record, sort_keys=True, default=str) for record in records)
+    hasher = hashlib.sha256()
+    for row in rows:
+        hasher.update(row.encode('utf-8'))
+        hasher.update(b"\n")
+    if extra is not None:
+        hasher.update(json.dumps(extra, sort_keys=True, default=str).encode('utf-8'))
+    return hasher.hexdigest()
+
+
+def catalog_fingerprint(records):
+    """
+    Version of a product catalog: a digest of its records in load order
+
+    Order is part of the version because agents see the catalog as a list.
+
+    Args:
+        records (list): Catalog rows as dicts
+
+    Returns:
+        str: Short hex digest
+    """
+    payload = json.dumps(records, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+class RunStore:
+    """
+    Persistent state shared across pipeline runs, backed by a local sqlite file
+
+    Holds results that are expensive to recompute so later runs can reuse them:
+    - monthly_summaries: financial summary per (user, month, transaction digest, prompt version)
+    - watermarks: (Txn Date, Txn ID) of the newest transaction processed per user
+    - catalogs: fingerprint of each product catalog used by the last completed run
+    - recommendations: product IDs per (user, product type) with the catalog version that produced them
+    - email_subjects: email subjects per user with a digest of their inputs
+    - email_templates: subject templates per email segment and prompt version
+    - output_digests: digest of the output last written per (user, output destination)
+    - runs / run_stages: each run's settings and the per-user stage results it completed, for --resume
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS monthly_summaries (
+        user_id TEXT NOT NULL,
+        month_year TEXT NOT NULL,
+        txn_digest TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        summary TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (user_id, month_year, txn_digest, prompt_version)
+    );
+    CREATE TABLE IF NOT EXISTS watermarks (
+        user_id TEXT PRIMARY KEY,
+        txn_date TEXT NOT NULL,
+        txn_id TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS catalogs (
+        name TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS recommendations (
+        user_id TEXT NOT NULL,
+        product_type TEXT NOT NULL,
+        catalog_version TEXT NOT NULL,
+        input_digest TEXT NOT NULL,
+        product_ids TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (user_id, product_type)
+    );
+    CREATE TABLE IF NOT EXISTS email_subjects (
+        user_id TEXT PRIMARY KEY,
+        input_digest TEXT NOT NULL,
+        subjects TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS email_templates (
+        segment_key TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        templates TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (segment_key, prompt_version)
+    );
+    CREATE TABLE IF NOT EXISTS output_digests (
+        user_id TEXT NOT NULL,
+        destination TEXT NOT NULL,
+        digest TEXT NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (user_id, destination)
+    );
+    CREATE TABLE IF NOT EXISTS runs (
+        run_id TEXT PRIMARY KEY,
+        config TEXT NOT NULL,
+        started_at REAL NOT NULL,
+        finished_at REAL
+    );
+    CREATE TABLE IF NOT EXISTS run_stages (
+        run_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        result TEXT NOT NULL,
+        completed_at REAL NOT NULL,
+        PRIMARY KEY (run_id, user_id, stage)
+    );
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            rows = cursor.fetchall()
+            self._conn.commit()
+            return rows
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # Monthly summaries
+
+    def get_summary(self, user_id, month_year, txn_digest, prompt_version):
+        """
+        Look up a stored monthly summary
+
+        Returns:
+            dict: The stored summary, or None if this month's inputs were never summarized
+        """
+        rows = self._execute(
+            "SELECT summary FROM monthly_summaries "
+            "WHERE user_id = ? AND month_year = ? AND txn_digest = ? AND prompt_version = ?",
+            (str(user_id), str(month_year), txn_digest, prompt_version)
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def put_summary(self, user_id, month_year, txn_digest, prompt_version, summary):
+        """
+        Store a monthly summary, replacing older versions for the same user and month
+        """
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM monthly_summaries WHERE user_id = ? AND month_year = ?",
+                (str(user_id), str(month_year))
+            )
+            self._conn.execute(
+                "INSERT INTO monthly_summaries VALUES (?, ?, ?, ?, ?, ?)",
+                (str(user_id), str(month_year), txn_digest, prompt_version,
+                 json.dumps(summary, default=str), time.time())
+            )
+            self._conn.commit()
+
+    # Watermarks
+
+    def get_watermarks(self):
+        """
+        Newest processed transaction per user
+
+        Returns:
+            dict: user_id -> (txn_date, txn_id)
+        """
+        rows = self._execute("SELECT user_id, txn_date, txn_id FROM watermarks")
+        return {user_id: (txn_date, txn_id) for user_id, txn_date, txn_id in rows}
+
+    def set_watermark(self, user_id, watermark):
+        """
+        Record that a user's transactions up to `watermark` have been processed
+
+        Args:
+            user_id (str): User ID
+            watermark (tuple): (txn_date 'YYYY-MM-DD', txn_id)
+        """
+        txn_date, txn_id = watermark
+        self._execute(
+            "INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?)",
+            (str(user_id), str(txn_date), str(txn_id), time.time())
+        )
+
+    def clear_watermark(self, user_id):
+        """
+        Forget a user's watermark so the next delta run processes all their transactions
+        """
+        self._execute("DELETE FROM watermarks WHERE user_id = ?", (str(user_id),))
+
+    # Catalog versions
+
+    def changed_catalogs(self, versions):
+        """
+        Catalogs whose version differs from the last completed run
+
+        Args:
+            versions (dict): catalog name -> version
+
+        Returns:
+            list: Names of new or changed catalogs
+        """
+        previous = dict(self._execute("SELECT name, version FROM catalogs"))
+        return [name for name, version in versions.items() if previous.get(name) != version]
+
+    def save_catalog_versions(self, versions):
+        """
+        Record the catalog versions once every user has been processed against them
+        """
+        for name, version in versions.items():
+            self._execute(
+                "INSERT OR REPLACE INTO catalogs VALUES (?, ?, ?)",
+                (name, version, time.time())
+            )
+
+    # Recommendations
+
+    def get_recommendation(self, user_id, product_type, catalog_version, input_digest):
+        """
+        Stored product IDs, if they were produced from the same catalog and user inputs
+
+        Returns:
+            list: Product IDs, or None if the agent has to run again
+        """
+        rows = self._execute(
+            "SELECT product_ids FROM recommendations "
+            "WHERE user_id = ? AND product_type = ? AND catalog_version = ? AND input_digest = ?",
+            (str(user_id), product_type, catalog_version, input_digest)
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_recommendations_for_version(self, product_type, catalog_version):
+        """
+        Every stored recommendation list of one product type produced by a given version
+
+        Returns:
+            list: (user_id, product_ids) pairs
+        """
+        rows = self._execute(
+            "SELECT user_id, product_ids FROM recommendations WHERE product_type = ? AND catalog_version = ?",
+            (product_type, catalog_version)
+        )
+        return [(user_id, json.loads(product_ids)) for user_id, product_ids in rows]
+
+    def put_recommendation(self, user_id, product_type, catalog_version, input_digest, product_ids):
+        self._execute(
+            "INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?, ?, ?, ?)",
+            (str(user_id), product_type, catalog_version, input_digest, json.dumps(product_ids), time.time())
+        )
+
+    # Email subjects
+
+    def get_email_subjects(self, user_id, input_digest):
+        rows = self._execute(
+            "SELECT subjects FROM email_subjects WHERE user_id = ? AND input_digest = ?",
+            (str(user_id), input_digest)
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def put_email_subjects(self, user_id, input_digest, subjects):
+        self._execute(
+            "INSERT OR REPLACE INTO email_subjects VALUES (?, ?, ?, ?)",
+            (str(user_id), input_digest, json.dumps(subjects), time.time())
+        )
+
+    # Email subject templates
+
+    def get_email_templates(self, segment_key, prompt_version):
+        rows = self._execute(
+            "SELECT templates FROM email_templates WHERE segment_key = ? AND prompt_version = ?",
+            (segment_key, prompt_version)
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def put_email_templates(self, segment_key, prompt_version, templates):
+        self._execute(
+            "INSERT OR REPLACE INTO email_templates VALUES (?, ?, ?, ?)",
+            (segment_key, prompt_version, json.dumps(templates), time.time())
+        )
+
+    # Output digests
+
+    def get_output_digest(self, user_id, destination):
+        rows = self._execute(
+            "SELECT digest FROM output_digests WHERE user_id = ? AND destination = ?",
+            (str(user_id), destination)
+        )
+        return rows[0][0] if rows else None
+
+    def put_output_digest(self, user_id, destination, digest):
+        self._execute(
+            "INSERT OR REPLACE INTO output_digests VALUES (?, ?, ?, ?)",
+            (str(user_id), destination, digest, time.time())
+        )
+
+    # Runs and their per-user stage results
+
+    def start_run(self, run_id, config):
+        self._execute(
+            "INSERT INTO runs VALUES (?, ?, ?, NULL)",
+            (run_id, json.dumps(config, sort_keys=True, default=str), time.time())
+        )
+
+    def get_run(self, run_id):
+        """
+        Settings of a run, or None if no run with this ID was started
+        """
+        rows = self._execute("SELECT config, finished_at FROM runs WHERE run_id = ?", (run_id,))
+        if not rows:
+            return None
+        config, finished_at = rows[0]
+        return {"run_id": run_id, "config": json.loads(config), "finished_at": finished_at}
+
+    def latest_unfinished_run(self):
+        rows = self._execute(
+            "SELECT run_id FROM runs WHERE finished_at IS NULL ORDER BY started_at DESC LIMIT 1"
+        )
+        return rows[0][0] if rows else None
+
+    def finish_run(self, run_id):
+        self._execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def get_stage_result(self, run_id, user_id, stage):
+        rows = self._execute(
+            "SELECT result FROM run_stages WHERE run_id = ? AND user_id = ? AND stage = ?",
+            (run_id, str(user_id), stage)
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def put_stage_result(self, run_id, user_id, stage, result):
+        self._execute(
+            "INSERT OR REPLACE INTO run_stages VALUES (?, ?, ?, ?, ?)",
+            (run_id, str(user_id), stage, json.dumps(result, default=str), time.time())
+        )
+
+    def users_with_stage(self, run_id, stage):
+        rows = self._execute(
+            "SELECT user_id FROM run_stages WHERE run_id = ? AND stage = ?", (run_id, stage)
+        )
+        return {user_id for user_id, in rows}
+
+
+class RunManifest:
+    """
+    Per-user stage completion of one pipeline run, recorded in the run store
+
+    Every run records its stages so a crashed run can be resumed with --resume:
+    users whose output was written are skipped, and for the others each
+    finished stage (an agent's recommendations, a month's summary, email
+    subjects) is read back instead of calling the model again.
+
+    Stages: "recommendations:<key>", "summary:<YYYY-MM>", "email", "output"
+    """
+    def __init__(self, store, run_id):
+        self.store = store
+        self.run_id = run_id
+        self.reused = 0
+
+    @classmethod
+    def start(cls, store, config, run_id=None):
+        """
+        Record a new run
+
+        Args:
+            store (RunStore): Run store to record progress in
+            config (dict): The run's settings, compared on resume
+            run_id (str): ID of the run (defaults to a new_run_id())
+
+        Raises:
+            ValueError: If a run with this ID was already started
+        """
+        run_id = run_id or new_run_id()
+        if store.get_run(run_id) is not None:
+            raise ValueError(f"Run {run_id} already exists; use --resume {run_id} to continue it")
+        store.start_run(run_id, config)
+        return cls(store, run_id)
+
+    @classmethod
+    def resume(cls, store, config, run_id="latest"):
+        """
+        Continue a recorded run ("latest" = the most recent unfinished one)
+
+        Raises:
+            ValueError: If there is no such run
+        """
+        if run_id == "latest":
+            run_id = store.latest_unfinished_run()
+            if run_id is None:
+                raise ValueError("No unfinished run to resume")
+        run = store.get_run(run_id)
+        if run is None:
+            raise ValueError(f"Unknown run {run_id}")
+        if run["finished_at"] is not None:
+            print(f"Run {run_id} already finished; resuming re-checks only users without output")
+        if run["config"] != json.loads(json.dumps(config, sort_keys=True, default=str)):
+            print(f"Warning: resuming {run_id} with different settings than it was started with: {run['config']}")
+        return cls(store, run_id)
+
+    def get(self, user_id, stage):
+        result = self.store.get_stage_result(self.run_id, user_id, stage)
+        if result is not None:
+            self.reused += 1
+        return result
+
+    def put(self, user_id, stage, result=True):
+        self.store.put_stage_result(self.run_id, user_id, stage, result)
+
+    def completed_users(self):
+        return self.store.users_with_stage(self.run_id, "output")
+
+    def finish(self):
+        self.store.finish_run(self.run_id)
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Shard:
+    """
+    One of `count` disjoint slices of the user population
+
+    Users are assigned by a stable hash of their User_id, so every process
+    or node computes the same assignment without coordinating, and a user
+    stays on the same shard from run to run as long as the count is unchanged.
+
+    Example:
+        shard = Shard(2, 8)
+        my_users = shard.select(get_user_ids())
+        shard.path("state/run_store.sqlite")  # state/run_store.shard-002-of-008.sqlite
+    """
+    index: int
+    count: int
+
+    def __post_init__(self):
+        if self.count < 1 or not 0 <= self.index < self.count:
+            raise ValueError(f"Invalid shard {self.index} of {self.count}: need 0 <= index < count")
+
+    @property
+    def name(self):
+        return f"shard-{self.index:03d}-of-{self.count:03d}"
+
+    def contains(self, user_id):
+        return shard_of(user_id, self.count) == self.index
+
+    def select(self, user_ids):
+        """
+        The users of this shard, in their original order
+        """
+        return [user_id for user_id in user_ids if self.contains(user_id)]
+
+    def path(self, path):
+        """
+        Per-shard variant of a state or log file path, so shards never share a file
+        """
+        if not path:
+            return path
+        root, extension = os.path.splitext(path)
+        return f"{root}.{self.name}{extension}"
+
+
+def shard_of(user_id, shard_count):
+    """
+    Shard number of a user (stable across processes, unlike hash())
+    """
+    digest = hashlib.blake2b(str(user_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
+
+
+def write_shard_manifest(directory, shard, run_id, summary):
+    """
+    Record what one shard of a run did, for merge_shards.py
+
+    Args:
+        directory (str): The run's output directory, shared by all shards (e.g. output/runs/<run_id>)
+        shard (Shard): The shard that ran
+        run_id (str): The shard's run ID
+        summary (dict): Users, failures, metrics and file locations of the shard
+
+    Returns:
+        str: Path of the manifest file
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = {"run_id": run_id, "shard_index": shard.index, "shard_count": shard.count,
+                "finished_at": time.time(), **summary}
+    path = os.path.join(directory, f"{shard.name}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,147 @@
+import numpy as np
+import pandas as pd
+from dataclasses import dataclass
+from typing import Tuple
+from agents.cash_flow import cash_flow
+
+
+@dataclass(frozen=True)
+class TagRule:
+    """
+    One spending behavior tag and the share that earns it
+
+    Attributes:
+        tag (str): Tag shown to the user, e.g. "Foodie"
+        categories (tuple): Txn Category prefixes counted toward the tag (empty = all spending)
+        threshold (float): Share at which the tag applies
+        basis (str): "spending" to divide by total spending, "income" to divide by income
+        below (bool): Apply the tag when the share is at or under the threshold instead of over it
+    """
+    tag: str
+    categories: Tuple[str, ...]
+    threshold: float
+    basis: str = "spending"
+    below: bool = False
+
+
+DEFAULT_TAG_RULES = (
+    TagRule("Foodie", ("FOOD_AND_DRINK_RESTAURANT", "FOOD_AND_DRINK_FAST_FOOD", "FOOD_AND_DRINK_COFFEE",
+                       "FOOD_AND_DRINK_BEER_WINE_AND_LIQUOR"), 0.15),
+    TagRule("Shopaholic", ("GENERAL_MERCHANDISE_CLOTHING", "GENERAL_MERCHANDISE_DEPARTMENT_STORES",
+                           "GENERAL_MERCHANDISE_ONLINE_MARKETPLACES", "GENERAL_MERCHANDISE_GIFTS",
+                           "PERSONAL_CARE_HAIR_AND_BEAUTY"), 0.15),
+    TagRule("Travel Enthusiast", ("TRAVEL_",), 0.10),
+    TagRule("Entertainment Buff", ("ENTERTAINMENT_",), 0.10),
+    TagRule("Home-Centered", ("RENT_AND_UTILITIES_", "UTILITIES_", "HOME_IMPROVEMENT_",
+                              "LOAN_PAYMENTS_MORTGAGE_PAYMENT"), 0.40),
+    TagRule("Health Conscious", ("MEDICAL_", "PERSONAL_CARE_GYMS_AND_FITNESS_CENTERS"), 0.08),
+    TagRule("Education Focused", ("GENERAL_SERVICES_EDUCATION", "GENERAL_MERCHANDISE_BOOK",
+                                  "LOAN_PAYMENTS_STUDENT_LOAN_PAYMENT"), 0.08),
+    TagRule("Tech Enthusiast", ("GENERAL_MERCHANDISE_ELECTRONICS", "ENTERTAINMENT_VIDEO_GAMES"), 0.08),
+    TagRule("Commuter", ("TRANSPORTATION_",), 0.12),
+    TagRule("Investor", ("TRANSFER_OUT_INVESTMENT_AND_RETIREMENT_FUNDS",), 0.10, basis="income"),
+    TagRule("Saver", (), 0.60, basis="income", below=True),
+)
+
+# Used when fewer rules apply than the number of tags per month
+FALLBACK_TAGS = ("Budget Master", "Balanced Spender")
+
+def build_spend_matrix(transactions):
+    """
+    Spend per Txn Category for every (user, month), plus income and total spending
+
+    Args:
+        transactions (pd.DataFrame): Transactions with User_id, Txn Amount, Txn Date, Txn Category
+            and optionally month_year
+
+    Returns:
+        tuple: (matrix, income, spending) where matrix is indexed by (User_id, month_year)
+            with one column per category, and income/spending are Series on the same index
+    """
+    if 'month_year' in transactions.columns:
+        months = transactions['month_year'].astype(str)
+    else:
+        months = pd.to_datetime(transactions['Txn Date'], errors='coerce').dt.strftime('%Y-%m')
+    income, spend, saved = cash_flow(transactions['Txn Category'], transactions['Txn Amount'])
+    frame = pd.DataFrame({
+        'User_id': transactions['User_id'].values,
+        'month_year': months.values,
+        'category': transactions['Txn Category'].astype(str).values,
+        'income': income,
+        'spend': spend,
+        # Savings and investment transfers count toward rules such as Investor but not toward spending
+        'outflow': spend + saved
+    })
+    frame = frame.dropna(subset=['month_year'])
+
+    matrix = frame.pivot_table(index=['User_id', 'month_year'], columns='category',
+                               values='outflow', aggfunc='sum', fill_value=0.0)
+    grouped = frame.groupby(['User_id', 'month_year'])
+    income = grouped['income'].sum().reindex(matrix.index)
+    spending = grouped['spend'].sum().reindex(matrix.index)
+    return matrix, income, spending
+
+
+def score_tags(matrix, income, spending, rules=DEFAULT_TAG_RULES):
+    """
+    Score every rule for every (user, month); a score of 1 or more means the tag applies
+
+    Returns:
+        pd.DataFrame: Same index as the matrix, one column per tag
+    """
+    scores = {}
+    for rule in rules:
+        if rule.categories:
+            columns = [c for c in matrix.columns if c.startswith(rule.categories)]
+            value = matrix[columns].sum(axis=1).to_numpy(dtype=float)
+        else:
+            value = spending.to_numpy(dtype=float)
+        base = (income if rule.basis == "income" else spending).to_numpy(dtype=float)
+
+        share = np.divide(value, base, out=np.full_like(value, np.nan), where=base > 0)
+        if rule.below:
+            # Larger margin under the threshold ranks higher; no income means the rule cannot apply
+            score = np.divide(rule.threshold, share, out=np.zeros_like(share), where=share > 0)
+            score = np.where((share == 0) & (base > 0), np.inf, score)
+        else:
+            score = share / rule.threshold
+        scores[rule.tag] = np.nan_to_num(score, nan=0.0, posinf=np.finfo(float).max)
+    return pd.DataFrame(scores, index=matrix.index)
+
+
+def compute_spending_tags(transactions, rules=DEFAULT_TAG_RULES, tags_per_month=2, fallback_tags=FALLBACK_TAGS):
+    """
+    Assign spending behavior tags to every user and month at once
+
+    The highest-scoring rules that pass their threshold become the month's
+    tags; remaining slots are filled from `fallback_tags`.
+
+    Args:
+        transactions (pd.DataFrame): Transactions for one or many users
+        rules (tuple): TagRule definitions with their thresholds
+        tags_per_month (int): Number of tags per month
+        fallback_tags (tuple): Tags used when too few rules apply
+
+    Returns:
+        dict: (user_id, 'YYYY-MM') -> list of tags
+    """
+    if transactions.empty:
+        return {}
+    matrix, income, spending = build_spend_matrix(transactions)
+    scores = score_tags(matrix, income, spending, rules)
+
+    values = scores.to_numpy()
+    tags = np.array(scores.columns)
+    top = np.argsort(-values, axis=1, kind='stable')[:, :tags_per_month]
+    top_scores = np.take_along_axis(values, top, axis=1)
+
+    result = {}
+    for key, row_tags, row_scores in zip(scores.index, tags[top], top_scores):
+        month_tags = [tag for tag, score in zip(row_tags, row_scores) if score >= 1.0]
+        for tag in fallback_tags:
+            if len(month_tags) >= tags_per_month:
+                break
+            if tag not in month_tags:
+                month_tags.append(tag)
+        result[key] = month_tags
+    return result
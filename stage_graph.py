@@ -0,0 +1,227 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional, Tuple
+
+
+@dataclass
+class Stage:
+    """
+    One node of a job's dependency graph
+
+    Attributes:
+        name (str): Unique name within the job; dependents receive the result under this name
+        fn (callable): Called with one keyword argument per input, returns the stage result
+        inputs (tuple): Names of the stages whose results fn needs
+        returns (type): Expected result type, checked when the stage finishes (None = unchecked)
+        resource (str): Global resource the stage holds while running, e.g. "model" (None = unlimited)
+    """
+    name: str
+    fn: Callable
+    inputs: Tuple[str, ...] = ()
+    returns: Optional[type] = None
+    resource: Optional[str] = None
+
+
+@dataclass
+class _Job:
+    key: str
+    stages: dict
+    on_done: Callable
+    on_error: Callable
+    wrap: Callable
+    sequence: int
+    positions: dict = field(default_factory=dict)
+    results: dict = field(default_factory=dict)
+    waiting: dict = field(default_factory=dict)
+    dependents: dict = field(default_factory=dict)
+    running: int = 0
+    error: Optional[BaseException] = None
+
+
+def validate(stages):
+    """
+    Check that stage names are unique, inputs exist and the graph has no cycle
+
+    Returns:
+        list: Stage names in a topological order
+
+    Raises:
+        ValueError: On a duplicate name, unknown input or cycle
+    """
+    by_name = {}
+    for stage in stages:
+        if stage.name in by_name:
+            raise ValueError(f"Duplicate stage {stage.name}")
+        by_name[stage.name] = stage
+    for stage in stages:
+        for name in stage.inputs:
+            if name not in by_name:
+                raise ValueError(f"Stage {stage.name} needs unknown stage {name}")
+
+    order = []
+    remaining = {stage.name: set(stage.inputs) for stage in stages}
+    while remaining:
+        ready = [name for name, inputs in remaining.items() if not inputs]
+        if not ready:
+            raise ValueError(f"Stages form a cycle: {', '.join(sorted(remaining))}")
+        for name in ready:
+            order.append(name)
+            del remaining[name]
+        for inputs in remaining.values():
+            inputs.difference_update(ready)
+    return order
+
+
+class StageScheduler:
+    """
+    Run the stage graphs of many jobs on one thread pool
+
+    A stage starts as soon as all its inputs are done and its resource has a
+    free slot, whichever job it belongs to, so a user with many months keeps
+    the model busy while other users wait on fewer calls. Ready stages of
+    earlier jobs go first, so users finish roughly in submission order.
+
+    When a stage raises, the rest of that job is skipped and on_error is
+    called once its running stages finish; other jobs are not affected.
+
+    Example:
+        scheduler = StageScheduler(max_workers=16, limits={"model": 8})
+        scheduler.submit("U1", stages, on_done=lambda results: ...)
+        scheduler.close()
+    """
+    def __init__(self, max_workers=16, limits=None, max_jobs=None):
+        self.limits = dict(limits or {})
+        self.max_jobs = max_jobs or max_workers * 4
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stage")
+        self._condition = threading.Condition()
+        self._ready = []
+        self._in_use = {resource: 0 for resource in self.limits}
+        self._jobs = {}
+        self._sequence = itertools.count()
+        # Jobs submitted whose callback has not returned yet
+        self._unfinished = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, key, stages, on_done=None, on_error=None, wrap=None):
+        """
+        Schedule one job; blocks while `max_jobs` jobs are still unfinished
+
+        Args:
+            key (str): Job identifier, e.g. the user ID
+            stages (list): The job's Stage graph
+            on_done (callable): on_done(results) with every stage's result, once all stages finished
+            on_error (callable): on_error(exception) if a stage failed
+            wrap (callable): wrap(stage) -> context manager entered around each stage, e.g. for tracing
+        """
+        validate(stages)
+        with self._condition:
+            while len(self._jobs) >= self.max_jobs:
+                self._condition.wait()
+            job = _Job(key, {stage.name: stage for stage in stages}, on_done, on_error, wrap, next(self._sequence))
+            for position, stage in enumerate(stages):
+                job.positions[stage.name] = position
+                job.waiting[stage.name] = set(stage.inputs)
+                for name in stage.inputs:
+                    job.dependents.setdefault(name, []).append(stage.name)
+                if not stage.inputs:
+                    heapq.heappush(self._ready, (job.sequence, position, stage.name))
+            self._jobs[job.sequence] = job
+            self._unfinished += 1
+            self._dispatch()
+
+    def _dispatch(self):
+        """
+        Start every ready stage whose resource has a free slot (called with the condition held)
+        """
+        deferred = []
+        while self._ready:
+            entry = heapq.heappop(self._ready)
+            sequence, _, name = entry
+            job = self._jobs.get(sequence)
+            # Stages left over from a failed job are dropped
+            if job is None or job.error is not None:
+                continue
+            resource = job.stages[name].resource
+            if resource in self.limits and self._in_use[resource] >= self.limits[resource]:
+                deferred.append(entry)
+                continue
+            if resource in self.limits:
+                self._in_use[resource] += 1
+            job.running += 1
+            self._executor.submit(self._run, job, name)
+        for entry in deferred:
+            heapq.heappush(self._ready, entry)
+
+    def _run(self, job, name):
+        stage = job.stages[name]
+        result, error = None, None
+        try:
+            kwargs = {input_name: job.results[input_name] for input_name in stage.inputs}
+            if job.wrap is not None:
+                with job.wrap(stage):
+                    result = stage.fn(**kwargs)
+            else:
+                result = stage.fn(**kwargs)
+            if stage.returns is not None and not isinstance(result, stage.returns):
+                raise TypeError(f"Stage {name} returned {type(result).__name__}, expected {stage.returns.__name__}")
+        except BaseException as e:
+            error = e
+        self._finish(job, name, result, error)
+
+    def _finish(self, job, name, result, error):
+        callback = None
+        with self._condition:
+            resource = job.stages[name].resource
+            if resource in self.limits:
+                self._in_use[resource] -= 1
+            job.running -= 1
+            if error is not None:
+                job.error = job.error or error
+            else:
+                job.results[name] = result
+                for dependent in job.dependents.get(name, []):
+                    job.waiting[dependent].discard(name)
+                    if not job.waiting[dependent]:
+                        heapq.heappush(self._ready, (job.sequence, job.positions[dependent], dependent))
+
+            finished = job.running == 0 and (job.error is not None or len(job.results) == len(job.stages))
+            if finished:
+                del self._jobs[job.sequence]
+                if job.error is not None:
+                    self.failed += 1
+                    callback = (job.on_error, job.error)
+                else:
+                    self.completed += 1
+                    callback = (job.on_done, job.results)
+            self._dispatch()
+            self._condition.notify_all()
+
+        if callback is None:
+            return
+        # Callbacks run outside the lock so they may submit further work
+        function, argument = callback
+        try:
+            if function is not None:
+                function(argument)
+        except Exception as e:
+            print(f"✗ Callback for job {job.key} failed: {e}")
+        finally:
+            with self._condition:
+                self._unfinished -= 1
+                self._condition.notify_all()
+
+    def wait(self):
+        """
+        Block until every submitted job has finished
+        """
+        with self._condition:
+            while self._unfinished:
+                self._condition.wait()
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
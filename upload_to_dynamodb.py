@@ -1,26 +1,25 @@
+import argparse
 import boto3
 import json
 import os
-from decimal import Decimal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from boto3.dynamodb.types import TypeSerializer
 from botocore.exceptions import ClientError
+from agents import resilience, tracing
+from output_codec import COMPRESSED_SUFFIX, OutputCodec, output_digest
+from output_sinks import DynamoDBSink, build_item
+from run_artifact import RunArtifact
+from run_store import RunStore
 
-def decimal_default(obj):
-    """JSON serializer function that handles Decimal objects"""
-    if isinstance(obj, Decimal):
-        return float(obj)
-    raise TypeError
-
-def convert_floats_to_decimal(obj):
-    """Convert float values to Decimal for DynamoDB compatibility"""
-    if isinstance(obj, list):
-        return [convert_floats_to_decimal(item) for item in obj]
-    elif isinstance(obj, dict):
-        return {key: convert_floats_to_decimal(value) for key, value in obj.items()}
-    elif isinstance(obj, float):
-        return Decimal(str(obj))
-    else:
-        return obj
+# BatchWriteItem accepts at most this many put requests
+BATCH_SIZE = 25
 
+# Backoff for batches DynamoDB throttles or returns as UnprocessedItems
+UPLOAD_RETRY_POLICY = resilience.RetryPolicy(max_attempts=8, base_delay=0.05, max_delay=5.0)
+
+@tracing.traced("dynamodb.upload_user")
 def upload_user_recommendations_to_dynamodb(user_id, output_data, table_name="UserRecommendations", use_json_string=True):
     """
     Upload user recommendations to DynamoDB table
@@ -36,19 +35,7 @@ def upload_user_recommendations_to_dynamodb(user_id, output_data, table_name="Us
         dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
         table = dynamodb.Table(table_name)
         
-        if use_json_string:
-            # Store as JSON string - much shorter and simpler
-            item = {
-                'user_id': user_id,
-                'output': json.dumps(output_data, default=decimal_default)
-            }
-        else:
-            # Convert floats to Decimal for DynamoDB compatibility (nested structure)
-            output_data_decimal = convert_floats_to_decimal(output_data)
-            item = {
-                'user_id': user_id,
-                'output': output_data_decimal
-            }
+        item = build_item(user_id, output_data, use_json_string)
         
         # Put item into DynamoDB
         response = table.put_item(Item=item)
@@ -65,50 +52,233 @@ def upload_user_recommendations_to_dynamodb(user_id, output_data, table_name="Us
         print(f"Unexpected error: {e}")
         return False
 
-def upload_all_output_files_to_dynamodb(output_directory="./output", table_name="UserRecommendations", use_json_string=True):
+class BatchUploader:
+    """
+    Upload items with BatchWriteItem from a bounded pool of workers sharing one client
+
+    Items are grouped into requests of BATCH_SIZE and sent concurrently by
+    `max_workers` threads. The low-level client is thread-safe, so one client
+    serves every worker. Items DynamoDB returns as UnprocessedItems, and
+    throttled batches, are retried with exponential backoff.
+
+    Example:
+        uploader = BatchUploader("UserRecommendations", max_workers=16)
+        uploader.upload(build_item(user_id, output) for user_id, output in outputs)
+    """
+    def __init__(self, table_name="UserRecommendations", max_workers=8, client=None, region_name='us-east-1',
+                 policy=UPLOAD_RETRY_POLICY, sleep=time.sleep):
+        self.table_name = table_name
+        self.max_workers = max_workers
+        self.client = client if client is not None else boto3.client('dynamodb', region_name=region_name)
+        self.policy = policy
+        self.sleep = sleep
+        self._serializer = TypeSerializer()
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed_keys = []
+        self.retries = 0
+
+    def _put_request(self, item):
+        return {'PutRequest': {'Item': {name: self._serializer.serialize(value) for name, value in item.items()}}}
+
+    def _batches(self, items):
+        batch = []
+        for item in items:
+            batch.append(self._put_request(item))
+            if len(batch) == BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _write_batch(self, requests):
+        """
+        Send one batch, resending whatever DynamoDB leaves unprocessed
+        """
+        attempt = 0
+        while requests:
+            attempt += 1
+            try:
+                response = self.client.batch_write_item(RequestItems={self.table_name: requests})
+                written = len(requests)
+                requests = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                written -= len(requests)
+                category = resilience.THROTTLED
+            except Exception as e:
+                written = 0
+                category = resilience.classify_error(e)
+                if category == resilience.PERMANENT:
+                    print(f"✗ Batch rejected by DynamoDB: {e}")
+                    break
+            with self._lock:
+                self.written += written
+            if not requests:
+                return
+            if attempt >= self.policy.max_attempts:
+                break
+            with self._lock:
+                self.retries += 1
+            self.sleep(self.policy.delay(attempt, category))
+
+        keys = [request['PutRequest']['Item']['user_id'].get('S') for request in requests]
+        with self._lock:
+            self.failed_keys.extend(keys)
+
+    def upload(self, items):
+        """
+        Upload an iterable of items, reading it lazily
+
+        Args:
+            items (iterable): DynamoDB items as built by build_item()
+
+        Returns:
+            dict: written, failed, retries, seconds and items_per_second
+        """
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="dynamodb-upload") as executor:
+            in_flight = set()
+            for batch in self._batches(items):
+                # Keep at most two batches per worker in memory so huge inputs stream through
+                if len(in_flight) >= 2 * self.max_workers:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                in_flight.add(executor.submit(self._write_batch, batch))
+            for future in in_flight:
+                future.result()
+        seconds = time.time() - started
+        return {
+            "written": self.written,
+            "failed": len(self.failed_keys),
+            "retries": self.retries,
+            "seconds": seconds,
+            "items_per_second": self.written / seconds if seconds > 0 else 0.0,
+        }
+
+
+def print_upload_summary(stats, failed_keys=()):
+    print(f"\n--- Upload Summary ---")
+    print(f"Successfully uploaded: {stats['written']} items")
+    print(f"Errors: {stats['failed']} items")
+    if 'skipped' in stats:
+        print(f"Unchanged and skipped: {stats['skipped']} items")
+    print(f"Batch retries: {stats['retries']}")
+    print(f"Throughput: {stats['items_per_second']:,.0f} items/s over {stats['seconds']:.1f}s")
+    if failed_keys:
+        print(f"Users not uploaded: {', '.join(str(key) for key in failed_keys)}")
+
+
+def read_output_files(output_directory="./output", codec=None):
+    """
+    Yield (user_id, output) for every output_{user_id}.json or .json.zst file, reading files lazily
+
+    A user with both files (left by runs before and after switching --compress)
+    is yielded once, from the more recently written file.
+    """
+    reader = codec or OutputCodec.load()
+    latest = {}
+    for filename in os.listdir(output_directory):
+        if filename.startswith("output_") and filename.endswith((".json", COMPRESSED_SUFFIX)):
+            # Extract user ID from filename (e.g., "output_U1.json" -> "U1")
+            user_id = filename[len("output_"):].replace(COMPRESSED_SUFFIX, "").replace(".json", "")
+            modified = os.path.getmtime(os.path.join(output_directory, filename))
+            if user_id not in latest or modified > latest[user_id][0]:
+                latest[user_id] = (modified, filename)
+
+    for user_id, (_, filename) in latest.items():
+        try:
+            with tracing.span("dynamodb.read_output_file", user_id=user_id):
+                with open(os.path.join(output_directory, filename), 'rb') as f:
+                    output_data = reader.decode(f.read())
+        except Exception as e:
+            print(f"✗ Error processing {filename}: {e}")
+            continue
+        yield user_id, output_data
+
+
+def upload_outputs(outputs, table_name="UserRecommendations", use_json_string=True, max_workers=8, codec=None,
+                   store=None):
     """
-    Upload all user output JSON files to DynamoDB
+    Upload a stream of (user_id, output) pairs to DynamoDB in batches of 25
     
     Args:
-        output_directory (str): Directory containing output JSON files
+        outputs (iterable): (user_id, output) pairs, consumed lazily
         table_name (str): DynamoDB table name
         use_json_string (bool): If True, store as JSON string; if False, store as nested structure
+        max_workers (int): Batches written concurrently
+        codec (OutputCodec): If given, upload outputs as compressed Binary attributes
+        store (RunStore): If given, skip outputs whose digest matches the one last uploaded
+    
+    Returns:
+        dict: Upload statistics from BatchUploader.upload, plus the skipped count
+    """
+    uploader = BatchUploader(table_name, max_workers=max_workers)
+    destination = DynamoDBSink.destination_for(table_name, use_json_string, codec)
+    skipped = []
+    uploaded = {}
+    
+    def changed_items():
+        for user_id, output_data in outputs:
+            digest = output_digest(output_data)
+            if store is not None and store.get_output_digest(user_id, destination) == digest:
+                skipped.append(user_id)
+                continue
+            uploaded[user_id] = digest
+            yield build_item(user_id, output_data, use_json_string, codec, digest)
+    
+    stats = uploader.upload(changed_items())
+    stats["skipped"] = len(skipped)
+    if store is not None:
+        failed = set(uploader.failed_keys)
+        for user_id, digest in uploaded.items():
+            if user_id not in failed:
+                store.put_output_digest(user_id, destination, digest)
+    print_upload_summary(stats, uploader.failed_keys)
+    return stats
+
+
+@tracing.traced("dynamodb.upload_all")
+def upload_all_output_files_to_dynamodb(output_directory="./output", table_name="UserRecommendations", use_json_string=True,
+                                        max_workers=8, codec=None, store=None):
     """
-    success_count = 0
-    error_count = 0
+    Upload all user output JSON files to DynamoDB in batches of 25
     
+    Args:
+        output_directory (str): Directory containing output JSON files
+        table_name (str): DynamoDB table name
+        use_json_string (bool): If True, store as JSON string; if False, store as nested structure
+        max_workers (int): Batches written concurrently
+        codec (OutputCodec): If given, upload outputs as compressed Binary attributes
+        store (RunStore): If given, skip outputs whose digest matches the one last uploaded
+    
+    Returns:
+        dict: Upload statistics from upload_outputs
+    """
     # Check if output directory exists
     if not os.path.exists(output_directory):
         print(f"Output directory {output_directory} does not exist")
         return
     
-    # Process all JSON files in the output directory
-    for filename in os.listdir(output_directory):
-        if filename.startswith("output_") and filename.endswith(".json"):
-            # Extract user ID from filename (e.g., "output_U1.json" -> "U1")
-            user_id = filename.replace("output_", "").replace(".json", "")
-            
-            try:
-                # Read the JSON file
-                file_path = os.path.join(output_directory, filename)
-                with open(file_path, 'r') as f:
-                    output_data = json.load(f)
-                
-                # Upload to DynamoDB
-                if upload_user_recommendations_to_dynamodb(user_id, output_data, table_name, use_json_string):
-                    success_count += 1
-                    print(f"✓ Uploaded {filename}")
-                else:
-                    error_count += 1
-                    print(f"✗ Failed to upload {filename}")
-                    
-            except Exception as e:
-                error_count += 1
-                print(f"✗ Error processing {filename}: {e}")
+    return upload_outputs(read_output_files(output_directory, codec), table_name, use_json_string, max_workers,
+                          codec, store)
+
+
+@tracing.traced("dynamodb.upload_artifact")
+def upload_run_artifact_to_dynamodb(artifact_directory, table_name="UserRecommendations", use_json_string=True,
+                                    max_workers=8, codec=None, store=None):
+    """
+    Stream a run artifact (see run_artifact.py) into DynamoDB in batches of 25
     
-    print(f"\n--- Upload Summary ---")
-    print(f"Successfully uploaded: {success_count} files")
-    print(f"Errors: {error_count} files")
+    Args:
+        artifact_directory (str): Directory written by RunArtifactWriter
+        (other arguments as in upload_outputs)
+    
+    Returns:
+        dict: Upload statistics from upload_outputs
+    """
+    artifact = RunArtifact(artifact_directory, codec)
+    print(f"Uploading {len(artifact)} outputs from {artifact_directory}")
+    return upload_outputs(artifact, table_name, use_json_string, max_workers, codec, store)
 
 def upload_single_user_output(user_id, output_file_path, table_name="UserRecommendations", use_json_string=True):
     """
@@ -141,9 +311,26 @@ def upload_single_user_output(user_id, output_file_path, table_name="UserRecomme
         return False
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload pipeline outputs to DynamoDB")
+    parser.add_argument("--artifact", metavar="DIR", help="upload a run artifact instead of output/output_*.json")
+    parser.add_argument("--table", default="UserRecommendations", help="DynamoDB table name")
+    parser.add_argument("--trace", nargs="?", const="logs/upload_trace.json", default=None, metavar="PATH",
+                        help="record a Chrome trace of the upload (default logs/upload_trace.json); "
+                             "open it in chrome://tracing or ui.perfetto.dev")
+    args = parser.parse_args()
+    
     # Upload all output files to DynamoDB
     print("Starting upload to DynamoDB...")
-    upload_all_output_files_to_dynamodb()
+    tracer = tracing.Tracer(args.trace) if args.trace else None
+    tracing.set_tracer(tracer)
+    try:
+        if args.artifact:
+            upload_run_artifact_to_dynamodb(args.artifact, args.table, store=RunStore())
+        else:
+            upload_all_output_files_to_dynamodb(table_name=args.table, store=RunStore())
+    finally:
+        if tracer:
+            tracer.close()
     
     # Example: Upload a specific user's file
     # upload_single_user_output("U1", "./output/output_U1.json")